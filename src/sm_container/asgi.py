@@ -0,0 +1,247 @@
+"""An ASGI entry point for serving the summarizer with async workers, e.g., uvicorn workers under gunicorn.
+
+Unlike the Flask app in wsgi.py, a request here does not hold an OS thread while waiting for the OpenAI API, so a
+single worker process can keep many chunk requests in flight.
+"""
+import re
+import json
+import time
+import asyncio
+import traceback
+from typing import Dict, Iterator, Optional
+from urllib.parse import parse_qs
+from summarizer.model.admission import Overloaded
+from summarizer import metrics
+from summarizer.metrics import DECODE_SECONDS, ENCODE_SECONDS, REQUEST_SECONDS
+from summarizer.dao.job_store import SUCCEEDED
+from summarizer_service import SummarizerService, JobRunner, TEXT_FIELD, SUMMARY_FIELD, DOC_ID_FIELD, \
+    TARGET_TOKENS_FIELD, NDJSON_MIMETYPE, TEXT_MIMETYPE, JSONL_MIMETYPES, JOB_QUEUE_FULL_HEADERS, is_stream_request, \
+    job_documents, retry_after_header, target_tokens_error, logger
+
+ROUTES = ("/ping", "/invocations", "/metrics", "/jobs")
+"""The routes served without path parameters, used as metric labels as they are."""
+JOB_PATH = re.compile(r"/jobs/(?P<job_id>[^/]+)(?P<result>/result)?")
+"""The routes of a job, labelled by their Flask url rule in the metrics, so that job ids are not labels."""
+
+# Imported once by the gunicorn master with --preload, so the workers share the tokenizers, see serve.
+SummarizerService.preload()
+
+
+async def app(scope, receive, send):
+    """Serve /ping, /invocations, /metrics and /jobs, mirroring the Flask routes in summarizer_service."""
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+
+    path = scope["path"]
+    method = scope["method"]
+    start = time.perf_counter()
+
+    job_match = JOB_PATH.fullmatch(path)
+    if path in ROUTES:
+        route = path
+    elif job_match:
+        route = "/jobs/<job_id>/result" if job_match.group("result") else "/jobs/<job_id>"
+    else:
+        route = "unmatched"
+
+    async def send_observed(message):
+        if message["type"] == "http.response.start":
+            REQUEST_SECONDS.labels(route, method, str(message["status"])).observe(time.perf_counter() - start)
+        await send(message)
+
+    if path == "/ping" and method == "GET":
+        # Initializing the summarizer loads files and opens SQLite, so it does not run on the event loop.
+        health = await asyncio.get_running_loop().run_in_executor(None, SummarizerService.warm_up)
+        await respond(send_observed, 200 if health else 404, "\n", "application/json")
+    elif path == "/invocations" and method == "POST":
+        await summarization(scope, receive, send_observed)
+    elif path == "/metrics" and method == "GET":
+        body, content_type = metrics.latest()
+        await respond(send_observed, 200, body.decode("utf-8"), content_type)
+    elif path == "/jobs" and method == "POST":
+        await submit_job(scope, receive, send_observed)
+    elif job_match and method == "GET":
+        await job_status(send_observed, job_match.group("job_id"), bool(job_match.group("result")))
+    else:
+        await respond(send_observed, 404, "{}", "application/json")
+
+
+async def lifespan(receive, send):
+    """Handle the ASGI lifespan protocol, warming up the summarizer before accepting requests."""
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            SummarizerService.warm_up()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await SummarizerService.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def summarization(scope, receive, send):
+    """Run SummarizationService on the given text. See summarizer_service.summarization for the contract."""
+    headers = dict(scope["headers"])
+    content_type = headers.get(b"content-type", b"").decode("latin-1")
+    if content_type.split(";")[0].strip() == TEXT_MIMETYPE:
+        await summarize_text_stream(scope, receive, send, content_type)
+        return
+    if content_type != "application/json":
+        await respond(send, 415, "Invalid request data type, only json and plain text are supported.", "text/plain")
+        return
+
+    try:
+        payload: str = (await read_body(receive)).decode("utf-8")
+        with DECODE_SECONDS.time():
+            data_dict: Dict = json.loads(payload)
+        if TEXT_FIELD not in data_dict:
+            logger.error(f"The request must contain '{TEXT_FIELD}' field!")
+            await respond(send, 400, f"The request must contain '{TEXT_FIELD}' field", "text/plain")
+        else:
+            text = data_dict[TEXT_FIELD]
+            doc_id = data_dict.get("doc_id", "n/a")
+            target_tokens = data_dict.get(TARGET_TOKENS_FIELD)
+            stream_response = is_stream_request(data_dict, headers.get(b"accept", b"").decode("latin-1"))
+            error = target_tokens_error(target_tokens, stream_response)
+            if error:
+                logger.error(error)
+                await respond(send, 400, error, "text/plain")
+                return
+            logger.info(f"Summarizing text length: {len(text)} of document: {doc_id}")
+            async with SummarizerService.aadmit(len(text)):
+                if stream_response:
+                    await stream(send, SummarizerService.astream_summary(text, doc_id))
+                    return
+                summary = await SummarizerService.asummarize(text, doc_id, target_tokens)
+            with ENCODE_SECONDS.time():
+                resp_json = json.dumps({SUMMARY_FIELD: summary})
+            await respond(send, 200, resp_json, "application/json")
+    except Overloaded as ex:
+        logger.warning(f"Rejected document: {data_dict.get('doc_id', 'n/a')}: {ex}")
+        await respond(send, ex.status, str(ex), "text/plain", retry_after_header(ex))
+    except Exception as ex:
+        err_msg = f"Algorithm error: {type(ex)}; message: {ex.args}; error: {traceback.format_exc()}"
+        logger.error(err_msg)
+        await respond(send, 500, err_msg, "text/plain")
+
+
+async def summarize_text_stream(scope, receive, send, content_type: str):
+    """Summarize the text/plain body of the request, chunking it while it is received. See summarize_text_stream of
+    summarizer_service."""
+    args = {name: values[-1] for name, values in parse_qs(scope["query_string"].decode("latin-1")).items()}
+    doc_id = args.get(DOC_ID_FIELD, "n/a")
+    target_tokens = args.get(TARGET_TOKENS_FIELD)
+    if target_tokens is not None and target_tokens.lstrip("-").isdigit():
+        target_tokens = int(target_tokens)
+    error = target_tokens_error(target_tokens, False)
+    if error:
+        logger.error(error)
+        await respond(send, 400, error, "text/plain")
+        return
+    params = dict(param.strip().partition("=")[::2] for param in content_type.split(";")[1:])
+    encoding = params.get("charset", "utf-8").strip('"')
+    content_length = dict(scope["headers"]).get(b"content-length")
+    num_of_chars = int(content_length) if content_length else None
+    try:
+        logger.info(f"Summarizing text stream of length: {num_of_chars} of document: {doc_id}")
+        # A byte is about a character, and a body of unknown length is admitted as the costliest request.
+        async with SummarizerService.aadmit(num_of_chars):
+            body = iter_body(receive, asyncio.get_running_loop())
+            summary = await SummarizerService.asummarize_stream(body, doc_id, target_tokens, encoding)
+        with ENCODE_SECONDS.time():
+            resp_json = json.dumps({SUMMARY_FIELD: summary})
+        await respond(send, 200, resp_json, "application/json")
+    except Overloaded as ex:
+        logger.warning(f"Rejected text stream of document: {doc_id}: {ex}")
+        await respond(send, ex.status, str(ex), "text/plain", retry_after_header(ex))
+    except Exception as ex:
+        err_msg = f"Algorithm error: {type(ex)}; message: {ex.args}; error: {traceback.format_exc()}"
+        logger.error(err_msg)
+        await respond(send, 500, err_msg, "text/plain")
+
+
+async def submit_job(scope, receive, send):
+    """Submit a summarization job, to be run in the background by the JobRunner of the worker. See submit_job of
+    summarizer_service for the contract."""
+    content_type = dict(scope["headers"]).get(b"content-type", b"").decode("latin-1")
+    if content_type != "application/json" and content_type not in JSONL_MIMETYPES:
+        await respond(send, 415, "Invalid request data type, only json and json lines are supported.", "text/plain")
+        return
+    try:
+        documents = job_documents((await read_body(receive)).decode("utf-8"), content_type != "application/json")
+    except ValueError as ex:
+        await respond(send, 400, str(ex), "text/plain")
+        return
+
+    # The job store is SQLite, so it is not used on the event loop.
+    job_id = await asyncio.get_running_loop().run_in_executor(None, JobRunner.submit, documents)
+    if job_id is None:
+        await respond(send, 503, "The job queue is full.", "text/plain", JOB_QUEUE_FULL_HEADERS)
+        return
+    await respond(send, 202, json.dumps({"job_id": job_id}), "application/json", {"Location": f"/jobs/{job_id}"})
+
+
+async def job_status(send, job_id: str, result: bool):
+    """Send the status of a job, or (if result) its summaries. See job_status and job_result of summarizer_service."""
+    loop = asyncio.get_running_loop()
+    store = await loop.run_in_executor(None, JobRunner.get_store)
+    job = await loop.run_in_executor(None, store.get, job_id)
+    if job is None:
+        await respond(send, 404, f"Unknown job: {job_id}", "text/plain")
+    elif not result:
+        await respond(send, 200, json.dumps(job), "application/json")
+    elif job["status"] != SUCCEEDED:
+        await respond(send, 409, json.dumps(job), "application/json")
+    else:
+        doc_sums = await loop.run_in_executor(None, store.result, job_id)
+        await respond(send, 200, "".join(json.dumps(doc_sum) + "\n" for doc_sum in doc_sums), "application/jsonlines")
+
+
+def iter_body(receive, loop: asyncio.AbstractEventLoop) -> Iterator[bytes]:
+    """Iterate the request body a message at a time, receiving it on the given event loop, from another thread, e.g.,
+    while the body is chunked on the loop's default executor."""
+    more_body = True
+    while more_body:
+        message = asyncio.run_coroutine_threadsafe(receive(), loop).result()
+        if message["type"] == "http.disconnect":
+            raise RuntimeError("The client disconnected before the end of the request body.")
+        yield message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+
+async def read_body(receive) -> bytes:
+    """Read the whole request body."""
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+
+async def respond(send, status: int, body: str, mimetype: str, headers: Optional[Dict[str, str]] = None):
+    """Send a complete response, with the given extra headers."""
+    body_bytes = body.encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", mimetype.encode("latin-1")),
+            (b"content-length", str(len(body_bytes)).encode("latin-1")),
+        ] + [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in (headers or {}).items()],
+    })
+    await send({"type": "http.response.body", "body": body_bytes})
+
+
+async def stream(send, records):
+    """Send a NDJSON response, a body part per record."""
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", NDJSON_MIMETYPE.encode("latin-1")), (b"x-accel-buffering", b"no")],
+    })
+    async for record in records:
+        await send({"type": "http.response.body", "body": record.encode("utf-8"), "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
@@ -2,18 +2,72 @@
 import os
 import sys
 import json
+import math
+import time
+import uuid
 import threading
 import traceback
 import flask
 import logging
-from typing import Dict
-from summarizer.model.summarizer import SummarizerFactory, TextSummarizer
+from dataclasses import asdict
+from contextlib import ExitStack, asynccontextmanager, contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+from summarizer.model import gpt3_config
+from summarizer.model.summarizer import SummarizerFactory, TextSummarizer, ChunkSummary
+from summarizer.dao.job_store import JobStore, SUCCEEDED
+from summarizer.model.token_counter import TOKEN_COUNTER
+from summarizer.dao.chunker import Chunk, sentence_spans
+from summarizer.model.single_flight import SingleFlight, content_key
+from summarizer.model.admission import AdmissionController, Overloaded, estimate_cost
+from summarizer import metrics
+from summarizer.metrics import DECODE_SECONDS, ENCODE_SECONDS, REQUEST_SECONDS
 
 prefix = "/opt/ml/"
 model_path = os.path.join(prefix, "model")
 
 TEXT_FIELD = "text"
+DOC_ID_FIELD = "doc_id"
 SUMMARY_FIELD = "summary"
+TARGET_TOKENS_FIELD = "target_tokens"
+STREAM_FIELD = "stream"
+
+TEXT_MIMETYPE = "text/plain"
+NDJSON_MIMETYPE = "application/x-ndjson"
+JSONL_MIMETYPES = ("application/jsonlines", "application/jsonl", NDJSON_MIMETYPE)
+JOB_QUEUE_FULL_HEADERS = {"Retry-After": "30"}
+"""The headers of a job submission rejected because the job queue of the worker is full."""
+
+summarizer_type = os.environ.get("SUMMARIZER_TYPE", "gpt3")
+"""The summarizer of the chunks, e.g., "extractive" for a local degraded mode, when the OpenAI API is unavailable."""
+summarizer_workers = int(os.environ.get("SUMMARIZER_WORKERS", 8))
+"""The number of chunks of a request summarized concurrently."""
+balanced_chunks = os.environ.get("BALANCED_CHUNKS", "false").lower() in ("1", "true", "yes")
+"""Whether a request is chunked into the least chunks of even sizes, rather than greedily."""
+coalesce_ttl = float(os.environ.get("COALESCE_TTL", 60))
+"""The seconds a document or chunk summary is served to duplicate requests, which are coalesced while in flight."""
+shrink_tokens = int(os.environ.get("SHRINK_TOKENS", 0))
+"""The tokens a larger text is shrunk to, extractively, before its chunks are summarized, see TextSummarizer. Zero
+never shrinks a text."""
+summary_cache_file = os.environ.get("SUMMARY_CACHE_FILE")
+"""An optional SQLite file caching chunk summaries, shared by the workers."""
+job_store_file = os.environ.get("JOB_STORE_FILE", "/tmp/summarizer-jobs.sqlite")
+"""The SQLite file storing the jobs, shared by the workers."""
+job_workers = int(os.environ.get("JOB_WORKERS", 2))
+"""The number of jobs run concurrently by a worker."""
+job_queue_size = int(os.environ.get("JOB_QUEUE_SIZE", 64))
+"""The maximum number of jobs queued or running in a worker, beyond which job submissions are rejected."""
+job_lease_seconds = float(os.environ.get("JOB_LEASE_SECONDS", 60))
+"""The seconds after which the unfinished jobs of a worker that stopped renewing its lease are resumed by another."""
+admission_token_budget = int(os.environ.get("ADMISSION_TOKEN_BUDGET", gpt3_config.tokens_per_minute))
+"""The estimated tokens of the requests summarized at a time by the container, split evenly between its workers, see
+AdmissionController. By default, a minute of the OpenAI rate limit. Zero admits every request."""
+admission_queue_size = int(os.environ.get("ADMISSION_QUEUE_SIZE", 64))
+"""The maximum number of requests waiting for admission in a worker, beyond which requests are rejected with 503."""
+admission_max_wait = float(os.environ.get("ADMISSION_MAX_WAIT", 30))
+"""The seconds a request waits for admission, before it is rejected with 429."""
+model_server_workers = int(os.environ.get("MODEL_SERVER_WORKERS", 1))
+"""The number of worker processes of the container, set by serve."""
 
 logging.basicConfig(
     stream=sys.stdout,
@@ -22,7 +76,6 @@ logging.basicConfig(
     datefmt="%Y-%m-%d %H:%M:%S",
 )
 logger = logging.getLogger(__name__)
-pid = os.getpid()
 
 
 class SummarizerService(object):
@@ -30,6 +83,10 @@ class SummarizerService(object):
 
     _summarizer: TextSummarizer = None  # Where we keep the summarizer
     _lock = threading.Lock()
+    _documents = SingleFlight(coalesce_ttl)  # The summaries of the documents in flight or recently summarized
+    _admission = AdmissionController(
+        max(1, admission_token_budget // model_server_workers), admission_queue_size, admission_max_wait
+    ) if admission_token_budget > 0 else None
 
     @classmethod
     def get_summarizer(cls):
@@ -37,37 +94,355 @@ class SummarizerService(object):
         if cls._summarizer is None:
             with cls._lock:
                 if not cls._summarizer:
-                    cls._summarizer = TextSummarizer(SummarizerFactory.create_summarizer("gpt3"))
-                    logger.info(f"Process id: {pid} - Initialized Summarizer!")
+                    cls._summarizer = TextSummarizer(
+                        SummarizerFactory.create_summarizer(summarizer_type, summary_cache_file, coalesce_ttl),
+                        summarizer_workers,
+                        balanced_chunks,
+                        shrink_tokens
+                    )
+                    logger.info(f"Process id: {os.getpid()} - Initialized Summarizer!")
         return cls._summarizer
 
     @classmethod
-    def summarize(cls, long_text: str, doc_id: str) -> str:
-        """For the given long text, summarize it.
+    def warm_up(cls) -> bool:
+        """Initialize the summarizer and load the tokenizer, so that the first request does not pay for them. Open the
+        job store, which resumes the orphaned jobs in the background, see JobRunner.get_store."""
+        summarizer = cls.get_summarizer()
+        TOKEN_COUNTER.warm_up()
+        JobRunner.get_store()
+        return summarizer is not None
+
+    @classmethod
+    def preload(cls):
+        """Load the tokenizers before gunicorn forks the workers (--preload), so that they share them copy-on-write.
+
+        Unlike warm_up, it opens no connection, thread or file, none of which may be shared by the workers.
+        """
+        TOKEN_COUNTER.warm_up()
+        list(sentence_spans("Load the sentence tokenizer."))
+
+    @classmethod
+    def estimate_cost(cls, num_of_chars: Optional[int]) -> int:
+        """Return the estimated tokens spent on summarizing a text of the given length, the whole budget if unknown."""
+        if num_of_chars is None:
+            return admission_token_budget
+        summarizer = cls.get_summarizer().summarizer
+        return estimate_cost(num_of_chars, summarizer.text_tokens, summarizer.summary_tokens)
+
+    @classmethod
+    @contextmanager
+    def admit(cls, num_of_chars: Optional[int]) -> Iterator[None]:
+        """Hold the admission of a request to summarize a text of the given length while the block runs, waiting for
+        it if the worker is busy. Raise Overloaded if the request is rejected, see AdmissionController."""
+        if cls._admission is None:
+            yield
+            return
+        with cls._admission.admit(cls.estimate_cost(num_of_chars)):
+            yield
+
+    @classmethod
+    @asynccontextmanager
+    async def aadmit(cls, num_of_chars: Optional[int]) -> AsyncIterator[None]:
+        """Hold the admission of a request while the block runs on the event loop. See admit."""
+        if cls._admission is None:
+            yield
+            return
+        async with cls._admission.aadmit(cls.estimate_cost(num_of_chars)):
+            yield
+
+    @classmethod
+    def summarize(cls, long_text: str, doc_id: str, target_tokens: int = None) -> str:
+        """For the given long text, summarize it. Concurrent requests of the same text and target_tokens are summarized
+        once, see SingleFlight.
 
         Args:
             long_text (str): The long text that needs to be summarized.
             doc_id (str): Document id or text id or chapter id
+            target_tokens (int): If given, the summary is summarized again, level by level, until it fits.
 
         Returns:
             summary_text (str): summary of the long text.
             """
         summarizer = cls.get_summarizer()
-        return summarizer.summarize_text(long_text, doc_id)
+        return cls._documents.do(
+            content_key(long_text, target_tokens), lambda: summarizer.summarize_text(long_text, doc_id, target_tokens)
+        )
+
+    @classmethod
+    def summarize_stream(cls, stream, doc_id: str, target_tokens: int = None, encoding: str = "utf-8") -> str:
+        """For the long text read incrementally from the given byte stream, summarize it. See summarize."""
+        summarizer = cls.get_summarizer()
+        return summarizer.summarize_stream(stream, doc_id, target_tokens, encoding)
+
+    @classmethod
+    async def asummarize(cls, long_text: str, doc_id: str, target_tokens: int = None) -> str:
+        """For the given long text, summarize it on the running event loop. See summarize."""
+        summarizer = cls.get_summarizer()
+        return await cls._documents.ado(
+            content_key(long_text, target_tokens), lambda: summarizer.asummarize_text(long_text, doc_id, target_tokens)
+        )
+
+    @classmethod
+    async def asummarize_stream(cls, stream, doc_id: str, target_tokens: int = None, encoding: str = "utf-8") -> str:
+        """For the long text read incrementally from the given byte stream, summarize it on the running event loop.
+        See summarize_stream."""
+        summarizer = cls.get_summarizer()
+        return await summarizer.asummarize_stream(stream, doc_id, target_tokens, encoding)
+
+    @classmethod
+    async def aclose(cls):
+        """Close the connections to the OpenAI API opened on the running event loop, e.g., on shutdown."""
+        summarizer = cls._summarizer.summarizer if cls._summarizer else None
+        while summarizer is not None and not hasattr(summarizer, "http_client"):
+            summarizer = getattr(summarizer, "summarizer", None)  # The summarizer of a caching or coalescing one
+        http_client = getattr(summarizer, "http_client", None)
+        if http_client:
+            await http_client.aclose()
+
+    @classmethod
+    def stream_summary(cls, long_text: str, doc_id: str) -> Iterator[str]:
+        """For the given long text, yield a NDJSON record per chunk summary as soon as it is ready.
+
+        The last record holds the summary of the whole text, or the error if the summarization failed midway.
+        """
+        start = time.perf_counter()
+        chunk_sums: Dict[int, str] = {}
+        try:
+            for chunk_sum in cls.get_summarizer().iter_chunk_summaries(long_text, doc_id):
+                chunk_sums[chunk_sum.chunk_id] = chunk_sum.summary
+                yield chunk_record(chunk_sum)
+            yield final_record(chunk_sums, time.perf_counter() - start)
+        except Exception as ex:
+            yield error_record(ex)
+
+    @classmethod
+    async def astream_summary(cls, long_text: str, doc_id: str) -> AsyncIterator[str]:
+        """For the given long text, yield NDJSON records on the running event loop. See stream_summary."""
+        start = time.perf_counter()
+        chunk_sums: Dict[int, str] = {}
+        try:
+            async for chunk_sum in cls.get_summarizer().aiter_chunk_summaries(long_text, doc_id):
+                chunk_sums[chunk_sum.chunk_id] = chunk_sum.summary
+                yield chunk_record(chunk_sum)
+            yield final_record(chunk_sums, time.perf_counter() - start)
+        except Exception as ex:
+            yield error_record(ex)
+
+
+class JobLost(RuntimeError):
+    """A job claimed by another worker while this one was running it, e.g., after this worker missed its lease."""
+
+
+class JobRunner(object):
+    """A singleton class for running summarization jobs in the background, storing them in a JobStore."""
+
+    _store: JobStore = None
+    _owner: str = None  # The token owning the jobs of this worker, unlike a pid unique across restarts
+    _executor: ThreadPoolExecutor = None
+    _slots = threading.BoundedSemaphore(job_queue_size)  # Free places in the queue of this worker
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_store(cls) -> JobStore:
+        """Open the job store and start the job executor if they are not already initialized.
+
+        Also start the thread renewing the lease of the jobs of this worker, and resuming the orphaned jobs of the
+        others, a third of the lease apart.
+        """
+        if cls._store is None:
+            with cls._lock:
+                if cls._store is None:
+                    cls._executor = ThreadPoolExecutor(max_workers=job_workers)
+                    cls._owner = uuid.uuid4().hex
+                    cls._store = JobStore(job_store_file, job_lease_seconds)
+                    threading.Thread(
+                        target=cls._keep_lease, args=(cls._store, cls._owner), name="job-lease", daemon=True
+                    ).start()
+                    logger.info(f"Process id: {os.getpid()} - Initialized job store: {job_store_file}, "
+                                f"owner: {cls._owner}")
+        return cls._store
+
+    @classmethod
+    def submit(cls, documents: List[Dict]) -> Optional[str]:
+        """Store a job of the given documents and queue it. Return the job id, or None if the queue is full."""
+        store = cls.get_store()
+        if not cls._slots.acquire(blocking=False):
+            return None
+        job_id = store.create(documents, cls._owner)
+        cls._executor.submit(cls._run, job_id)
+        logger.info(f"Process id: {os.getpid()} - Queued job: {job_id} of {len(documents)} documents.")
+        return job_id
+
+    @classmethod
+    def resume_orphans(cls):
+        """Queue the unfinished jobs whose lease has expired, as long as there are free places in the queue."""
+        store = cls.get_store()
+        while cls._slots.acquire(blocking=False):
+            job_ids = store.claim_orphans(cls._owner, limit=1)
+            if not job_ids:
+                cls._slots.release()
+                return
+            cls._executor.submit(cls._run, job_ids[0])
+
+    @classmethod
+    def _keep_lease(cls, store: JobStore, owner: str):
+        """Renew the lease of the jobs of this worker and resume the orphaned jobs, until the worker exits."""
+        while True:
+            try:
+                store.renew(owner)
+                cls.resume_orphans()
+            except Exception as ex:
+                logger.error(f"Process id: {os.getpid()} - Failed to renew the job lease: {ex}")
+            time.sleep(job_lease_seconds / 3)
+
+    @classmethod
+    def _admitted(cls, job_id: str, num_of_chars: int) -> ExitStack:
+        """Return the admission of a document of the given job, held until the returned stack is closed. A job has no
+        client to answer with Retry-After, so a rejected document waits for that long and asks again."""
+        while True:
+            admission = ExitStack()
+            try:
+                admission.enter_context(SummarizerService.admit(num_of_chars))
+                return admission
+            except Overloaded as ex:
+                logger.info(f"Process id: {os.getpid()} - Job: {job_id} waits {ex.retry_after:.1f}s for admission.")
+                time.sleep(ex.retry_after)
+
+    @classmethod
+    def _run(cls, job_id: str):
+        """Summarize the documents of the given job, recording the progress chunk by chunk.
+
+        Each document is shrunk, admitted and chunked while it is summarized, as a request of /invocations, so the
+        chunks total grows as the documents are chunked. Stop as soon as the job is owned by another worker, i.e., an
+        update of the job updates nothing.
+        """
+        store, owner = cls._store, cls._owner
+        chunks_total = 0
+
+        def counted(chunks: Iterator[Chunk]) -> Iterator[Chunk]:
+            nonlocal chunks_total
+            for chunk in chunks:
+                chunks_total += 1
+                yield chunk
+
+        try:
+            summarizer = SummarizerService.get_summarizer()
+            documents = store.documents(job_id)
+            if not store.start(job_id, owner, 0):
+                raise JobLost(job_id)
+
+            chunks_done = 0
+            result = []
+            for document in documents:
+                doc_id = document.get(DOC_ID_FIELD, "n/a")
+                text = summarizer.shrink_text(document[TEXT_FIELD], doc_id)
+                chunk_sums: Dict[int, str] = {}
+                with cls._admitted(job_id, len(text)):
+                    chunks = counted(summarizer.chunker.chunk_generator_from_text(text, doc_id))
+                    for chunk_sum in summarizer.iter_summaries(chunks):
+                        chunk_sums[chunk_sum.chunk_id] = chunk_sum.summary
+                        chunks_done += 1
+                        if not store.progress(job_id, owner, chunks_done, chunks_total):
+                            raise JobLost(job_id)
+                summary = " ".join(chunk_sums[chunk_id] for chunk_id in sorted(chunk_sums))
+                result.append({DOC_ID_FIELD: doc_id, SUMMARY_FIELD: summary})
+            if not store.succeed(job_id, owner, result):
+                raise JobLost(job_id)
+            logger.info(f"Process id: {os.getpid()} - Finished job: {job_id}")
+        except JobLost:
+            logger.warning(f"Process id: {os.getpid()} - Stopped job: {job_id}, claimed by another worker.")
+        except Exception as ex:
+            err_msg = f"Algorithm error: {type(ex)}; message: {ex.args}; error: {traceback.format_exc()}"
+            logger.error(err_msg)
+            store.fail(job_id, owner, err_msg)
+        finally:
+            cls._slots.release()
+
+
+def chunk_record(chunk_sum: ChunkSummary) -> str:
+    """Return the NDJSON record of a chunk summary."""
+    return json.dumps(asdict(chunk_sum)) + "\n"
+
+
+def final_record(chunk_sums: Dict[int, str], seconds: float) -> str:
+    """Return the NDJSON record of the whole summary, joining the chunk summaries in chunk id order."""
+    summary = " ".join(chunk_sums[chunk_id] for chunk_id in sorted(chunk_sums))
+    return json.dumps({SUMMARY_FIELD: summary, "num_of_chunks": len(chunk_sums), "seconds": seconds}) + "\n"
+
+
+def error_record(ex: Exception) -> str:
+    """Return the NDJSON record of an error raised after the response has started."""
+    err_msg = f"Algorithm error: {type(ex)}; message: {ex.args}; error: {traceback.format_exc()}"
+    logger.error(err_msg)
+    return json.dumps({"error": err_msg}) + "\n"
+
+
+def retry_after_header(ex: Overloaded) -> Dict[str, str]:
+    """Return the Retry-After header of a request rejected by admission control, in whole seconds."""
+    return {"Retry-After": str(math.ceil(ex.retry_after))}
+
+
+def job_documents(payload: str, jsonl: bool) -> List[Dict]:
+    """Return the documents of a job request, of a JSON object or (if jsonl) of JSON Lines of objects, with their text
+    and doc_id fields only. Raise ValueError if the payload is not such documents."""
+    try:
+        if jsonl:
+            documents = [json.loads(line) for line in payload.splitlines() if line.strip()]
+        else:
+            documents = [json.loads(payload)]
+    except ValueError as ex:
+        raise ValueError(f"Invalid JSON: {ex}") from ex
+    if not documents or not all(isinstance(doc, dict) and isinstance(doc.get(TEXT_FIELD), str) for doc in documents):
+        raise ValueError(f"Each document must be an object with a '{TEXT_FIELD}' string field")
+    return [{TEXT_FIELD: doc[TEXT_FIELD], DOC_ID_FIELD: doc.get(DOC_ID_FIELD, "n/a")} for doc in documents]
+
+
+def target_tokens_error(target_tokens, stream: bool) -> Optional[str]:
+    """Return why the given target_tokens of a request is invalid, or None if it is absent or a positive integer.
+
+    A streamed response has no reduced summary: its chunk summaries are sent as soon as they are ready.
+    """
+    if target_tokens is None:
+        return None
+    if isinstance(target_tokens, bool) or not isinstance(target_tokens, int) or target_tokens <= 0:
+        return f"'{TARGET_TOKENS_FIELD}' must be a positive integer, got: {target_tokens!r}"
+    if stream:
+        return f"'{TARGET_TOKENS_FIELD}' is not supported by streamed responses"
+    return None
+
+
+def is_stream_request(data_dict: Dict, accept: str) -> bool:
+    """Return True if the client asked for a NDJSON stream, by the 'stream' field or by the Accept header."""
+    return bool(data_dict.get(STREAM_FIELD)) or NDJSON_MIMETYPE in (accept or "")
 
 
 # The flask app for serving predictions
 app = flask.Flask(__name__)
-app.logger.info(f"Process id: {pid} - Importing Summarizer Service.")
+app.logger.info(f"Process id: {os.getpid()} - Importing Summarizer Service.")
+
+
+@app.before_request
+def start_request_timer():
+    flask.g.request_start = time.perf_counter()
+
+
+@app.after_request
+def observe_request(response: flask.Response) -> flask.Response:
+    """Observe the seconds spent on the request, by route rather than path, so that job ids are not labels."""
+    rule = flask.request.url_rule
+    REQUEST_SECONDS.labels(rule.rule if rule else "unmatched", flask.request.method, str(response.status_code)) \
+        .observe(time.perf_counter() - flask.g.request_start)
+    return response
 
 
 @app.route('/ping', methods=['GET'])
 def ping():
     """Determine if the container is working and healthy.
 
-    In this sample container, we declare it healthy if we can initialize the model successfully.
+    In this sample container, we declare it healthy if we can initialize the model and load the tokenizer
+    successfully.
     """
-    health = SummarizerService.get_summarizer() is not None
+    health = SummarizerService.warm_up()
     status = 200 if health else 404
     return flask.Response(response='\n', status=status, mimetype='application/json')
 
@@ -77,36 +452,49 @@ def summarization():
     """Run SummarizationService on the given text.
 
     Request type: POST
-    Request body: A JSON object that contains 'text' field.
+    Request body: A JSON object that contains 'text' field, and optionally 'doc_id' and 'target_tokens' fields.
+        Or the text itself as text/plain, with optional 'doc_id' and 'target_tokens' query parameters. The text is
+        then chunked while it is read, so very large texts are not held in memory. 'target_tokens' is a positive
+        integer, and is not supported by streamed (NDJSON) responses.
     Response:
         200 OK - Success.
         A JSON object that contains 'summary' filed.
+        If the request has '"stream": true' or accepts application/x-ndjson, NDJSON records of each chunk summary
+        ('chunk_id', 'num_of_tokens', 'summary', 'seconds') as soon as they are ready, and a last record that
+        contains 'summary' field (or 'error' field if the summarization failed after the response started).
 
         415 Unsupported Media Type - Fail.
-        This endpoint only supports application/json data
+        This endpoint only supports application/json and text/plain data
 
         400 Bad Request - Fail.
-        Failed to decode given CasePair JSON. Provide a valid JSON encoded CasePair.
+        Failed to decode given CasePair JSON. Provide a valid JSON encoded CasePair. Or an invalid 'target_tokens'.
 
         422 Unprocessable Entity - Fail.
         The given input is in the expected format but lacks enough attributes.
 
+        429 Too Many Requests / 503 Service Unavailable - Fail.
+        The worker is saturated: the request waited too long for admission (429), or too many requests are waiting
+        (503). Retry after the Retry-After seconds. Smaller texts are admitted first, see AdmissionController.
+
         500 Internal Server Error - Fail.
         Algorithm error - The algorithm fails to process the request, please check the error message/stack trace.
         Please note that the load balancer/web server also sends 500's errors. Search for "Algorithm error:" in the
         error message to get machine-learning algorithm error.
     """
+    if flask.request.mimetype == TEXT_MIMETYPE:
+        return summarize_text_stream()
     if flask.request.content_type == 'application/json':
         payload: str = flask.request.data.decode('utf-8')
     else:
         return flask.Response(
-            response='Invalid request data type, only json is supported.',
+            response='Invalid request data type, only json and plain text are supported.',
             status=415,
             mimetype='text/plain'
         )
 
     try:
-        data_dict: Dict = json.loads(payload)
+        with DECODE_SECONDS.time():
+            data_dict: Dict = json.loads(payload)
         if TEXT_FIELD not in data_dict:
             app.logger.error(f"The request must contain '{TEXT_FIELD}' field!")
             return flask.Response(
@@ -114,17 +502,148 @@ def summarization():
             )
         else:
             text = data_dict[TEXT_FIELD]
-            doc_id = data_dict.get("doc_id", "n/a")
+            doc_id = data_dict.get(DOC_ID_FIELD, "n/a")
+            target_tokens = data_dict.get(TARGET_TOKENS_FIELD)
+            stream = is_stream_request(data_dict, flask.request.headers.get("Accept"))
+            error = target_tokens_error(target_tokens, stream)
+            if error:
+                app.logger.error(error)
+                return flask.Response(response=error, status=400, mimetype="text/plain")
             app.logger.info(f"Summarizing text length: {len(text)} of document: {doc_id}")
-            summary = SummarizerService.summarize(text, doc_id)
-            resp_json = json.dumps({SUMMARY_FIELD: summary})
+            if stream:
+                # Admitted before the response starts, so that a rejection is a status, and held until it ends. The
+                # admission is handed over to the response once it is created, released here if that fails.
+                with ExitStack() as admission:
+                    admission.enter_context(SummarizerService.admit(len(text)))
+                    response = flask.Response(
+                        response=flask.stream_with_context(SummarizerService.stream_summary(text, doc_id)),
+                        status=200,
+                        mimetype=NDJSON_MIMETYPE,
+                        headers={"X-Accel-Buffering": "no"}
+                    )
+                    response.call_on_close(admission.pop_all().close)
+                return response
+            with SummarizerService.admit(len(text)):
+                summary = SummarizerService.summarize(text, doc_id, target_tokens)
+            with ENCODE_SECONDS.time():
+                resp_json = json.dumps({SUMMARY_FIELD: summary})
             return flask.Response(response=resp_json, status=200, mimetype="application/json")
+    except Overloaded as ex:
+        app.logger.warning(f"Rejected document: {data_dict.get(DOC_ID_FIELD, 'n/a')}: {ex}")
+        return flask.Response(response=str(ex), status=ex.status, mimetype="text/plain", headers=retry_after_header(ex))
+    except Exception as ex:
+        err_msg = f"Algorithm error: {type(ex)}; message: {ex.args}; error: {traceback.format_exc()}"
+        app.logger.error(err_msg)
+        return flask.Response(response=err_msg, status=500, mimetype="text/plain")
+
+
+def summarize_text_stream():
+    """Summarize the text/plain body of the request, chunking it while it is read from the request stream."""
+    doc_id = flask.request.args.get(DOC_ID_FIELD, "n/a")
+    target_tokens = flask.request.args.get(TARGET_TOKENS_FIELD, type=int)
+    if TARGET_TOKENS_FIELD in flask.request.args and target_tokens is None:
+        target_tokens = flask.request.args[TARGET_TOKENS_FIELD]  # Not an integer, reported as it is
+    error = target_tokens_error(target_tokens, False)
+    if error:
+        app.logger.error(error)
+        return flask.Response(response=error, status=400, mimetype="text/plain")
+    encoding = flask.request.mimetype_params.get("charset", "utf-8")
+    try:
+        app.logger.info(f"Summarizing text stream of length: {flask.request.content_length} of document: {doc_id}")
+        # A byte is about a character, and a body of unknown length is admitted as the costliest request.
+        with SummarizerService.admit(flask.request.content_length):
+            summary = SummarizerService.summarize_stream(flask.request.stream, doc_id, target_tokens, encoding)
+        with ENCODE_SECONDS.time():
+            resp_json = json.dumps({SUMMARY_FIELD: summary})
+        return flask.Response(response=resp_json, status=200, mimetype="application/json")
+    except Overloaded as ex:
+        app.logger.warning(f"Rejected text stream of document: {doc_id}: {ex}")
+        return flask.Response(response=str(ex), status=ex.status, mimetype="text/plain", headers=retry_after_header(ex))
     except Exception as ex:
         err_msg = f"Algorithm error: {type(ex)}; message: {ex.args}; error: {traceback.format_exc()}"
         app.logger.error(err_msg)
         return flask.Response(response=err_msg, status=500, mimetype="text/plain")
 
 
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Submit a summarization job, to be run in the background.
+
+    Request type: POST
+    Request body: A JSON object that contains 'text' field and optionally 'doc_id' field, or (with a JSON Lines
+    content type, e.g., application/jsonlines) a batch of such objects, one per line.
+    Response:
+        202 Accepted - Success.
+        A JSON object that contains 'job_id' field. Poll GET /jobs/<job_id>, then fetch GET /jobs/<job_id>/result.
+
+        415 Unsupported Media Type - Fail.
+        400 Bad Request - Fail. A document is not an object with a 'text' string field.
+        503 Service Unavailable - Fail. The job queue of the worker is full, retry after the Retry-After seconds.
+    """
+    content_type = flask.request.content_type
+    if content_type != "application/json" and content_type not in JSONL_MIMETYPES:
+        return flask.Response(
+            response='Invalid request data type, only json and json lines are supported.',
+            status=415,
+            mimetype='text/plain'
+        )
+
+    try:
+        documents = job_documents(flask.request.data.decode('utf-8'), content_type != "application/json")
+    except ValueError as ex:
+        return flask.Response(response=str(ex), status=400, mimetype="text/plain")
+
+    job_id = JobRunner.submit(documents)
+    if job_id is None:
+        return flask.Response(
+            response="The job queue is full.", status=503, mimetype="text/plain", headers=JOB_QUEUE_FULL_HEADERS
+        )
+    return flask.Response(
+        response=json.dumps({"job_id": job_id}),
+        status=202,
+        mimetype="application/json",
+        headers={"Location": f"/jobs/{job_id}"}
+    )
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id: str):
+    """Return the status ('queued', 'running', 'succeeded' or 'failed') and progress (chunks done/total) of a job.
+
+    The chunks total counts the chunks of the documents chunked so far, i.e., it is final once the job has succeeded.
+    """
+    job = JobRunner.get_store().get(job_id)
+    if job is None:
+        return flask.Response(response=f"Unknown job: {job_id}", status=404, mimetype="text/plain")
+    return flask.Response(response=json.dumps(job), status=200, mimetype="application/json")
+
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id: str):
+    """Return the summaries of a succeeded job as JSON Lines, one {'doc_id': ..., 'summary': ...} per document.
+
+    Response:
+        200 OK - Success.
+        404 Not Found - Fail. Unknown job.
+        409 Conflict - Fail. The job has not succeeded (yet), see GET /jobs/<job_id>.
+    """
+    store = JobRunner.get_store()
+    job = store.get(job_id)
+    if job is None:
+        return flask.Response(response=f"Unknown job: {job_id}", status=404, mimetype="text/plain")
+    if job["status"] != SUCCEEDED:
+        return flask.Response(response=json.dumps(job), status=409, mimetype="application/json")
+    result = "".join(json.dumps(doc_sum) + "\n" for doc_sum in store.result(job_id))
+    return flask.Response(response=result, status=200, mimetype="application/jsonlines")
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Return the metrics of the service in the Prometheus text format, summed over the workers, see metrics.latest."""
+    body, content_type = metrics.latest()
+    return flask.Response(response=body, status=200, content_type=content_type)
+
+
 def main():  # pragma: no cover
     """Start/bind the service."""
     app.run(threaded=True, host="0.0.0.0", port=8080)
@@ -0,0 +1,14 @@
+"""The uvicorn worker class of gunicorn, bounding the requests of a worker by the worker_connections of gunicorn."""
+from uvicorn.workers import UvicornWorker
+
+
+class BoundedUvicornWorker(UvicornWorker):
+    """A UvicornWorker serving at most worker_connections requests at a time, and 503 beyond them.
+
+    The UvicornWorker ignores the worker_connections setting, so an async worker would otherwise accept requests
+    without bound, each of them holding its text and chunk summaries in memory.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.config.limit_concurrency = self.cfg.worker_connections
@@ -6,3 +6,6 @@ import summarizer_service as myapp
 # new file.
 
 app = myapp.app
+
+# Imported once by the gunicorn master with --preload, so the workers share the tokenizers, see serve.
+myapp.SummarizerService.preload()
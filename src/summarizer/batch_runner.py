@@ -0,0 +1,129 @@
+"""Run a function over the documents of a JSON Lines corpus concurrently, resuming where a previous run stopped."""
+import os
+import json
+import logging
+from typing import Callable, Dict, Iterator, Set, Tuple
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, wait
+
+logger = logging.getLogger(__name__)
+
+
+def booksum_doc_id(line: Dict) -> str:
+    """Return the document id of a BookSum line, i.e., its chapter path and summary path."""
+    return line["metadata"]["chapter_path"] + "-" + line["metadata"]["summary_path"]
+
+
+class BatchRunner:
+    """Process the lines of a JSON Lines file with up to max_workers lines in flight, appending them to an output file.
+
+    The output file is the checkpoint: the lines whose doc_id is already in it are skipped, so a rerun after an
+    interruption only processes the remaining lines. A line whose processing fails is logged and left out of the
+    output, to be retried by the next run.
+    """
+
+    def __init__(
+            self,
+            process_line: Callable[[Dict], Dict],
+            doc_id: Callable[[Dict], str] = booksum_doc_id,
+            max_workers: int = 4,
+            ordered: bool = True
+    ):
+        """
+        Args:
+            process_line: Return the output line of the given input line, e.g., the line with its system summary.
+            doc_id: Return the document id of an input or output line.
+            max_workers: The number of lines processed concurrently.
+            ordered: Write the output lines in input order if True, otherwise as soon as they are processed.
+        """
+        self.process_line = process_line
+        self.doc_id = doc_id
+        self.max_workers = max_workers
+        self.ordered = ordered
+
+    def run(self, input_file: str, output_file: str) -> Dict:
+        """Process the unfinished lines of input_file into output_file, return the number of lines per outcome."""
+        done_ids = self.load_checkpoint(output_file)
+        stats = {"skipped": 0, "succeeded": 0, "failed": 0}
+
+        with open(output_file, "a", encoding="utf-8") as out_file:
+            def write(line: Dict):
+                out_file.write(json.dumps(line) + "\n")
+                out_file.flush()
+
+            pending: Dict[int, Dict] = {}  # Processed lines waiting for their predecessors, in ordered mode
+            next_seq = 0
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                in_flight: Set[Future] = set()
+                for seq, line in self._todo_lines(input_file, done_ids, stats):
+                    # Bound the lines held in memory, including those waiting for a slow predecessor.
+                    while len(in_flight) + len(pending) >= 2 * self.max_workers:
+                        finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        next_seq = self._collect(finished, pending, next_seq, write, stats)
+                    in_flight.add(executor.submit(self._process, seq, line))
+                next_seq = self._collect(in_flight, pending, next_seq, write, stats, wait_all=True)
+
+        logger.info(f"Batch of {input_file} done: {stats}")
+        return stats
+
+    def load_checkpoint(self, output_file: str) -> Set[str]:
+        """Return the doc_ids already in the output file, truncating a partially written last line."""
+        done_ids: Set[str] = set()
+        if not os.path.exists(output_file):
+            return done_ids
+
+        valid_size = 0
+        with open(output_file, "rb") as file_obj:
+            for raw_line in file_obj:
+                try:
+                    done_ids.add(self.doc_id(json.loads(raw_line)))
+                except (ValueError, KeyError):
+                    logger.warning(f"Dropping a partially written line at byte {valid_size} of {output_file}")
+                    break
+                valid_size += len(raw_line)
+        with open(output_file, "r+b") as file_obj:
+            file_obj.truncate(valid_size)
+
+        logger.info(f"Resuming {output_file}: {len(done_ids)} documents already done.")
+        return done_ids
+
+    def _todo_lines(self, input_file: str, done_ids: Set[str], stats: Dict) -> Iterator[Tuple[int, Dict]]:
+        seq = 0
+        with open(input_file, "r", encoding="utf-8") as in_file:
+            for raw_line in in_file:
+                if not raw_line.strip():
+                    continue
+                line = json.loads(raw_line)
+                if self.doc_id(line) in done_ids:
+                    stats["skipped"] += 1
+                    continue
+                yield seq, line
+                seq += 1
+
+    def _process(self, seq: int, line: Dict) -> Tuple[int, Dict]:
+        doc_id = self.doc_id(line)
+        logger.info(f"Processing line# {seq + 1} document: {doc_id}")
+        try:
+            return seq, self.process_line(line)
+        except Exception as ex:
+            logger.error(f"Failed to process document: {doc_id}, error: {ex}")
+            return seq, None
+
+    def _collect(self, finished, pending: Dict[int, Dict], next_seq: int, write, stats: Dict, wait_all=False) -> int:
+        """Write the finished lines (in ordered mode, only those whose predecessors are written) and return next_seq."""
+        if wait_all:
+            finished, _ = wait(finished)
+        for future in finished:
+            seq, out_line = future.result()
+            stats["succeeded" if out_line is not None else "failed"] += 1
+            if not self.ordered:
+                if out_line is not None:
+                    write(out_line)
+            else:
+                pending[seq] = out_line
+
+        while next_seq in pending:
+            out_line = pending.pop(next_seq)
+            if out_line is not None:
+                write(out_line)
+            next_seq += 1
+        return next_seq
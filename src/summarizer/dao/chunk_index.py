@@ -0,0 +1,332 @@
+"""A chunk index of a corpus, persisted in a binary sidecar file, so that the corpus is chunked without tokenizing it.
+
+A corpus is a text file (one document) or a JSON Lines file (one document per line, in its text field). Per document,
+the index holds the byte offsets and number of tokens of its paragraphs, as split by TextChunker's
+chunk_generator_from_text, and of their sentences, and the chunk boundaries for a given max_tokens and packing.
+Rechunking with another max_tokens only packs the stored counts again.
+
+The text of a chunk is sliced from a memory-mapped file: the corpus for a text file, and for a JSON Lines file, the
+UTF-8 texts of its documents, stored decoded at the end of the index, so that they are not parsed again.
+"""
+import os
+import re
+import json
+import mmap
+import struct
+import uuid
+import logging
+import threading
+import numpy as np
+from typing import Iterator, List, Optional, Tuple, Union
+from nltk.data import load
+from summarizer.util import TEXT_FIELD
+from summarizer.dao.chunker import PARA_REGEX, PARAGRAPH, FIRST_SENTENCE, SENTENCE, Chunk, pack_units, \
+    pack_units_balanced, join_spans
+from summarizer.model.token_counter import TokenCounter, TOKEN_COUNTER
+
+INDEX_SUFFIX = ".chunkidx"
+MAGIC = b"CHIX"
+VERSION = 4
+
+HEADER = struct.Struct("<4sIQqIIIIIIIIQ")
+"""Magic, version, corpus size and mtime, max_tokens, is balanced, is JSON Lines, the number of rows of each table,
+and the size of the texts."""
+
+DOC_DTYPE = np.dtype([("start", "<u8"), ("end", "<u8"), ("text_start", "<u8"), ("para_start", "<u4"),
+                      ("para_count", "<u4"), ("chunk_start", "<u4"), ("chunk_count", "<u4")])
+"""The byte range of a document in the corpus file, the offset of its UTF-8 text in the corpus file (text) or in the
+texts of the index (JSON Lines), and its paragraphs and chunks."""
+PARA_DTYPE = np.dtype([("start", "<u4"), ("end", "<u4"), ("tokens", "<u4"), ("sent_start", "<u4"),
+                       ("sent_count", "<u4")])
+"""The byte range of a paragraph in the UTF-8 text of its document, its number of tokens, and its sentences."""
+SENT_DTYPE = np.dtype([("start", "<u4"), ("end", "<u4"), ("tokens", "<u4")])
+"""The byte range of a sentence in the UTF-8 text of its document, and its number of tokens."""
+ITEM_DTYPE = np.dtype([("kind", "u1"), ("index", "<u4")])
+"""A paragraph of a chunk, or a sentence of a split paragraph of a chunk, as the index of its kind of table."""
+NO_SENTENCE = SENTENCE + 1
+"""The kinds of items. A split paragraph is a FIRST_SENTENCE followed by SENTENCEs, or NO_SENTENCE when empty."""
+CHUNK_DTYPE = np.dtype([("item_start", "<u4"), ("item_count", "<u4"), ("tokens", "<u4")])
+
+TABLES = [("docs", DOC_DTYPE), ("paragraphs", PARA_DTYPE), ("sentences", SENT_DTYPE), ("items", ITEM_DTYPE),
+          ("chunks", CHUNK_DTYPE)]
+
+logger = logging.getLogger(__name__)
+
+
+class ChunkIndex:
+    """The chunk index of a corpus file, whose tables are read from the memory-mapped sidecar file.
+
+    The index can be shared by threads, e.g., summarizing its documents concurrently: a rechunk, under the lock,
+    replaces the chunk tables at once, and a chunk generator iterates the tables it started with.
+    """
+
+    def __init__(self, corpus_file: str, max_tokens: int, is_jsonl: bool, tables: dict,
+                 text_field: str = TEXT_FIELD, index_file: str = None, balanced: bool = False,
+                 texts: Union[bytes, mmap.mmap] = b"", texts_offset: int = 0, texts_size: int = 0):
+        self.corpus_file = corpus_file
+        self.index_file = index_file or corpus_file + INDEX_SUFFIX
+        self.max_tokens = max_tokens
+        self.balanced = balanced
+        self.is_jsonl = is_jsonl
+        self.text_field = text_field
+        self.docs = tables["docs"]
+        self.paragraphs = tables["paragraphs"]
+        self.sentences = tables["sentences"]
+        self.items = tables["items"]
+        self.chunks = tables["chunks"]
+        self.texts = texts  # The buffer holding the texts of the documents of a JSON Lines corpus
+        self.texts_offset = texts_offset
+        self.texts_size = texts_size
+        self._corpus = None
+        self._file_obj = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.docs)
+
+    @classmethod
+    def open(cls, corpus_file: str, max_tokens: int, token_counter: TokenCounter = TOKEN_COUNTER,
+             text_field: str = TEXT_FIELD, index_file: str = None, balanced: bool = False) -> "ChunkIndex":
+        """Load the index of the corpus, building it if missing or stale, and rechunking it if built for another
+        max_tokens or packing."""
+        index_file = index_file or corpus_file + INDEX_SUFFIX
+        index = cls.load(corpus_file, text_field, index_file) if os.path.exists(index_file) else None
+        if index is None:
+            return cls.build(corpus_file, max_tokens, token_counter, text_field, index_file, balanced)
+        index.ensure_chunked(max_tokens, balanced)
+        return index
+
+    @classmethod
+    def load(cls, corpus_file: str, text_field: str = TEXT_FIELD, index_file: str = None) -> Optional["ChunkIndex"]:
+        """Load the index of the corpus, or return None if it was built from another version of the corpus, or
+        is of another version of the index."""
+        index_file = index_file or corpus_file + INDEX_SUFFIX
+        with open(index_file, "rb") as file_obj:
+            buffer = mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = struct.unpack_from("<4sI", buffer)
+        if magic != MAGIC:
+            raise RuntimeError(f"Not a chunk index: {index_file}")
+        if version != VERSION:
+            logger.warning(f"Chunk index: {index_file} is of version {version}, rebuilding it.")
+            return None
+        _, _, size, mtime_ns, max_tokens, balanced, is_jsonl, *counts, texts_size = HEADER.unpack_from(buffer)
+        corpus_stat = os.stat(corpus_file)
+        if (size, mtime_ns) != (corpus_stat.st_size, corpus_stat.st_mtime_ns):
+            logger.warning(f"Chunk index: {index_file} is stale, {corpus_file} has changed.")
+            return None
+
+        tables, offset = {}, HEADER.size
+        for (name, dtype), count in zip(TABLES, counts):
+            tables[name] = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+            offset += count * dtype.itemsize
+        return cls(corpus_file, max_tokens, bool(is_jsonl), tables, text_field, index_file, bool(balanced),
+                   buffer, offset, texts_size)
+
+    @classmethod
+    def build(cls, corpus_file: str, max_tokens: int, token_counter: TokenCounter = TOKEN_COUNTER,
+              text_field: str = TEXT_FIELD, index_file: str = None, balanced: bool = False) -> "ChunkIndex":
+        """Split and tokenize each document of the corpus, and save the index of the given max_tokens and packing."""
+        is_jsonl = corpus_file.endswith(".jsonl")
+        builder = IndexBuilder(token_counter)
+        with open(corpus_file, "rb") as file_obj:
+            if is_jsonl:
+                start = 0
+                for line in file_obj:
+                    if line.strip():
+                        builder.add(start, start + len(line), json.loads(line)[text_field], keep_text=True)
+                    start += len(line)
+            else:
+                data = file_obj.read()
+                builder.add(0, len(data), data.decode("utf-8"))
+
+        texts = b"".join(builder.texts)
+        index = cls(corpus_file, max_tokens, is_jsonl, builder.tables(), text_field, index_file, balanced,
+                    texts, 0, len(texts))
+        index.rechunk(max_tokens, balanced)
+        logger.info(f"Chunk index of {corpus_file}: {len(index.docs)} documents, {len(index.paragraphs)} paragraphs")
+        return index
+
+    def ensure_chunked(self, max_tokens: int, balanced: bool = False):
+        """Rechunk the index, unless it is chunked for the given max_tokens and packing already."""
+        with self._lock:
+            if (self.max_tokens, self.balanced) != (max_tokens, balanced):
+                self._rechunk(max_tokens, balanced)
+
+    def rechunk(self, max_tokens: int, balanced: bool = False):
+        """Pack the paragraphs of every document into chunks of max_tokens, from the stored counts, and save it.
+
+        If balanced, pack them with pack_units_balanced rather than greedily.
+        """
+        with self._lock:
+            self._rechunk(max_tokens, balanced)
+
+    def _rechunk(self, max_tokens: int, balanced: bool):
+        pack = pack_units_balanced if balanced else pack_units
+        docs = self.docs.copy()
+        items: List[Tuple[int, int]] = []
+        chunks: List[Tuple[int, int, int]] = []
+        sent_tokens = self.sentences["tokens"].tolist()
+        for doc_no, (para_start, para_count) in enumerate(docs[["para_start", "para_count"]].tolist()):
+            paragraphs = self.paragraphs[para_start:para_start + para_count]
+
+            def split_paragraph(para_no: int) -> Iterator[Tuple[int, int]]:
+                sent_start = int(self.paragraphs["sent_start"][para_no])
+                sent_end = sent_start + int(self.paragraphs["sent_count"][para_no])
+                return zip(range(sent_start, sent_end), sent_tokens[sent_start:sent_end])
+
+            units = zip(range(para_start, para_start + para_count), paragraphs["tokens"].tolist())
+            docs["chunk_start"][doc_no] = len(chunks)
+            for chunk_tokens, pieces in pack(units, max_tokens, split_paragraph):
+                item_start = len(items)
+                for piece in pieces:
+                    if not isinstance(piece, list):
+                        items.append((PARAGRAPH, piece))
+                    elif not piece:
+                        items.append((NO_SENTENCE, 0))
+                    else:
+                        items.append((FIRST_SENTENCE, piece[0]))
+                        items.extend((SENTENCE, sent_no) for sent_no in piece[1:])
+                chunks.append((item_start, len(items) - item_start, chunk_tokens))
+            docs["chunk_count"][doc_no] = len(chunks) - docs["chunk_start"][doc_no]
+
+        self.max_tokens = max_tokens
+        self.balanced = balanced
+        self.docs, self.items = docs, np.array(items, dtype=ITEM_DTYPE)
+        self.chunks = np.array(chunks, dtype=CHUNK_DTYPE)
+        self.save()
+
+    def save(self):
+        """Write the index into its sidecar file, atomically, through a temporary file of its own, so that the
+        processes or threads saving the index at the same time do not write the same temporary file."""
+        corpus_stat = os.stat(self.corpus_file)
+        tables = [self.docs, self.paragraphs, self.sentences, self.items, self.chunks]
+        tmp_file = f"{self.index_file}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_file, "xb") as file_obj:
+                file_obj.write(HEADER.pack(MAGIC, VERSION, corpus_stat.st_size, corpus_stat.st_mtime_ns,
+                                           self.max_tokens, int(self.balanced), int(self.is_jsonl),
+                                           *(len(table) for table in tables), self.texts_size))
+                for table in tables:
+                    file_obj.write(table.tobytes())
+                with memoryview(self.texts) as texts:
+                    file_obj.write(texts[self.texts_offset:self.texts_offset + self.texts_size])
+            os.replace(tmp_file, self.index_file)
+        except Exception:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+
+    def chunk_generator(self, doc_no: int, doc_id: str) -> Iterator[Chunk]:
+        """Iterate the chunks of the given document (its number in the corpus), as spans of the memory-mapped corpus.
+
+        The text of a chunk is read from the mmap on first use, so it must be used before the index is closed.
+        """
+        with self._lock:
+            docs, items, chunks = self.docs, self.items, self.chunks
+        doc = docs[doc_no]
+        source, base = self._document_source(doc)
+        chunk_start, chunk_count = int(doc["chunk_start"]), int(doc["chunk_count"])
+        para_starts, para_ends = self.paragraphs["start"], self.paragraphs["end"]
+        sent_starts, sent_ends = self.sentences["start"], self.sentences["end"]
+        for counter, (item_start, item_count, chunk_tokens) in enumerate(
+                chunks[chunk_start:chunk_start + chunk_count].tolist(), 1):
+            pieces = []
+            for kind, index in items[item_start:item_start + item_count].tolist():
+                if kind == PARAGRAPH:
+                    pieces.append((base + int(para_starts[index]), base + int(para_ends[index])))
+                elif kind == NO_SENTENCE:
+                    pieces.append([])
+                else:
+                    span = (base + int(sent_starts[index]), base + int(sent_ends[index]))
+                    if kind == SENTENCE:
+                        pieces[-1].append(span)
+                    else:
+                        pieces.append([span])
+            yield Chunk(counter, chunk_tokens, doc_id, source=source, spans=tuple(join_spans(pieces)))
+
+    def _document_source(self, doc) -> Tuple[Union[bytes, mmap.mmap], int]:
+        """Return the buffer holding the UTF-8 text of the given document, and the offset of the text in it.
+
+        For a text file, that is the memory-mapped corpus, for a JSON Lines file, the texts of the index, i.e., the
+        memory-mapped index once it is loaded.
+        """
+        if self.is_jsonl:
+            return self.texts, self.texts_offset + int(doc["text_start"])
+        with self._lock:
+            if self._corpus is None:
+                self._file_obj = open(self.corpus_file, "rb")
+                self._corpus = mmap.mmap(self._file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._corpus, int(doc["text_start"])
+
+    def close(self):
+        if self._corpus is not None:
+            self._corpus.close()
+            self._file_obj.close()
+            self._corpus = self._file_obj = None
+
+
+class IndexBuilder:
+    """Accumulate the paragraph and sentence tables of the documents of a corpus."""
+
+    def __init__(self, token_counter: TokenCounter):
+        self.token_counter = token_counter
+        self.punkt = load("tokenizers/punkt/english.pickle")
+        self.docs: List[Tuple] = []
+        self.paragraphs: List[Tuple] = []
+        self.sentences: List[Tuple] = []
+        self.texts: List[bytes] = []
+        self.texts_size = 0
+
+    def add(self, start: int, end: int, text: str, keep_text: bool = False):
+        """Add the document at the given byte range of the corpus, whose text is given.
+
+        If keep_text, e.g., for a JSON Lines corpus, the UTF-8 text is kept in texts, rather than read from the corpus.
+        """
+        text_start = start
+        if keep_text:
+            text_start = self.texts_size
+            self.texts.append(text.encode("utf-8"))
+            self.texts_size += len(self.texts[-1])
+        offsets = ByteOffsets(text)
+        strip_start = len(text) - len(text.lstrip())
+        body = text.strip()
+        para_spans, pos = [], 0
+        for match in re.finditer(PARA_REGEX, body):
+            para_spans.append((pos, match.start()))
+            pos = match.end()
+        para_spans.append((pos, len(body)))
+
+        para_texts = [body[para_start:para_end] for para_start, para_end in para_spans]
+        para_tokens = self.token_counter.count_batch(para_texts)
+        self.docs.append((start, end, text_start, len(self.paragraphs), len(para_spans), 0, 0))
+        for (para_start, para_end), para_text, tokens in zip(para_spans, para_texts, para_tokens):
+            sent_spans = list(self.punkt.span_tokenize(para_text))
+            sent_tokens = self.token_counter.count_batch([para_text[s:e] for s, e in sent_spans])
+            para_offset = strip_start + para_start
+            self.paragraphs.append((offsets[para_offset], offsets[strip_start + para_end], tokens,
+                                    len(self.sentences), len(sent_spans)))
+            self.sentences.extend((offsets[para_offset + sent_start], offsets[para_offset + sent_end], tokens)
+                                  for (sent_start, sent_end), tokens in zip(sent_spans, sent_tokens))
+
+    def tables(self) -> dict:
+        return {
+            "docs": np.array(self.docs, dtype=DOC_DTYPE),
+            "paragraphs": np.array(self.paragraphs, dtype=PARA_DTYPE),
+            "sentences": np.array(self.sentences, dtype=SENT_DTYPE),
+            "items": np.empty(0, dtype=ITEM_DTYPE),
+            "chunks": np.empty(0, dtype=CHUNK_DTYPE),
+        }
+
+
+class ByteOffsets:
+    """Map the character offsets of a text to the byte offsets of its UTF-8 encoding."""
+
+    def __init__(self, text: str):
+        self.cumulative = None
+        if not text.isascii():
+            code_points = np.frombuffer(text.encode("utf-32-le"), dtype="<u4")
+            lengths = 1 + (code_points >= 0x80) + (code_points >= 0x800) + (code_points >= 0x10000)
+            self.cumulative = np.concatenate([[0], np.cumsum(lengths)])
+
+    def __getitem__(self, char_offset: int) -> int:
+        return char_offset if self.cumulative is None else int(self.cumulative[char_offset])
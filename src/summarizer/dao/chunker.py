@@ -1,32 +1,103 @@
 import re
+import mmap
+import codecs
 import logging
-from typing import Iterator, List, Tuple
-from dataclasses import dataclass
-from nltk.tokenize import sent_tokenize
-from summarizer.model.gpt3_summarizer import count_tokens
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple, Union, TYPE_CHECKING
+from nltk.data import load
+from summarizer.model.token_counter import TokenCounter, TOKEN_COUNTER
+from summarizer.metrics import CHUNK_SECONDS, timed_generator
+
+if TYPE_CHECKING:
+    from summarizer.dao.chunk_index import ChunkIndex
 
 PARA_REGEX = r"(?:\r?\n){2,}"
 """Greedily match two or more new-lines in Windows/Linux/Mac."""
+PARA_PATTERN = re.compile(PARA_REGEX)
+
+STREAM_BLOCK_SIZE = 1 << 16
+"""The number of bytes read at a time from a stream."""
+
+PARAGRAPH, FIRST_SENTENCE, SENTENCE = range(3)
+"""The kinds of the items packed into chunks: a paragraph, or a sentence of a long paragraph, first or not."""
+
+NEWLINE = memoryview(b"\n")
+SPACE = memoryview(b" ")
 
 logger = logging.getLogger(__name__)
 
 
-@dataclass()
 class Chunk:
-    """A sequence of non-empty paragraphs separated by a newline."""
+    """A sequence of non-empty paragraphs separated by a newline.
+
+    A chunk holds either its paragraphs, or only their spans in a source buffer, i.e., the str of its document or its
+    UTF-8 bytes, e.g., a mmap, so that chunking a document doesn't copy its text. The text is joined on first use only.
+    """
+
+    __slots__ = ("id", "num_of_tokens", "document_id", "source", "spans", "_paragraphs", "_text")
+
+    def __init__(self, id: int, num_of_tokens: int, document_id: str, paragraphs: Tuple[str, ...] = (),
+                 source: Union[str, bytes, mmap.mmap, None] = None, spans: Tuple[Tuple[int, ...], ...] = ()):
+        self.id = id  # Auto-increment number in a given text document
+        self.num_of_tokens = num_of_tokens  # The number of tokens in the current chunk
+        self.document_id = document_id  # File name, chapter name or document id of the document of this chunk
+        self.source = source
+        self.spans = spans  # Per paragraph, the (start, end, start, end, ...) of its sentences joined by a space
+        self._paragraphs = paragraphs
+        self._text: Optional[str] = None
 
-    id: int
-    """Auto-increment number in a given text document."""
-    num_of_tokens: int
-    """The number of tokens in the current chunk."""
-    document_id: str
-    """Identifier of the document where this chunk belongs to. It could be file name or chapter name or document id."""
-    paragraphs: Tuple[str]
-    """A set of paragraphs of this chunk. We use tuple here to make paragraphs immutable, not for heterogeneous."""
+    @property
+    def paragraphs(self) -> Tuple[str, ...]:
+        """The paragraphs of this chunk, sliced from the source if it has one."""
+        if self.source is None:
+            return self._paragraphs
+        if isinstance(self.source, str):
+            return tuple(" ".join(self.source[span[i]:span[i + 1]] for i in range(0, len(span), 2))
+                         for span in self.spans)
+        return tuple(b" ".join(self.source[span[i]:span[i + 1]] for i in range(0, len(span), 2)).decode("utf-8")
+                     for span in self.spans)
 
     def text(self) -> str:
         """Return all the paragraph's text of this chunk."""
-        return "\n".join(self.paragraphs)
+        if self._text is None:
+            self._text = "\n".join(self.paragraphs)
+        return self._text
+
+    def buffers(self) -> List[memoryview]:
+        """Return the UTF-8 text of this chunk as a list of buffers, e.g., for socket.sendmsg or writelines.
+
+        For a bytes source, the buffers are views of the source, without copying it, so that a mmap can't be closed
+        while they are alive.
+        """
+        if self.source is None or isinstance(self.source, str):
+            return [memoryview(self.text().encode("utf-8"))]
+        view = memoryview(self.source)
+        buffers = []
+        for span in self.spans:
+            if buffers:
+                buffers.append(NEWLINE)
+            for i in range(0, len(span), 2):
+                if i:
+                    buffers.append(SPACE)
+                buffers.append(view[span[i]:span[i + 1]])
+        return buffers
+
+    def to_bytes(self) -> bytes:
+        """Return the UTF-8 text of this chunk."""
+        if self.source is None or isinstance(self.source, str):
+            return self.text().encode("utf-8")
+        return b"".join(self.buffers())
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Chunk):
+            return NotImplemented
+        return (self.id, self.num_of_tokens, self.document_id, self.paragraphs) == \
+               (other.id, other.num_of_tokens, other.document_id, other.paragraphs)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"Chunk(id={self.id!r}, num_of_tokens={self.num_of_tokens!r}, document_id={self.document_id!r}, " \
+               f"paragraphs={self.paragraphs!r})"
 
 
 def paragraphs(file_obj, separator="\n", joiner="".join) -> Iterator[str]:
@@ -43,20 +114,98 @@ def paragraphs(file_obj, separator="\n", joiner="".join) -> Iterator[str]:
         yield joiner(paragraph)
 
 
+def iter_paragraphs(source, encoding: str = "utf-8", block_size: int = STREAM_BLOCK_SIZE) -> Iterator[str]:
+    """Iterate the paragraphs of a text read from a byte stream, as re.split(PARA_REGEX, text.strip()) would split it.
+
+    A paragraph is only yielded once a later non-whitespace character is read, since stripping the text removes the
+    trailing whitespace of its last paragraph, and any whitespace-only paragraph after it.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    started = False
+    pending: List[str] = []  # The text of the current paragraph, up to tail
+    tail = ""  # The text not scanned for separators yet, and the trailing new-lines that may start a separator
+    held: List[str] = []  # The paragraphs since the last one with a non-whitespace character, that one included
+    num_of_paragraphs = 0
+
+    def add(paragraph: str) -> Iterator[str]:
+        nonlocal held, num_of_paragraphs
+        if paragraph.strip():
+            num_of_paragraphs += len(held)
+            yield from held
+            held = [paragraph]
+        else:
+            held.append(paragraph)
+
+    blocks = iter_blocks(source, block_size)
+    final = False
+    while not final:
+        block = next(blocks, None)
+        final = block is None
+        text = decoder.decode(block or b"", final=final)
+        if not started:
+            text = text.lstrip()
+            started = bool(text)
+        tail += text
+
+        pos = 0
+        for match in PARA_PATTERN.finditer(tail):
+            # A separator at the end of what is read so far may go on in the next block.
+            if not final and (match.end() == len(tail) or match.end() == len(tail) - 1 and tail[-1] == "\r"):
+                break
+            pending.append(tail[pos:match.start()])
+            yield from add("".join(pending))
+            pending = []
+            pos = match.end()
+        tail = tail[pos:]
+        keep = len(tail) - len(tail.rstrip("\r\n"))
+        if not final and keep < len(tail):
+            pending.append(tail[:len(tail) - keep])
+            tail = tail[len(tail) - keep:]
+
+    if started:
+        yield from add("".join(pending) + tail)
+    if held and held[0].strip():
+        yield held[0].rstrip()
+    elif num_of_paragraphs == 0:
+        yield ""
+
+
+def iter_blocks(source, block_size: int = STREAM_BLOCK_SIZE) -> Iterator[bytes]:
+    """Iterate the bytes of a binary file object, or of an iterable of bytes, a block at a time."""
+    if not hasattr(source, "read"):
+        yield from source
+        return
+    while True:
+        block = source.read(block_size)
+        if not block:
+            return
+        yield block
+
+
 class TextChunker:
     """Process an input text file as a set of chunks."""
 
-    def __init__(self, num_of_tokens: int):
+    def __init__(self, num_of_tokens: int, token_counter: TokenCounter = TOKEN_COUNTER, balanced: bool = False):
+        """
+        Args:
+            num_of_tokens: The maximum number of tokens of a chunk.
+            token_counter: The token counter of the paragraphs and sentences.
+            balanced: Pack the paragraphs of a document into the least chunks of even sizes, see pack_units_balanced,
+                rather than greedily, which often leaves a tiny last chunk.
+        """
         self.max_tokens = num_of_tokens
+        self.token_counter = token_counter
+        self.balanced = balanced
+        self.pack_units = pack_units_balanced if balanced else pack_units
 
+    @timed_generator(CHUNK_SECONDS)
     def chunk_generator_from_file(self, file_name: str) -> Iterator[Chunk]:
         """Iterate a file object by chunk. A chunk consist of a set of paragraphs."""
         counter = 0
         chunk_tokens = 0
         chunk_paragraphs = []
         with open(file_name, "r", encoding="utf8") as file_obj:
-            for paragraph in paragraphs(file_obj):
-                para_tokens = count_tokens(paragraph)
+            for paragraph, para_tokens in self.token_counter.iter_with_counts(paragraphs(file_obj)):
                 if para_tokens > self.max_tokens:
                     logger.error(f"Paragraph tokens: {para_tokens} must be less than the max_token: {self.max_tokens}")
                     raise RuntimeError(f"Too long paragraph, tokens: {para_tokens}, max_tokens: {self.max_tokens}")
@@ -72,51 +221,203 @@ class TextChunker:
                 counter += 1
                 yield Chunk(counter, chunk_tokens, file_name, tuple(chunk_paragraphs))
 
+    @timed_generator(CHUNK_SECONDS)
     def chunk_generator_from_text(self, text: str, doc_id: str) -> Iterator[Chunk]:
-        """Iterate a text(str) by chunk. A chunk consist of a set of paragraphs."""
-        def chunk_generator_from_paragraph(paragraph_text: str) -> Iterator[Chunk]:
-            """Iterate a paragraph(str) by chunk. A chunk consist of a set of sentences/paragraphs."""
-            nonlocal counter, chunk_tokens
-            chunk_sentences = []
-            for sentence in sent_tokenize(paragraph_text):
-                sent_tokens = count_tokens(sentence)
-                if sent_tokens > self.max_tokens:
-                    logger.error(f"Skipping very long sentence, tokens: {sent_tokens}, max_tokens: {self.max_tokens}")
+        """Iterate a text(str) by chunk. A chunk consist of a set of paragraphs, as spans of the text."""
+        def split_paragraph(span: Tuple[int, int]) -> Iterator[Tuple[Tuple[int, int], int]]:
+            logger.warning(f"Document-{doc_id}: Chunking long paragraph.")
+            para_start, para_end = span
+            sent_spans = [(para_start + start, para_start + end)
+                          for start, end in sentence_spans(text[para_start:para_end])]
+            return with_counts(sent_spans)
+
+        def with_counts(spans: List[Tuple[int, int]]) -> Iterator[Tuple[Tuple[int, int], int]]:
+            counts = self.token_counter.iter_with_counts(text[start:end] for start, end in spans)
+            return ((span, num_of_tokens) for span, (_, num_of_tokens) in zip(spans, counts))
+
+        units = with_counts(paragraph_spans(text))
+        for counter, (chunk_tokens, pieces) in enumerate(self.pack_units(units, self.max_tokens, split_paragraph), 1):
+            yield Chunk(counter, chunk_tokens, doc_id, source=text, spans=tuple(join_spans(pieces)))
+
+    def chunk_generator_from_stream(self, source, doc_id: str, encoding: str = "utf-8") -> Iterator[Chunk]:
+        """Iterate a text read incrementally from a byte stream by chunk, the same as chunk_generator_from_text.
+
+        The source is a binary file object, e.g., an open file, a mmap or a request stream, or an iterable of bytes.
+        Only the current paragraph and chunk are held in memory, not the whole text.
+        """
+        return self.chunk_generator_from_paragraphs(iter_paragraphs(source, encoding), doc_id)
+
+    @timed_generator(CHUNK_SECONDS)
+    def chunk_generator_from_paragraphs(self, paragraphs: Iterable[str], doc_id: str) -> Iterator[Chunk]:
+        """Iterate the given paragraphs by chunk, splitting the paragraphs longer than max_tokens into sentences."""
+        def split_paragraph(paragraph: str) -> Iterator[Tuple[str, int]]:
+            logger.warning(f"Document-{doc_id}: Chunking long paragraph.")
+            return self.token_counter.iter_with_counts(paragraph[start:end] for start, end in sentence_spans(paragraph))
+
+        units = self.token_counter.iter_with_counts(paragraphs)
+        for counter, (chunk_tokens, pieces) in enumerate(self.pack_units(units, self.max_tokens, split_paragraph), 1):
+            yield Chunk(counter, chunk_tokens, doc_id, tuple(join_pieces(pieces)))
+
+    def chunk_generator_from_index(self, index: "ChunkIndex", doc_no: int, doc_id: str) -> Iterator[Chunk]:
+        """Iterate the chunks of a document of an indexed corpus, the same as chunk_generator_from_text, without
+        tokenizing it."""
+        index.ensure_chunked(self.max_tokens, self.balanced)
+        return index.chunk_generator(doc_no, doc_id)
+
+
+def pack_units(
+        units: Iterable[Tuple[Any, int]],
+        max_tokens: int,
+        split_paragraph: Callable[[Any], Iterable[Tuple[Any, int]]]
+) -> Iterator[Tuple[int, List]]:
+    """Greedily pack paragraphs, given with their number of tokens, into chunks of at most max_tokens.
+
+    Yield the number of tokens and the pieces of each chunk. A piece is a paragraph, or a list of consecutive sentences
+    of a paragraph longer than max_tokens, which split_paragraph splits into sentences with their number of tokens.
+    Paragraphs and sentences are opaque to the packing, e.g., strings or their indices. A paragraph, or the first
+    sentence of a split paragraph, counts a token more for its separator, unless it starts the chunk.
+    """
+    chunk_tokens = 0
+    pieces: List = []
+    for paragraph, para_tokens in units:
+        if para_tokens > max_tokens:
+            logger.warning(f"Too long paragraph, tokens: {para_tokens}, max_tokens: {max_tokens}")
+            sentences = []
+            for sentence, sent_tokens in split_paragraph(paragraph):
+                if sent_tokens > max_tokens:
+                    logger.error(f"Skipping very long sentence, tokens: {sent_tokens}, max_tokens: {max_tokens}")
                     continue
-                if chunk_tokens + sent_tokens > self.max_tokens:
-                    counter += 1
-                    chunk_paragraphs.append(" ".join(chunk_sentences))
-                    yield Chunk(counter, chunk_tokens, doc_id, tuple(chunk_paragraphs))
-                    chunk_paragraphs.clear()
-                    chunk_sentences = [sentence]
+                separator = 1 if pieces and not sentences else 0
+                if chunk_tokens + separator + sent_tokens > max_tokens:
+                    if sentences:
+                        pieces.append(sentences)
+                    yield chunk_tokens, pieces
+                    pieces = []
+                    sentences = [sentence]
                     chunk_tokens = sent_tokens
                 else:
-                    chunk_tokens += (sent_tokens + 1 if chunk_paragraphs and not chunk_sentences else sent_tokens)
-                    chunk_sentences.append(sentence)
-            if chunk_sentences:
-                chunk_paragraphs.append(" ".join(chunk_sentences))
+                    chunk_tokens += separator + sent_tokens
+                    sentences.append(sentence)
+            if sentences:
+                pieces.append(sentences)
+        elif pieces and chunk_tokens + 1 + para_tokens > max_tokens:
+            yield chunk_tokens, pieces
+            pieces = [paragraph]
+            chunk_tokens = para_tokens
+        else:
+            chunk_tokens += (para_tokens + 1 if pieces else para_tokens)
+            pieces.append(paragraph)
+    if pieces:
+        yield chunk_tokens, pieces
 
-        counter = 0
-        chunk_tokens = 0
-        chunk_paragraphs: List[str] = []
-        for paragraph in re.split(PARA_REGEX, text.strip()):
-            para_tokens = count_tokens(paragraph)
-            if para_tokens > self.max_tokens:
-                logger.warning(f"Too long paragraph, tokens: {para_tokens}, max_tokens: {self.max_tokens}")
-                logger.warning(f"Document-{doc_id}: Chunking long paragraph.")
-                yield from chunk_generator_from_paragraph(paragraph)
-            elif chunk_tokens + para_tokens > self.max_tokens:
-                counter += 1
-                yield Chunk(counter, chunk_tokens, doc_id, tuple(chunk_paragraphs))
-                chunk_paragraphs = [paragraph]
-                chunk_tokens = para_tokens
+
+def pack_units_balanced(
+        units: Iterable[Tuple[Any, int]],
+        max_tokens: int,
+        split_paragraph: Callable[[Any], Iterable[Tuple[Any, int]]]
+) -> Iterator[Tuple[int, List]]:
+    """Pack paragraphs, given with their number of tokens, into the least chunks of at most max_tokens, of even sizes.
+
+    The same as pack_units, except for the chunk boundaries: among the packings into the least chunks, a linear
+    partition dynamic program picks the one minimizing the sum of the squared chunk sizes. It reads all the units of a
+    document before yielding its first chunk.
+    """
+    items: List[Tuple[int, Any]] = []  # The paragraphs and sentences of the document, with their kind
+    tokens = [0]  # The number of tokens of the items before each item, and of the separator before it
+    separators = [0]
+    for paragraph, para_tokens in units:
+        if para_tokens > max_tokens:
+            logger.warning(f"Too long paragraph, tokens: {para_tokens}, max_tokens: {max_tokens}")
+            kind = FIRST_SENTENCE
+            for sentence, sent_tokens in split_paragraph(paragraph):
+                if sent_tokens > max_tokens:
+                    logger.error(f"Skipping very long sentence, tokens: {sent_tokens}, max_tokens: {max_tokens}")
+                    continue
+                items.append((kind, sentence))
+                tokens.append(tokens[-1] + sent_tokens)
+                separators.append(separators[-1] + (kind != SENTENCE))
+                kind = SENTENCE
+        else:
+            items.append((PARAGRAPH, paragraph))
+            tokens.append(tokens[-1] + para_tokens)
+            separators.append(separators[-1] + 1)
+    num_of_items = len(items)
+    if not num_of_items:
+        return
+
+    def chunk_size(start: int, end: int) -> int:
+        """The number of tokens of the chunk of items[start:end], the separator of its first item excluded."""
+        return tokens[end] - tokens[start] + separators[end] - separators[start + 1]
+
+    # The least chunks of the items before (after) each item, so that only the chunk counts reachable from both ends
+    # are tried at each boundary.
+    min_chunks_before, start, count = [0] * (num_of_items + 1), 0, 1
+    for end in range(1, num_of_items + 1):
+        if chunk_size(start, end) > max_tokens:
+            start, count = end - 1, count + 1
+        min_chunks_before[end] = count
+    min_chunks_after, end, count = [0] * (num_of_items + 1), num_of_items, 1
+    for start in range(num_of_items - 1, -1, -1):
+        if chunk_size(start, end) > max_tokens:
+            end, count = start + 1, count + 1
+        min_chunks_after[start] = count
+    num_of_chunks = min_chunks_before[num_of_items]
+
+    # best[end][count]: the least sum of squared chunk sizes of items[:end] in count chunks, and the last chunk start.
+    best: List[dict] = [{0: (0, -1)}] + [{} for _ in range(num_of_items)]
+    for end in range(1, num_of_items + 1):
+        for count in range(min_chunks_before[end], num_of_chunks - min_chunks_after[end] + 1):
+            candidates = best[end]
+            for start in range(end - 1, -1, -1):
+                size = chunk_size(start, end)
+                if size > max_tokens:
+                    break
+                previous = best[start].get(count - 1)
+                if previous is not None and (count not in candidates or
+                                             previous[0] + size * size < candidates[count][0]):
+                    candidates[count] = (previous[0] + size * size, start)
+
+    boundaries = [num_of_items]
+    for count in range(num_of_chunks, 0, -1):
+        boundaries.append(best[boundaries[-1]][count][1])
+    boundaries.reverse()
+    for start, end in zip(boundaries, boundaries[1:]):
+        pieces: List = []
+        for position in range(start, end):
+            kind, item = items[position]
+            if kind == PARAGRAPH:
+                pieces.append(item)
+            elif kind == SENTENCE and position > start:
+                pieces[-1].append(item)
             else:
-                chunk_tokens += (para_tokens + 1 if chunk_paragraphs else para_tokens)
-                chunk_paragraphs.append(paragraph)
-        if chunk_paragraphs:
-            counter += 1
-            yield Chunk(counter, chunk_tokens, doc_id, tuple(chunk_paragraphs))
+                pieces.append([item])
+        yield chunk_size(start, end), pieces
+
+
+def paragraph_spans(text: str) -> List[Tuple[int, int]]:
+    """Return the spans of the paragraphs of a text, as split by re.split(PARA_REGEX, text.strip())."""
+    start = len(text) - len(text.lstrip())
+    end = max(start, len(text.rstrip()))
+    spans = []
+    for match in PARA_PATTERN.finditer(text, start, end):
+        spans.append((start, match.start()))
+        start = match.end()
+    spans.append((start, end))
+    return spans
+
+
+def sentence_spans(text: str) -> Iterator[Tuple[int, int]]:
+    """Iterate the spans of the sentences of a text, as split by nltk's sent_tokenize."""
+    return load("tokenizers/punkt/english.pickle").span_tokenize(text)
 
 
+def join_spans(pieces: List) -> Iterator[Tuple[int, ...]]:
+    """Iterate the spans of the paragraphs of the pieces of a chunk, the sentences of a split paragraph flattened."""
+    for piece in pieces:
+        yield tuple(offset for span in piece for offset in span) if isinstance(piece, list) else piece
 
 
+def join_pieces(pieces: List) -> Iterator[str]:
+    """Iterate the paragraphs of the pieces of a chunk, joining the sentences of a split paragraph with a space."""
+    for piece in pieces:
+        yield " ".join(piece) if isinstance(piece, list) else piece
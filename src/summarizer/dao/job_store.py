@@ -0,0 +1,151 @@
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, Optional
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+DEFAULT_LEASE_SECONDS = 60.0
+"""The seconds a process owns its unfinished jobs without renewing its lease, after which they can be claimed."""
+
+logger = logging.getLogger(__name__)
+
+
+class JobStore:
+    """A persistent store of summarization jobs backed by SQLite, shared by the service workers.
+
+    A job holds its input documents, its progress, and finally its result, so it can be polled from any worker and it
+    survives the worker that ran it. Each unfinished job is owned by the process that runs it, by a token unique to
+    that process, for a lease that the process renews while it is alive. The jobs whose lease has expired, e.g., of a
+    worker that was killed or of a container that was restarted, can be claimed by another process. The updates of a
+    job by its owner (start, progress, succeed and fail) return the number of jobs updated: zero once the job is owned
+    by another process, so that the former owner stops running it.
+    """
+
+    def __init__(self, db_file: str, lease_seconds: float = DEFAULT_LEASE_SECONDS):
+        self.db_file = db_file
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job (id TEXT PRIMARY KEY, status TEXT NOT NULL, documents TEXT NOT NULL, "
+            "num_of_documents INTEGER NOT NULL, chunks_done INTEGER NOT NULL DEFAULT 0, "
+            "chunks_total INTEGER NOT NULL DEFAULT 0, result TEXT, error TEXT, owner TEXT, lease_until REAL, "
+            "created REAL NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def create(self, documents: List[Dict], owner: str) -> str:
+        """Store a new queued job of the given documents, i.e., {"text": ..., "doc_id": ...}, owned by the given owner
+        token, and return its id."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO job (id, status, documents, num_of_documents, owner, lease_until, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(documents), len(documents), owner, now + self.lease_seconds, now, now)
+            )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Return the status and progress of the given job, or None if there is no such job."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, num_of_documents, chunks_done, chunks_total, error, created, updated FROM job "
+                "WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        status, num_of_documents, chunks_done, chunks_total, error, created, updated = row
+        return {
+            "job_id": job_id,
+            "status": status,
+            "num_of_documents": num_of_documents,
+            "chunks_done": chunks_done,
+            "chunks_total": chunks_total,
+            "error": error,
+            "created": created,
+            "updated": updated,
+        }
+
+    def documents(self, job_id: str) -> List[Dict]:
+        """Return the input documents of the given job."""
+        with self._lock:
+            row = self._conn.execute("SELECT documents FROM job WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0])
+
+    def result(self, job_id: str) -> Optional[List[Dict]]:
+        """Return the summaries of a succeeded job, i.e., {"doc_id": ..., "summary": ...} per document."""
+        with self._lock:
+            row = self._conn.execute("SELECT result FROM job WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] is not None else None
+
+    def start(self, job_id: str, owner: str, chunks_total: int) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE job SET status = ?, chunks_done = 0, chunks_total = ?, updated = ? "
+                "WHERE id = ? AND owner = ?", (RUNNING, chunks_total, time.time(), job_id, owner)
+            ).rowcount
+
+    def progress(self, job_id: str, owner: str, chunks_done: int, chunks_total: Optional[int] = None) -> int:
+        """Record the chunks done, and the chunks total if given, e.g., as the documents are chunked."""
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE job SET chunks_done = ?, chunks_total = COALESCE(?, chunks_total), updated = ? "
+                "WHERE id = ? AND owner = ?", (chunks_done, chunks_total, time.time(), job_id, owner)
+            ).rowcount
+
+    def succeed(self, job_id: str, owner: str, result: List[Dict]) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE job SET status = ?, result = ?, owner = NULL, lease_until = NULL, updated = ? "
+                "WHERE id = ? AND owner = ?", (SUCCEEDED, json.dumps(result), time.time(), job_id, owner)
+            ).rowcount
+
+    def fail(self, job_id: str, owner: str, error: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE job SET status = ?, error = ?, owner = NULL, lease_until = NULL, updated = ? "
+                "WHERE id = ? AND owner = ?", (FAILED, error, time.time(), job_id, owner)
+            ).rowcount
+
+    def renew(self, owner: str) -> int:
+        """Extend the lease of the unfinished jobs of the given owner, return their number."""
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE job SET lease_until = ? WHERE owner = ? AND status IN (?, ?)",
+                (time.time() + self.lease_seconds, owner, QUEUED, RUNNING)
+            ).rowcount
+
+    def claim_orphans(self, owner: str, limit: int) -> List[str]:
+        """Requeue up to limit unfinished jobs of other owners whose lease has expired under the given owner, return
+        their ids."""
+        claimed = []
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, owner FROM job WHERE status IN (?, ?) AND (lease_until IS NULL OR lease_until < ?) "
+                "AND owner IS NOT ? ORDER BY created LIMIT ?", (QUEUED, RUNNING, now, owner, limit)
+            ).fetchall()
+            for job_id, old_owner in rows:
+                # Unless another process claimed it, or its owner renewed the lease, meanwhile.
+                cursor = self._conn.execute(
+                    "UPDATE job SET status = ?, owner = ?, lease_until = ?, updated = ? WHERE id = ? AND owner IS ? "
+                    "AND status IN (?, ?) AND (lease_until IS NULL OR lease_until < ?)",
+                    (QUEUED, owner, now + self.lease_seconds, now, job_id, old_owner, QUEUED, RUNNING, now)
+                )
+                if cursor.rowcount == 1:
+                    claimed.append(job_id)
+        if claimed:
+            logger.info(f"Owner: {owner} - claimed orphaned jobs: {claimed}")
+        return claimed
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,113 @@
+import time
+import sqlite3
+import logging
+import threading
+from typing import Dict, Optional
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+"""The default size budget of a summary cache, 512 MiB of keys and summaries."""
+
+logger = logging.getLogger(__name__)
+
+
+class SummaryCache:
+    """A persistent, content-addressed summary store backed by SQLite, with size-based LRU eviction.
+
+    The cache file can be shared by several processes (e.g., gunicorn workers), SQLite serializes the writes. The
+    total size of the summaries is kept in the summary_total row, updated in the transaction of each write, so that a
+    put does not scan the table, and the least recently used summaries are found by the last_access index.
+    """
+
+    def __init__(self, db_file: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.db_file = db_file
+        self.max_bytes = max_bytes
+        self.hits = 0
+        """The number of lookups served from the cache by this instance."""
+        self.misses = 0
+        """The number of lookups not found in the cache by this instance."""
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS summary "
+            "(key TEXT PRIMARY KEY, summary TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS summary_last_access ON summary (last_access)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS summary_total (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER NOT NULL)"
+        )
+        # Summed once, for a cache file written before the total was kept.
+        self._conn.execute("INSERT OR IGNORE INTO summary_total (id, size) SELECT 0, TOTAL(size) FROM summary")
+        logger.info(f"Summary cache opened: {db_file}, max_bytes: {max_bytes}")
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached summary of the given key, or None if it is not cached."""
+        with self._lock:
+            row = self._conn.execute("SELECT summary FROM summary WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE summary SET last_access = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, key: str, summary: str):
+        """Cache the summary of the given key, evicting the least recently used summaries beyond max_bytes."""
+        size = len(key) + len(summary.encode("utf-8"))
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT size FROM summary WHERE key = ?", (key,)).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO summary (key, summary, size, last_access) VALUES (?, ?, ?, ?)",
+                    (key, summary, size, time.time())
+                )
+                old_size = row[0] if row else 0
+                self._conn.execute("UPDATE summary_total SET size = size + ? WHERE id = 0", (size - old_size,))
+                self._evict()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _evict(self):
+        """Delete the least recently used summaries beyond max_bytes, in the transaction of the put."""
+        excess = self._total_size() - self.max_bytes
+        if excess <= 0:
+            return
+        evicted_keys = []
+        evicted_size = 0
+        for key, size in self._conn.execute("SELECT key, size FROM summary ORDER BY last_access"):
+            evicted_keys.append((key,))
+            evicted_size += size
+            if evicted_size >= excess:
+                break
+        self._conn.executemany("DELETE FROM summary WHERE key = ?", evicted_keys)
+        self._conn.execute("UPDATE summary_total SET size = size - ? WHERE id = 0", (evicted_size,))
+        logger.info(f"Summary cache evicted {len(evicted_keys)} summaries.")
+
+    def _total_size(self) -> int:
+        return int(self._conn.execute("SELECT size FROM summary_total WHERE id = 0").fetchone()[0])
+
+    def size(self) -> int:
+        """Return the total size in bytes of the cached keys and summaries."""
+        with self._lock:
+            return self._total_size()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM summary").fetchone()[0]
+
+    def stats(self) -> Dict:
+        """Return hit/miss counters of this instance and the current cache size."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "entries": len(self),
+            "bytes": self.size(),
+        }
+
+    def close(self):
+        self._conn.close()
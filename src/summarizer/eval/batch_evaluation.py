@@ -0,0 +1,220 @@
+"""Batch evaluation engine, scoring a corpus with the same ROUGE and BLEU scores as get_eval_score, but faster.
+
+Each text is tokenized once: the Punkt sentences of a text are tokenized into words once, and the words of the text
+are their concatenation, exactly as word_tokenize does. Words are mapped to integer ids, so that the n-gram overlaps
+are array operations and the LCS table of ROUGE-L is computed a row at a time. The documents are spread across a
+pool of processes.
+"""
+import os
+import math
+import jsonlines
+import numpy as np
+import pandas as pd
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from nltk.tokenize import sent_tokenize, NLTKWordTokenizer
+from nltk.translate.bleu_score import brevity_penalty, closest_ref_length
+from summarizer.util import GOLD_SUM_FIELD, MODEL_SUM_FIELD
+from summarizer.eval.evaluation import aggregate_scores
+from summarizer.eval.score_aggregator import ScoreAggregator
+
+WORD_TOKENIZER = NLTKWordTokenizer()
+"""The Treebank word tokenizer of nltk.word_tokenize."""
+
+BATCH_SIZE = 256
+"""The number of lines scored by the process pool at a time, bounding the lines held in memory."""
+
+
+class Vocabulary:
+    """Map words to consecutive integer ids."""
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+
+    def encode(self, words: Iterable[str]) -> np.ndarray:
+        return np.fromiter((self.ids.setdefault(word, len(self.ids)) for word in words), dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def rouge_sentences(text: str) -> List[str]:
+    """Split a text into the sentences of the rouge package: on periods, with normalized whitespace."""
+    return [" ".join(sentence.split()) for sentence in text.split(".") if len(sentence) > 0]
+
+
+def word_sentences(text: str) -> List[List[str]]:
+    """Return the words of each Punkt sentence of the text; their concatenation is word_tokenize(text)."""
+    return [WORD_TOKENIZER.tokenize(sentence) for sentence in sent_tokenize(text)]
+
+
+def get_rouge_n(hyp_ids: np.ndarray, ref_ids: np.ndarray, n: int, vocab_size: int) -> Dict:
+    """Return ROUGE-N of the rouge package, i.e., over the distinct n-grams of the hypothesis and the reference."""
+    hyp_ngrams = np.unique(ngram_keys(hyp_ids, n, vocab_size))
+    ref_ngrams = np.unique(ngram_keys(ref_ids, n, vocab_size))
+    overlap = np.intersect1d(hyp_ngrams, ref_ngrams, assume_unique=True).size
+    return f_r_p(int(hyp_ngrams.size), int(ref_ngrams.size), int(overlap))
+
+
+def ngram_keys(ids: np.ndarray, n: int, vocab_size: int) -> np.ndarray:
+    """Return an integer key per n-gram of the given word ids."""
+    if ids.size < n:
+        return np.empty(0, dtype=np.int64)
+    keys = ids[:ids.size - n + 1].copy()
+    for offset in range(1, n):
+        keys = keys * vocab_size + ids[offset:ids.size - n + 1 + offset]
+    return keys
+
+
+def f_r_p(evaluated_count: int, reference_count: int, overlapping_count: int) -> Dict:
+    """Return the scores as rouge_score.f_r_p_rouge_n does, in the order of the rouge package."""
+    precision = overlapping_count / evaluated_count if evaluated_count else 0.0
+    recall = overlapping_count / reference_count if reference_count else 0.0
+    f1_score = 2.0 * ((precision * recall) / (precision + recall + 1e-8))
+    return {"r": recall, "p": precision, "f": f1_score}
+
+
+def lcs_words(x: np.ndarray, ys: np.ndarray, lengths: List[int]) -> Set[int]:
+    """Return the words of x in its longest common subsequences with each of ys, as reconstructed by the rouge package.
+
+    ys holds a sequence per row, padded with -1 to the longest of the given lengths, so that the LCS tables of x
+    with all of them are computed together, a row (i.e., a word of x) at a time.
+    """
+    words: Set[int] = set()
+    if x.size == 0:
+        return words
+    matches = x[:, None, None] == ys[None, :, :]
+    tables = np.zeros((x.size + 1, ys.shape[0], ys.shape[1] + 1), dtype=np.int32)
+    for i in range(1, x.size + 1):
+        # A row of the LCS table is the running maximum of the diagonal + 1 on matches and the row above otherwise.
+        candidates = np.where(matches[i - 1], tables[i - 1, :, :-1] + 1, tables[i - 1, :, 1:])
+        tables[i, :, 1:] = np.maximum.accumulate(candidates, axis=1)
+
+    for k, length in enumerate(lengths):
+        rows = tables[:, k, :].tolist()
+        row_matches = matches[:, k, :].tolist()
+        i, j = x.size, length
+        while i > 0 and j > 0:
+            if row_matches[i - 1][j - 1]:
+                words.add(int(x[i - 1]))
+                i, j = i - 1, j - 1
+            elif rows[i - 1][j] > rows[i][j - 1]:
+                i -= 1
+            else:
+                j -= 1
+    return words
+
+
+def get_rouge_l(hyp_sentences: List[np.ndarray], ref_sentences: List[np.ndarray]) -> Dict:
+    """Return the summary level ROUGE-L of the rouge package, i.e., over the union of distinct LCS words."""
+    lengths = [ids.size for ids in hyp_sentences]
+    padded_hyp = np.full((len(hyp_sentences), max(lengths)), -1, dtype=np.int64)
+    for k, ids in enumerate(hyp_sentences):
+        padded_hyp[k, :ids.size] = ids
+
+    union: Set[int] = set()
+    for ref_ids in ref_sentences:
+        union |= lcs_words(ref_ids, padded_hyp, lengths)
+    num_of_ref_words = len(set().union(*(ids.tolist() for ids in ref_sentences)))
+    num_of_hyp_words = len(set().union(*(ids.tolist() for ids in hyp_sentences)))
+
+    llcs = len(union)
+    r_lcs = llcs / num_of_ref_words
+    p_lcs = llcs / num_of_hyp_words
+    f_lcs = 2.0 * ((p_lcs * r_lcs) / (p_lcs + r_lcs + 1e-8))
+    return {"r": r_lcs, "p": p_lcs, "f": f_lcs}
+
+
+def get_bleu_1(references: List[np.ndarray], hypothesis: np.ndarray, vocab_size: int):
+    """Return sentence_bleu with unigram weights and smoothing method4, from word id arrays."""
+    hyp_counts = np.bincount(hypothesis, minlength=vocab_size)
+    max_ref_counts = np.zeros(vocab_size, dtype=np.int64)
+    for reference in references:
+        np.maximum(max_ref_counts, np.bincount(reference, minlength=vocab_size), out=max_ref_counts)
+    numerator = int(np.minimum(hyp_counts, max_ref_counts).sum())
+    if numerator == 0:
+        return 0
+
+    hyp_len = int(hypothesis.size)
+    denominator = max(1, hyp_len)
+    bp = brevity_penalty(closest_ref_length([reference.tolist() for reference in references], hyp_len), hyp_len)
+    # The weights of the higher n-gram orders are 0, so they add nothing to the log-sum.
+    return bp * math.exp(math.fsum([math.log(numerator / denominator)]))
+
+
+def get_eval_score(candidate: str, reference: str) -> Dict:
+    """Return the same rouge and bleu scores as evaluation.get_eval_score."""
+    hyp_rouge = rouge_sentences(candidate)
+    ref_rouge = rouge_sentences(reference)
+    if not hyp_rouge:
+        raise ValueError("Hypothesis is empty.")
+    if not ref_rouge:
+        raise ValueError("Reference is empty.")
+
+    vocab = Vocabulary()
+    hyp_sentence_ids = [vocab.encode(sentence.split(" ")) for sentence in hyp_rouge]
+    ref_sentence_ids = [vocab.encode(sentence.split(" ")) for sentence in ref_rouge]
+    hyp_ids, ref_ids = np.concatenate(hyp_sentence_ids), np.concatenate(ref_sentence_ids)
+    score = {
+        "rouge-1": get_rouge_n(hyp_ids, ref_ids, 1, len(vocab)),
+        "rouge-2": get_rouge_n(hyp_ids, ref_ids, 2, len(vocab)),
+        "rouge-l": get_rouge_l(hyp_sentence_ids, ref_sentence_ids),
+    }
+
+    reference_words, ref_sentence_words = [], []
+    for sentence in sent_tokenize(reference):
+        words = WORD_TOKENIZER.tokenize(sentence)
+        reference_words.extend(words)
+        # word_tokenize(sentence) splits the sentence again, which Punkt rarely does.
+        sub_sentences = sent_tokenize(sentence)
+        if len(sub_sentences) != 1 or sub_sentences[0] != sentence:
+            words = [word for sub_sentence in sub_sentences for word in WORD_TOKENIZER.tokenize(sub_sentence)]
+        ref_sentence_words.append(words)
+    candidate_words = [word for words in word_sentences(candidate) for word in words]
+
+    vocab = Vocabulary()
+    candidate_bleu = vocab.encode(candidate_words)
+    sentences_bleu = [vocab.encode(words) for words in ref_sentence_words]
+    reference_bleu = [vocab.encode(reference_words)]
+    score["bleu-1"] = get_bleu_1(reference_bleu, candidate_bleu, len(vocab))
+    score["bleu-2"] = get_bleu_1(sentences_bleu, candidate_bleu, len(vocab))
+    return score
+
+
+def score_line(line: Dict) -> Dict:
+    line["eval_score"] = get_eval_score(candidate=line[MODEL_SUM_FIELD], reference=line[GOLD_SUM_FIELD])
+    return line
+
+
+def iter_scored_lines(lines: Iterable[Dict], max_workers: int = None) -> Iterator[Dict]:
+    """Score the given lines across max_workers processes (all cores by default), yielding them in order."""
+    max_workers = max_workers or os.cpu_count()
+    if max_workers == 1:
+        yield from map(score_line, lines)
+        return
+
+    lines = iter(lines)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            batch = list(islice(lines, BATCH_SIZE))
+            if not batch:
+                return
+            yield from executor.map(score_line, batch, chunksize=max(1, len(batch) // (4 * max_workers)))
+
+
+def evaluate(
+        file_path: str, max_workers: int = None, with_dataframe: bool = True
+) -> Tuple[Dict, Optional[pd.DataFrame]]:
+    """Same as evaluation.evaluate, scoring the lines with the batch engine across max_workers processes."""
+    aggregator, scores_df = evaluate_file(file_path, max_workers, with_dataframe)
+    return aggregator.avg_score(), scores_df
+
+
+def evaluate_file(
+        file_path: str, max_workers: int = None, with_dataframe: bool = False
+) -> Tuple[ScoreAggregator, Optional[pd.DataFrame]]:
+    """Score the file into its _eval.jsonl file, return the aggregated scores, e.g., for their percentiles."""
+    eval_file_path = file_path.split(".")[0] + "_eval.jsonl"
+    with jsonlines.open(eval_file_path, mode="w") as writer:
+        return aggregate_scores(iter_scored_lines(jsonlines.open(file_path), max_workers), with_dataframe, writer)
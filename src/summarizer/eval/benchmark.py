@@ -0,0 +1,280 @@
+"""Benchmark the throughput, latency and CPU time of the summarizer stages against a mock completion server.
+
+The stages are the chunker alone, TextSummarizer, the batch script (BatchRunner) and the Flask container, each over
+the same corpus of BookSum chapters. The results are a JSON-serializable dict, which can be compared with the
+results of a previous run to catch regressions, see compare.
+"""
+import os
+import sys
+import json
+import time
+import resource
+import tempfile
+import subprocess
+import openai
+import requests
+import numpy as np
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+from summarizer.batch_runner import BatchRunner, booksum_doc_id
+from summarizer.dao.chunker import TextChunker
+from summarizer.model.gpt3_summarizer import Gpt3Summarizer
+from summarizer.model.summarizer import SummarizerFactory, TextSummarizer
+from summarizer.model.token_counter import TOKEN_COUNTER, TokenCounter
+from summarizer.util import TEXT_FIELD, MODEL_SUM_FIELD
+from summarizer.profiling import profiled
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+"""The source directory of the summarizer package, added to the PYTHONPATH of the subprocesses."""
+
+CONTAINER_SCRIPT = os.path.join(SRC_DIR, "sm_container", "summarizer_service.py")
+"""The Flask service of the container, run as a subprocess, see container_process."""
+
+CONTAINER_URL = "http://127.0.0.1:8080"
+"""The URL the Flask service listens on, when run as a script."""
+
+STAGES = ("chunker", "text_summarizer", "batch", "container")
+"""The stages benchmarked, in order."""
+
+REGRESSION_METRICS = {"docs_per_sec": -1, "p50_seconds": 1, "p99_seconds": 1, "cpu_seconds_per_doc": 1}
+"""The metrics compared with a baseline, with the sign of a regression: lower throughput, or higher latency or CPU."""
+
+
+def load_corpus(input_file: str, repeat: int = 1) -> List[Dict]:
+    """Return the lines of a BookSum JSON Lines file, repeat times, each copy of a line with its own document id."""
+    with open(input_file, "r", encoding="utf-8") as file_obj:
+        lines = [json.loads(raw_line) for raw_line in file_obj if raw_line.strip()]
+    corpus = list(lines)
+    for copy in range(1, repeat):
+        for line in lines:
+            metadata = dict(line["metadata"], chapter_path=f"{line['metadata']['chapter_path']}#{copy}")
+            corpus.append(dict(line, metadata=metadata))
+    return corpus
+
+
+def cold_chunker(max_tokens: int, balanced: bool = False) -> TextChunker:
+    """Return a chunker that memoizes no token counts, so that the repeated chapters of a corpus are tokenized each
+    time, as unique documents would be."""
+    return TextChunker(max_tokens, TokenCounter(TOKEN_COUNTER.backend, cache_size=0), balanced)
+
+
+def stage_stats(latencies: List[float], seconds: float, cpu_seconds: float, failed: int = 0) -> Dict:
+    """Return the throughput, latency percentiles and CPU time of a stage that processed len(latencies) documents."""
+    num_of_docs = len(latencies)
+    return {
+        "docs": num_of_docs,
+        "failed": failed,
+        "seconds": seconds,
+        "docs_per_sec": num_of_docs / seconds if seconds else 0.0,
+        "p50_seconds": float(np.percentile(latencies, 50)) if latencies else None,
+        "p99_seconds": float(np.percentile(latencies, 99)) if latencies else None,
+        "cpu_seconds": cpu_seconds,
+        "cpu_seconds_per_doc": cpu_seconds / num_of_docs if num_of_docs else None
+    }
+
+
+def measure(process: Callable[[Dict], object], corpus: Iterable[Dict], max_docs: int = 1) -> Dict:
+    """Process the documents of the corpus, max_docs at a time, and return the stats of the stage.
+
+    The CPU time is the one of this process, i.e., of the summarizer, since the mock server runs in another one.
+    """
+    latencies: List[float] = []
+    failures: List[Exception] = []
+
+    def process_timed(line: Dict):
+        start = time.perf_counter()
+        try:
+            process(line)
+        except Exception as ex:
+            failures.append(ex)
+            return
+        latencies.append(time.perf_counter() - start)
+
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_docs) as executor:
+        list(executor.map(process_timed, corpus))
+    return stage_stats(latencies, time.perf_counter() - start, time.process_time() - cpu_start, len(failures))
+
+
+def bench_chunker(corpus: List[Dict], max_tokens: int, balanced: bool = False) -> Dict:
+    """Chunk each document, one at a time, since chunking is CPU bound."""
+    chunker = cold_chunker(max_tokens, balanced)
+    return measure(lambda line: list(chunker.chunk_generator_from_text(line[TEXT_FIELD], booksum_doc_id(line))),
+                   corpus)
+
+
+def bench_text_summarizer(corpus: List[Dict], text_summarizer: TextSummarizer, max_docs: int) -> Dict:
+    """Summarize the documents, max_docs at a time."""
+    return measure(lambda line: text_summarizer.summarize_text(line[TEXT_FIELD], booksum_doc_id(line)), corpus,
+                   max_docs)
+
+
+def bench_batch(corpus: List[Dict], text_summarizer: TextSummarizer, max_docs: int) -> Dict:
+    """Summarize the documents with a BatchRunner from and to JSON Lines files, as the batch scripts do."""
+    latencies: List[float] = []
+
+    def summarize_line(line: Dict) -> Dict:
+        start = time.perf_counter()
+        line[MODEL_SUM_FIELD] = text_summarizer.summarize_text(line[TEXT_FIELD], booksum_doc_id(line))
+        latencies.append(time.perf_counter() - start)
+        return line
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_file = os.path.join(tmp_dir, "input.jsonl")
+        with open(input_file, "w", encoding="utf-8") as file_obj:
+            file_obj.writelines(json.dumps(line) + "\n" for line in corpus)
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        outcomes = BatchRunner(summarize_line, max_workers=max_docs).run(
+            input_file, os.path.join(tmp_dir, "output.jsonl")
+        )
+        seconds, cpu_seconds = time.perf_counter() - start, time.process_time() - cpu_start
+    return stage_stats(latencies, seconds, cpu_seconds, outcomes["failed"])
+
+
+def bench_endpoint(corpus: List[Dict], url: str, max_docs: int) -> Dict:
+    """POST the documents to the /invocations route of a running service, max_docs at a time.
+
+    The CPU time is the one of the client; see run_benchmark for the CPU time of a container it starts.
+    """
+    session = requests.Session()
+
+    def invoke(line: Dict):
+        payload = {TEXT_FIELD: line[TEXT_FIELD], "doc_id": booksum_doc_id(line)}
+        session.post(f"{url}/invocations", json=payload).raise_for_status()
+
+    return measure(invoke, corpus, max_docs)
+
+
+def children_cpu_seconds() -> float:
+    """Return the CPU time of the terminated child processes of this process."""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def subprocess_env(**variables: str) -> Dict[str, str]:
+    """Return the environment of a subprocess, which imports the summarizer package from SRC_DIR."""
+    python_path = os.pathsep.join(path for path in (SRC_DIR, os.environ.get("PYTHONPATH")) if path)
+    return dict(os.environ, PYTHONPATH=python_path, **variables)
+
+
+@contextmanager
+def mock_server_process(**options) -> Iterator[str]:
+    """Run a MockCompletionServer in a subprocess, with the given options of its command line, and yield its URL."""
+    command = [sys.executable, "-m", "summarizer.eval.mock_completion_server"]
+    command += [f"--{name}={value}" for name, value in options.items() if value is not None]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True, env=subprocess_env())
+    try:
+        url = process.stdout.readline().strip()
+        if not url:
+            raise RuntimeError(f"The mock completion server exited with code: {process.wait()}")
+        yield url
+    finally:
+        process.terminate()
+        process.wait()
+
+
+@contextmanager
+def container_process(api_base: str, url: str = CONTAINER_URL, timeout: float = 120.0) -> Iterator[str]:
+    """Run the Flask service of the container in a subprocess, against the given API, and yield its URL once it is
+    healthy. As in run_benchmark, its rate limiter is disabled, so it neither waits for nor spends the budget of the
+    host shared by the real summarizers, in the rate limit file."""
+    if not os.path.exists(CONTAINER_SCRIPT):
+        raise RuntimeError(f"The container service is not found: {CONTAINER_SCRIPT}")
+    process = subprocess.Popen(
+        [sys.executable, CONTAINER_SCRIPT], cwd=os.path.dirname(CONTAINER_SCRIPT),
+        env=subprocess_env(OPENAI_API_BASE=api_base, OPENAI_RATE_LIMITED="false"), stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"The container service exited with code: {process.returncode}")
+            try:
+                if requests.get(f"{url}/ping", timeout=5).status_code == 200:
+                    break
+            except requests.ConnectionError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"The container service is not healthy after {timeout}s")
+            time.sleep(0.5)
+        yield url
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def run_benchmark(
+        corpus: List[Dict],
+        api_base: str,
+        stages: Iterable[str] = STAGES,
+        max_docs: int = 4,
+        max_workers: int = 8,
+        balanced: bool = False,
+        endpoint_url: Optional[str] = None
+) -> Dict:
+    """Run the given stages over the corpus against the completion API at api_base, e.g., a mock server.
+
+    The rate limiter of the summarizer is disabled, so that the throughput is the one of the summarizer; the rate
+    limit of the API is simulated by the 429 responses of the mock server instead. The container stage benchmarks
+    the service at endpoint_url if given, otherwise it starts one, whose CPU time, including its start, is reported as
+    server_cpu_seconds. Each stage is profiled if opted in by the SUMMARIZER_PROFILE environment variable, see
+    profiling.profiled.
+    """
+    results: Dict[str, Dict] = {}
+    api_base_before = openai.api_base
+    openai.api_base = api_base
+    try:
+        summarizer: Gpt3Summarizer = SummarizerFactory.create_summarizer("gpt3")
+        summarizer.rate_limiter = None
+        text_summarizer = TextSummarizer(summarizer, max_workers, balanced)
+        text_summarizer.chunker = cold_chunker(summarizer.text_tokens, balanced)
+        TOKEN_COUNTER.warm_up()
+
+        for stage in stages:
+            with profiled(f"benchmark-{stage}"):
+                results[stage] = run_stage(stage, corpus, text_summarizer, max_docs, api_base, endpoint_url)
+    finally:
+        openai.api_base = api_base_before
+    return results
+
+
+def run_stage(stage: str, corpus: List[Dict], text_summarizer: TextSummarizer, max_docs: int, api_base: str,
+              endpoint_url: Optional[str] = None) -> Dict:
+    """Run a stage of run_benchmark, with the given text summarizer."""
+    if stage == "chunker":
+        return bench_chunker(corpus, text_summarizer.chunker.max_tokens, text_summarizer.chunker.balanced)
+    if stage == "text_summarizer":
+        return bench_text_summarizer(corpus, text_summarizer, max_docs)
+    if stage == "batch":
+        return bench_batch(corpus, text_summarizer, max_docs)
+    if stage == "container" and endpoint_url:
+        return bench_endpoint(corpus, endpoint_url, max_docs)
+    if stage == "container":
+        cpu_start = children_cpu_seconds()
+        with container_process(api_base) as url:
+            stats = bench_endpoint(corpus, url, max_docs)
+        stats["server_cpu_seconds"] = children_cpu_seconds() - cpu_start
+        return stats
+    raise NotImplementedError(f"Benchmark stage: {stage} is not implemented yet.")
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float = 0.2) -> List[str]:
+    """Return the regressions of the stages of a benchmark report from those of a baseline report, i.e., of a previous
+    run of scripts/run_benchmark.py, beyond the relative tolerance."""
+    regressions = []
+    for stage, stats in results.get("stages", {}).items():
+        base_stats = baseline.get("stages", {}).get(stage)
+        if not base_stats:
+            continue
+        for metric, sign in REGRESSION_METRICS.items():
+            value, base_value = stats.get(metric), base_stats.get(metric)
+            if value is None or not base_value:
+                continue
+            change = (value - base_value) / base_value
+            if sign * change > tolerance:
+                regressions.append(f"{stage}.{metric}: {base_value:.4g} -> {value:.4g} ({change:+.1%})")
+    return regressions
@@ -0,0 +1,143 @@
+"""Micro-benchmarks of the chunker hot path over synthetic and real corpora.
+
+A case is a corpus chunked by a chunker method, e.g., short paragraphs chunked from a text, or a text with Windows
+line endings chunked from a byte stream, or split into sentences ranked by LexRank, the hot path of the extractive
+summarizer. Each case is chunked a number of runs with a token counter that memoizes
+nothing, so that each run tokenizes the corpus as unique documents would be. The stats of a case have the same
+fields as those of a benchmark stage, so that the reports are compared by benchmark.compare.
+"""
+import io
+import re
+import time
+import random
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+from summarizer.dao.chunker import TextChunker, sentence_spans
+from summarizer.eval.benchmark import cold_chunker, load_corpus, stage_stats
+from summarizer.model.extractive_summarizer import lexrank
+from summarizer.profiling import profiled
+from summarizer.util import TEXT_FIELD
+
+WORD_REGEX = re.compile(r"[A-Za-z']+")
+
+SENTENCE_WORDS = 16
+"""The number of words of a synthetic sentence."""
+
+
+class Case(NamedTuple):
+    """A corpus and how it is chunked."""
+
+    texts: List[str]
+    """The documents of the corpus."""
+    method: str
+    """The chunker method: text, i.e., chunk_generator_from_text, stream, i.e., chunk_generator_from_stream, or
+    lexrank, i.e., the LexRank of the sentences of a text."""
+
+
+def synthetic_text(
+        num_of_paragraphs: int,
+        paragraph_words: int,
+        vocabulary: List[str],
+        line_ending: str = "\n",
+        seed: int = 0
+) -> str:
+    """Return a text of num_of_paragraphs paragraphs of paragraph_words words of the vocabulary, in sentences of
+    SENTENCE_WORDS words, the paragraphs separated by an empty line of the given line ending."""
+    rand = random.Random(seed)
+    paragraphs = []
+    for _ in range(num_of_paragraphs):
+        words = rand.choices(vocabulary, k=paragraph_words)
+        sentences = [" ".join(words[start:start + SENTENCE_WORDS]).capitalize() + "."
+                     for start in range(0, paragraph_words, SENTENCE_WORDS)]
+        paragraphs.append(" ".join(sentences))
+    return (line_ending * 2).join(paragraphs) + line_ending
+
+
+def corpus_vocabulary(texts: Iterable[str]) -> List[str]:
+    """Return the distinct words of the given texts, in order, so that synthetic texts tokenize like real ones."""
+    return list(dict.fromkeys(word.lower() for text in texts for word in WORD_REGEX.findall(text)))
+
+
+def default_cases(input_file: str, max_tokens: int, num_of_docs: int = 10) -> Dict[str, Case]:
+    """Return the default cases: paragraph sizes from a sentence to the long-paragraph fallback, Windows line
+    endings, the real documents of a BookSum JSON Lines file, from a text and from a stream, and the LexRank of a
+    document of thousands of sentences."""
+    real_texts = [line[TEXT_FIELD] for line in load_corpus(input_file)[:num_of_docs]]
+    vocabulary = corpus_vocabulary(real_texts)
+    words_per_doc = 8000
+
+    def synthetic(paragraph_words: int, line_ending: str = "\n") -> List[str]:
+        return [synthetic_text(max(1, words_per_doc // paragraph_words), paragraph_words, vocabulary, line_ending, seed)
+                for seed in range(num_of_docs)]
+
+    long_words = 2 * max_tokens  # More tokens than max_tokens, so that they are split into sentences
+    return {
+        "short_paragraphs": Case(synthetic(SENTENCE_WORDS), "text"),
+        "medium_paragraphs": Case(synthetic(120), "text"),
+        "long_paragraphs": Case(synthetic(max_tokens // 2), "text"),
+        "long_paragraph_fallback": Case(synthetic(long_words), "text"),
+        "crlf_paragraphs": Case(synthetic(120, "\r\n"), "text"),
+        "crlf_stream": Case(synthetic(120, "\r\n"), "stream"),
+        "booksum": Case(real_texts, "text"),
+        "booksum_stream": Case(real_texts, "stream"),
+        "lexrank_large": Case([synthetic_text(400, 15 * SENTENCE_WORDS, vocabulary)], "lexrank"),
+    }
+
+
+def chunk_function(chunker: TextChunker, method: str) -> Callable[[str], int]:
+    """Return a function chunking a text with the given chunker method, and returning the number of chunks, or of
+    sentences ranked by lexrank."""
+    if method == "text":
+        return lambda text: sum(1 for _ in chunker.chunk_generator_from_text(text, "bench"))
+    if method == "stream":
+        return lambda text: sum(1 for _ in chunker.chunk_generator_from_stream(io.BytesIO(text.encode()), "bench"))
+    if method == "lexrank":
+        return lambda text: len(lexrank([text[start:end] for start, end in sentence_spans(text)]))
+    raise NotImplementedError(f"Chunker method: {method} is not implemented yet.")
+
+
+def bench_case(case: Case, max_tokens: int, runs: int = 5, balanced: bool = False) -> Dict:
+    """Chunk the corpus of the case runs times, and return the stats of a run, i.e., of chunking the whole corpus.
+
+    A doc of the stats is a run, so that docs_per_sec is the runs per second, and p50_seconds the median run.
+    """
+    chunk = chunk_function(cold_chunker(max_tokens, balanced), case.method)
+    num_of_chunks = sum(chunk(text) for text in case.texts)  # Warm up, e.g., load the tokenizer and punkt
+    latencies: List[float] = []
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    for _ in range(runs):
+        run_start = time.perf_counter()
+        for text in case.texts:
+            chunk(text)
+        latencies.append(time.perf_counter() - run_start)
+    stats = stage_stats(latencies, time.perf_counter() - start, time.process_time() - cpu_start)
+
+    num_of_bytes = sum(len(text.encode("utf-8")) for text in case.texts)
+    best = min(latencies)
+    stats.update(
+        texts=len(case.texts),
+        chunks=num_of_chunks,
+        bytes=num_of_bytes,
+        mb_per_sec=num_of_bytes / best / 1e6,
+        min_seconds=best
+    )
+    return stats
+
+
+def run_chunker_benchmark(
+        cases: Dict[str, Case],
+        max_tokens: int,
+        runs: int = 5,
+        balanced: bool = False,
+        profile: Optional[Iterable[str]] = None,
+        profile_dir: Optional[str] = None
+) -> Dict[str, Dict]:
+    """Benchmark the given cases, profiling each of them with the given profilers (by default, those of the
+    SUMMARIZER_PROFILE environment variable) into profile_dir, see profiling.profiled."""
+    results = {}
+    for name, case in cases.items():
+        with profiled(f"chunker-{name}", profile, profile_dir) as reports:
+            results[name] = bench_case(case, max_tokens, runs, balanced)
+        if reports:
+            results[name]["profile"] = reports
+    return results
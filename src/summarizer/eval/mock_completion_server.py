@@ -0,0 +1,199 @@
+"""A local stand-in for the OpenAI Completion API, to benchmark the summarizer without spending OpenAI money."""
+import sys
+import json
+import math
+import time
+import random
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+CHARS_PER_TOKEN = 4
+"""The characters of a token, roughly, so that the server estimates the tokens of the usage field without a
+tokenizer, and spends as little CPU as possible."""
+
+WORDS_PER_TOKEN = 0.75
+"""The words of a token, roughly, so that a completion has about the number of tokens asked for."""
+
+logger = logging.getLogger(__name__)
+
+
+class MockCompletionServer:
+    """Serve POST <url>/completions like the OpenAI Completion API, including the batched prompts and usage fields.
+
+    The latency of a response is log-normal, its median being latency and its shape latency_sigma, plus the time to
+    generate its completion at tokens_per_second. A completion is the first words of its prompt, about
+    completion_ratio of max_tokens. A request fails with 503 (overloaded) with probability error_rate, and is
+    throttled with 429 and a Retry-After header with probability rate_limit_rate, as the OpenAI API does.
+    """
+
+    def __init__(
+            self,
+            latency: float = 0.5,
+            latency_sigma: float = 0.5,
+            tokens_per_second: float = 0.0,
+            error_rate: float = 0.0,
+            rate_limit_rate: float = 0.0,
+            retry_after: float = 0.1,
+            completion_ratio: float = 0.5,
+            host: str = "127.0.0.1",
+            port: int = 0,
+            seed: Optional[int] = None
+    ):
+        """
+        Args:
+            latency: The median seconds before a response starts.
+            latency_sigma: The standard deviation of the log of the latency, zero for a constant latency.
+            tokens_per_second: The speed of the completions, zero for an instant completion.
+            error_rate: The probability that a request fails with 503.
+            rate_limit_rate: The probability that a request is throttled with 429.
+            retry_after: The Retry-After seconds of a throttled request.
+            completion_ratio: The tokens of a completion, as a ratio of its max_tokens.
+            host: The host to listen on.
+            port: The port to listen on, zero for any free port.
+            seed: The seed of the latencies and errors, for a reproducible run.
+        """
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.completion_ratio = completion_ratio
+        self.stats = {"requests": 0, "prompts": 0, "errors": 0, "throttled": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), CompletionHandler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """The base URL of the API, e.g., the api_base of the OpenAI client."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockCompletionServer":
+        """Serve the requests in a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-completion-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockCompletionServer":
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
+
+    def respond(self, request: Dict) -> Tuple[int, Dict, Dict[str, str]]:
+        """Return the status, body and headers of the response to the given completion request, after its latency."""
+        with self._lock:
+            self.stats["requests"] += 1
+            draw = self._random.random()
+            latency = self.latency * math.exp(self.latency_sigma * self._random.gauss(0, 1)) if self.latency else 0.0
+            if draw < self.rate_limit_rate:
+                self.stats["throttled"] += 1
+            elif draw < self.rate_limit_rate + self.error_rate:
+                self.stats["errors"] += 1
+
+        if draw < self.rate_limit_rate:
+            return 429, error_body("Rate limit reached for requests", "requests"), \
+                {"Retry-After": str(self.retry_after)}
+        time.sleep(latency)
+        if draw < self.rate_limit_rate + self.error_rate:
+            return 503, error_body("The server is currently overloaded with other requests.", "server_error"), {}
+
+        prompts: List[str] = request["prompt"] if isinstance(request["prompt"], list) else [request["prompt"]]
+        max_words = max(1, int(request.get("max_tokens", 16) * self.completion_ratio * WORDS_PER_TOKEN))
+        texts = [" " + " ".join(prompt.split()[:max_words]) for prompt in prompts]
+        completion_tokens = [len(text) // CHARS_PER_TOKEN + 1 for text in texts]
+        if self.tokens_per_second:
+            # The prompts of a batch are completed in parallel.
+            time.sleep(max(completion_tokens) / self.tokens_per_second)
+        with self._lock:
+            self.stats["prompts"] += len(prompts)
+
+        prompt_tokens = sum(len(prompt) // CHARS_PER_TOKEN + 1 for prompt in prompts)
+        return 200, {
+            "id": "cmpl-mock",
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [{"text": text, "index": index, "logprobs": None, "finish_reason": "length"}
+                        for index, text in enumerate(texts)],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": sum(completion_tokens),
+                      "total_tokens": prompt_tokens + sum(completion_tokens)}
+        }, {}
+
+
+class CompletionHandler(BaseHTTPRequestHandler):
+    """Handle the requests of a MockCompletionServer."""
+
+    protocol_version = "HTTP/1.1"  # Keep-alive connections, as the OpenAI API
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not self.path.rstrip("/").endswith("/completions"):
+            self.send_json(404, error_body(f"Unknown path: {self.path}", "invalid_request_error"), {})
+            return
+        try:
+            request = json.loads(body)
+        except ValueError as ex:
+            self.send_json(400, error_body(f"Invalid JSON: {ex}", "invalid_request_error"), {})
+            return
+        self.send_json(*self.server.mock.respond(request))
+
+    def send_json(self, status: int, body: Dict, headers: Dict[str, str]):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def error_body(message: str, error_type: str) -> Dict:
+    """Return the body of an OpenAI API error."""
+    return {"error": {"message": message, "type": error_type, "param": None, "code": None}}
+
+
+def main(args: List[str]):  # pragma: no cover
+    """Serve until interrupted, printing the base URL first, e.g., for a benchmark running it as a subprocess."""
+    parser = argparse.ArgumentParser(description="A local stand-in for the OpenAI Completion API.")
+    parser.add_argument("--port", type=int, default=0, help="The port to listen on, any free port by default.")
+    parser.add_argument("--latency", type=float, default=0.5, help="The median seconds of a response.")
+    parser.add_argument("--latency_sigma", type=float, default=0.5, help="The log-normal shape of the latency.")
+    parser.add_argument("--tokens_per_second", type=float, default=0.0, help="The completion speed, 0 for instant.")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="The probability of a 503 response.")
+    parser.add_argument("--rate_limit_rate", type=float, default=0.0, help="The probability of a 429 response.")
+    parser.add_argument("--seed", type=int, default=None)
+    parsed = parser.parse_args(args)
+
+    server = MockCompletionServer(parsed.latency, parsed.latency_sigma, parsed.tokens_per_second, parsed.error_rate,
+                                  parsed.rate_limit_rate, port=parsed.port, seed=parsed.seed)
+    print(server.url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main(sys.argv[1:])
@@ -0,0 +1,123 @@
+"""Aggregate evaluation scores in a single pass, with constant memory, mergeable across shards."""
+import math
+import numpy as np
+from typing import Dict, List, Tuple
+
+ROUGE_METRICS = ["rouge-1", "rouge-2", "rouge-l"]
+ROUGE_STATS = ["f", "p", "r"]
+BLEU_METRICS = ["bleu-1", "bleu-2"]
+
+METRICS: List[Tuple[str, ...]] = [(metric,) for metric in BLEU_METRICS] + \
+                                 [(metric, stat) for metric in ROUGE_METRICS for stat in ROUGE_STATS]
+"""The path of each aggregated score in an eval_score dict, e.g., ("rouge-l", "f")."""
+
+NUM_OF_BINS = 1000
+"""The number of histogram bins over [0, 1], so that percentiles are within 0.001 of the exact ones."""
+
+PERCENTILES = [5, 25, 50, 75, 95]
+
+
+class ScoreAggregator:
+    """Running sums, Welford's mean and variance, and a fixed-bin histogram sketch of percentiles, per score.
+
+    All of them are of constant size and can be merged, so that shards of a corpus evaluated in parallel are
+    aggregated into the statistics of the whole corpus.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.sums = np.zeros(len(METRICS))
+        self.means = np.zeros(len(METRICS))
+        self.m2s = np.zeros(len(METRICS))
+        self.mins = np.full(len(METRICS), np.inf)
+        self.maxs = np.full(len(METRICS), -np.inf)
+        self.histograms = np.zeros((len(METRICS), NUM_OF_BINS), dtype=np.int64)
+
+    def add(self, score: Dict):
+        """Add the eval_score of a line, i.e., the dict returned by get_eval_score."""
+        values = np.array([metric_value(score, path) for path in METRICS])
+        self.count += 1
+        self.sums += values
+        delta = values - self.means
+        self.means += delta / self.count
+        self.m2s += delta * (values - self.means)
+        np.minimum(self.mins, values, out=self.mins)
+        np.maximum(self.maxs, values, out=self.maxs)
+        bins = np.clip((values * NUM_OF_BINS).astype(np.int64), 0, NUM_OF_BINS - 1)
+        self.histograms[np.arange(len(METRICS)), bins] += 1
+
+    def merge(self, other: "ScoreAggregator") -> "ScoreAggregator":
+        """Add the scores aggregated by other into this aggregator, and return it."""
+        count = self.count + other.count
+        if other.count:
+            delta = other.means - self.means
+            self.m2s += other.m2s + delta ** 2 * self.count * other.count / count
+            self.means += delta * other.count / count
+        self.count = count
+        self.sums += other.sums
+        np.minimum(self.mins, other.mins, out=self.mins)
+        np.maximum(self.maxs, other.maxs, out=self.maxs)
+        self.histograms += other.histograms
+        return self
+
+    def avg_score(self) -> Dict:
+        """Return the average scores, in the format of get_eval_metric."""
+        avg_score = {}
+        for (metric, *stat), total in zip(METRICS, self.sums.tolist()):
+            if stat:
+                avg_score.setdefault(metric, {})[stat[0]] = float(total) / self.count
+            else:
+                avg_score[metric] = float(total) / self.count
+        return avg_score
+
+    def stats(self) -> Dict:
+        """Return the mean, variance, standard deviation, min, max and percentiles of each score, e.g., "rouge-l-f"."""
+        stats = {}
+        for index, path in enumerate(METRICS):
+            variance = self.m2s[index] / (self.count - 1) if self.count > 1 else 0.0
+            stats["-".join(path)] = dict(
+                mean=float(self.means[index]),
+                var=float(variance),
+                std=math.sqrt(variance),
+                min=float(self.mins[index]),
+                max=float(self.maxs[index]),
+                **{f"p{q}": self.percentile(index, q) for q in PERCENTILES}
+            )
+        return stats
+
+    def percentile(self, index: int, q: float) -> float:
+        """Return the q-th percentile of the score of the given index, at the middle of its histogram bin."""
+        if not self.count:
+            return math.nan
+        cumulative = np.cumsum(self.histograms[index])
+        bin_index = int(np.searchsorted(cumulative, q / 100 * self.count))
+        value = (bin_index + 0.5) / NUM_OF_BINS
+        return float(min(max(value, self.mins[index]), self.maxs[index]))
+
+    def to_dict(self) -> Dict:
+        """Return the state as a JSON serializable dict, e.g., to merge the aggregators of other processes."""
+        return {
+            "count": self.count,
+            "sums": self.sums.tolist(),
+            "means": self.means.tolist(),
+            "m2s": self.m2s.tolist(),
+            "mins": self.mins.tolist(),
+            "maxs": self.maxs.tolist(),
+            "histograms": self.histograms.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, state: Dict) -> "ScoreAggregator":
+        aggregator = cls()
+        aggregator.count = state["count"]
+        for name in ["sums", "means", "m2s", "mins", "maxs"]:
+            setattr(aggregator, name, np.array(state[name], dtype=float))
+        aggregator.histograms = np.array(state["histograms"], dtype=np.int64)
+        return aggregator
+
+
+def metric_value(score: Dict, path: Tuple[str, ...]) -> float:
+    value = score
+    for key in path:
+        value = value[key]
+    return value
@@ -0,0 +1,107 @@
+"""Prometheus metrics of the latency of the summarization stages and of the tokens spent, aggregated across processes."""
+import os
+import time
+from functools import wraps
+from typing import Callable, Iterable, Iterator, Tuple
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client.multiprocess import MultiProcessCollector
+
+MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+"""The directory where each process, e.g., a gunicorn worker, writes its metrics, so that they are summed on scrape.
+It must be set before prometheus_client is imported, i.e., before the workers start, see serve."""
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+"""The histogram buckets, in seconds, from the tokenization of a paragraph to the summarization of a long document."""
+
+STAGE_SECONDS = Histogram(
+    "summarizer_stage_seconds",
+    "Seconds spent in a stage of the summarization. The chunk stage includes the tokenize stage of its paragraphs, "
+    "and the summarize stage the completion and rate_limit stages of its requests.",
+    ["stage"],
+    buckets=LATENCY_BUCKETS
+)
+TOKENIZE_SECONDS = STAGE_SECONDS.labels("tokenize")
+"""Counting the tokens of a batch of texts."""
+CHUNK_SECONDS = STAGE_SECONDS.labels("chunk")
+"""Producing the chunks of a document, excluding the time its consumer spends on each of them."""
+SUMMARIZE_SECONDS = STAGE_SECONDS.labels("summarize")
+"""Summarizing a chunk, or a batch of chunks, including the retries and their backoff."""
+COMPLETION_SECONDS = STAGE_SECONDS.labels("completion")
+"""Waiting for the response of a single completion request, i.e., the upstream latency."""
+RATE_LIMIT_SECONDS = STAGE_SECONDS.labels("rate_limit")
+"""Waiting for the rate limiter before a completion request."""
+DECODE_SECONDS = STAGE_SECONDS.labels("decode")
+"""Decoding the JSON of a request."""
+ENCODE_SECONDS = STAGE_SECONDS.labels("encode")
+"""Encoding the JSON of a response."""
+ADMISSION_SECONDS = STAGE_SECONDS.labels("admission")
+"""Waiting for admission control to admit a request, see admission.AdmissionController."""
+
+REQUEST_SECONDS = Histogram(
+    "summarizer_request_seconds",
+    "Seconds to serve an HTTP request, up to its first byte for a streamed response.",
+    ["route", "method", "status"],
+    buckets=LATENCY_BUCKETS
+)
+OPENAI_TOKENS = Counter(
+    "summarizer_openai_tokens",
+    "Tokens spent on completion requests, as reported by the usage field of their responses.",
+    ["kind"]
+)
+PROMPT_TOKENS = OPENAI_TOKENS.labels("prompt")
+COMPLETION_TOKENS = OPENAI_TOKENS.labels("completion")
+ADMISSION_REJECTIONS = Counter(
+    "summarizer_admission_rejections",
+    "Requests rejected by admission control, by status: 503 if too many were waiting, 429 if one waited too long.",
+    ["status"]
+)
+OPENAI_RETRIES = Counter("summarizer_openai_retries", "Completion requests retried, by error.", ["error"])
+
+
+def record_usage(response):
+    """Count the prompt and completion tokens of the given completion response, if it reports them."""
+    usage = response.get("usage")
+    if usage:
+        PROMPT_TOKENS.inc(usage.get("prompt_tokens", 0))
+        COMPLETION_TOKENS.inc(usage.get("completion_tokens", 0))
+
+
+def timed(iterable: Iterable, histogram: Histogram) -> Iterator:
+    """Iterate the given iterable, observing the seconds spent producing all of its items once it is closed."""
+    iterator = iter(iterable)
+    seconds = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                seconds += time.perf_counter() - start
+            yield item
+    finally:
+        histogram.observe(seconds)
+
+
+def timed_generator(histogram: Histogram) -> Callable:
+    """Decorate a function returning an iterator so that the seconds spent producing its items are observed."""
+    def decorator(func: Callable[..., Iterable]) -> Callable[..., Iterator]:
+        @wraps(func)
+        def wrapper(*args, **kwargs) -> Iterator:
+            return timed(func(*args, **kwargs), histogram)
+        return wrapper
+    return decorator
+
+
+def latest() -> Tuple[bytes, str]:
+    """Return the metrics in the Prometheus text format, and its content type.
+
+    If MULTIPROC_DIR_ENV is set, the metrics are summed over all the processes writing to that directory, e.g., over
+    the gunicorn workers, whichever of them serves the scrape.
+    """
+    if os.environ.get(MULTIPROC_DIR_ENV):
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,203 @@
+"""Admit the summarization requests of a process by their estimated cost in tokens, shortest first."""
+import math
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Callable, Iterator, List, Optional
+from summarizer.metrics import ADMISSION_REJECTIONS, ADMISSION_SECONDS
+
+CHARS_PER_TOKEN = 4
+"""The characters of a token, roughly, so that the cost of a request is estimated without tokenizing it."""
+
+DEFAULT_RETRY_AFTER = 5.0
+"""The Retry-After seconds of a rejected request, until the holding time of the admitted requests is known."""
+
+MAX_RETRY_AFTER = 120.0
+"""The highest Retry-After seconds of a rejected request."""
+
+HOLD_SMOOTHING = 0.2
+"""The weight of the latest request in the moving average of the seconds a request holds its tokens."""
+
+
+class Overloaded(RuntimeError):
+    """A request rejected by admission control, to be answered with its status and a Retry-After header."""
+
+    def __init__(self, message: str, status: int, retry_after: float):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def estimate_cost(num_of_chars: int, chunk_tokens: int, summary_tokens: int) -> int:
+    """Return the tokens spent on summarizing a text of the given length, without tokenizing it: its prompt tokens,
+    estimated by CHARS_PER_TOKEN, plus the completion tokens of each of its chunks of chunk_tokens."""
+    text_tokens = math.ceil(num_of_chars / CHARS_PER_TOKEN)
+    num_of_chunks = max(1, math.ceil(text_tokens / chunk_tokens))
+    return text_tokens + num_of_chunks * summary_tokens
+
+
+class AdmissionController:
+    """A budget of tokens in flight, shared by the requests of a process, with a priority queue of waiting requests.
+
+    A request holds its estimated cost while it is served. If that does not fit the budget, it waits in the queue,
+    ordered by a virtual deadline: its arrival time plus its cost at priority_rate tokens per second. So a small
+    request overtakes the big ones that arrived shortly before it, but not those that have waited long enough, and a
+    burst of big chapters does not hold the small requests behind it. A request costlier than the whole budget is
+    admitted alone.
+
+    Requests are rejected fast rather than queued without bound: with 503 if max_queue requests are already waiting,
+    and with 429 if a request is not admitted within max_wait seconds, so that the latency of the admitted requests
+    stays predictable under bursts. Both carry the seconds after which a retry is likely to be admitted, i.e., the
+    average time a request holds its tokens.
+    """
+
+    def __init__(self, budget_tokens: int, max_queue: int = 64, max_wait: float = 30.0,
+                 priority_rate: float = 1000.0):
+        """
+        Args:
+            budget_tokens: The tokens of the requests served at a time.
+            max_queue: The number of requests waiting, beyond which requests are rejected with 503.
+            max_wait: The seconds a request waits for admission, before it is rejected with 429.
+            priority_rate: The tokens of cost worth a second of waiting, in the order of the queue.
+        """
+        self.budget_tokens = budget_tokens
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.priority_rate = priority_rate
+        self.in_flight_tokens = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._hold_seconds: Optional[float] = None
+        self._queue: List[list] = []  # Heap of [deadline, sequence, cost, wake, state]
+        self._waiting = 0
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def admit(self, cost: int) -> Iterator[int]:
+        """Hold the tokens of a request of the given cost while the block runs, waiting for them in the queue.
+
+        Raise Overloaded if the request is rejected. Yield the tokens held, i.e., the cost, up to the budget.
+        """
+        event = threading.Event()
+        start = time.perf_counter()
+        tokens, entry = self._enqueue(cost, event.set)
+        if entry is not None:
+            event.wait(self.max_wait)
+            self._settle(entry)
+        ADMISSION_SECONDS.observe(time.perf_counter() - start)
+        start = time.perf_counter()
+        try:
+            yield tokens
+        finally:
+            self.release(tokens, time.perf_counter() - start)
+
+    @asynccontextmanager
+    async def aadmit(self, cost: int) -> AsyncIterator[int]:
+        """Hold the tokens of a request of the given cost while the block runs on the event loop. See admit."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        start = time.perf_counter()
+        tokens, entry = self._enqueue(cost, wake)
+        if entry is not None:
+            try:
+                await asyncio.wait_for(future, self.max_wait)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                # The client is gone: give up the place, or the tokens if they were granted meanwhile.
+                if self._cancel(entry):
+                    self.release(tokens)
+                raise
+            self._settle(entry)
+        ADMISSION_SECONDS.observe(time.perf_counter() - start)
+        start = time.perf_counter()
+        try:
+            yield tokens
+        finally:
+            self.release(tokens, time.perf_counter() - start)
+
+    def release(self, tokens: int, seconds: Optional[float] = None):
+        """Give back the tokens of a request served in the given seconds, and admit the waiting requests that fit.
+
+        Without seconds, e.g., for a request cancelled before it was served, the holding time is not averaged.
+        """
+        with self._lock:
+            self.in_flight_tokens -= tokens
+            if seconds is not None and self._hold_seconds is None:
+                self._hold_seconds = seconds
+            elif seconds is not None:
+                self._hold_seconds += HOLD_SMOOTHING * (seconds - self._hold_seconds)
+            self._dispatch()
+
+    def retry_after(self) -> float:
+        """Return the seconds after which a rejected request is likely to be admitted."""
+        if self._hold_seconds is None:
+            return DEFAULT_RETRY_AFTER
+        return min(MAX_RETRY_AFTER, max(1.0, math.ceil(self._hold_seconds)))
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight_tokens": self.in_flight_tokens, "waiting": self._waiting, "admitted": self.admitted,
+                    "rejected": self.rejected}
+
+    def _enqueue(self, cost: int, wake: Callable[[], None]):
+        """Admit the request or queue it, returning its tokens and its queue entry, None if it is admitted already."""
+        tokens = max(1, min(cost, self.budget_tokens))
+        with self._lock:
+            entry = [time.monotonic() + tokens / self.priority_rate, next(self._sequence), tokens, wake, "waiting"]
+            heapq.heappush(self._queue, entry)
+            self._waiting += 1
+            self._dispatch()
+            if entry[4] == "admitted":
+                return tokens, None
+            if self._waiting > self.max_queue:
+                entry[4] = "cancelled"
+                self._waiting -= 1
+                self._dispatch()
+                raise self._reject(f"Too many requests waiting: {self._waiting}", 503)
+            return tokens, entry
+
+    def _settle(self, entry: list):
+        """Raise Overloaded, unless the waiting request was admitted."""
+        if not self._cancel(entry):
+            with self._lock:
+                raise self._reject(f"Not admitted within {self.max_wait}s", 429)
+
+    def _reject(self, message: str, status: int) -> Overloaded:
+        """Count a rejected request and return its error. Hold the lock."""
+        self.rejected += 1
+        ADMISSION_REJECTIONS.labels(str(status)).inc()
+        return Overloaded(message, status, self.retry_after())
+
+    def _cancel(self, entry: list) -> bool:
+        """Remove the request from the queue, unless it was admitted already. Return whether it was admitted."""
+        with self._lock:
+            if entry[4] == "admitted":
+                return True
+            entry[4] = "cancelled"
+            self._waiting -= 1
+            self._dispatch()  # The cancelled request may have held the others behind it
+            return False
+
+    def _dispatch(self):
+        """Admit the requests at the head of the queue, in order, as long as they fit the budget. Hold the lock."""
+        while self._queue:
+            entry = self._queue[0]
+            _, _, tokens, wake, state = entry
+            if state == "waiting" and self.in_flight_tokens + tokens > self.budget_tokens:
+                return
+            heapq.heappop(self._queue)
+            if state == "waiting":
+                entry[4] = "admitted"
+                self._waiting -= 1
+                self.in_flight_tokens += tokens
+                self.admitted += 1
+                wake()
@@ -0,0 +1,77 @@
+import json
+import asyncio
+import hashlib
+import logging
+from typing import Dict, List
+from summarizer.model.gpt3_summarizer import Summarizer
+from summarizer.dao.summary_cache import SummaryCache
+
+logger = logging.getLogger(__name__)
+
+
+class CachedSummarizer(Summarizer):
+    """Serve summaries of already summarized texts from a SummaryCache, delegating the rest to a summarizer."""
+
+    def __init__(self, summarizer: Summarizer, cache: SummaryCache):
+        super().__init__(summarizer.text_tokens, summarizer.summary_tokens)
+        self.summarizer = summarizer
+        self.cache = cache
+        self.batch_size = summarizer.batch_size
+
+    def summarize(self, input_text) -> str:
+        key = self.cache_key(input_text)
+        summary_text = self.cache.get(key)
+        if summary_text is None:
+            summary_text = self.summarizer.summarize(input_text)
+            self.cache.put(key, summary_text)
+        else:
+            logger.debug(f"Summary cache hit: {key}")
+        return summary_text
+
+    def summarize_many(self, input_texts: List[str]) -> List[str]:
+        keys = [self.cache_key(input_text) for input_text in input_texts]
+        summaries = [self.cache.get(key) for key in keys]
+        missing = [index for index, summary_text in enumerate(summaries) if summary_text is None]
+        if missing:
+            missing_summaries = self.summarizer.summarize_many([input_texts[index] for index in missing])
+            for index, summary_text in zip(missing, missing_summaries):
+                summaries[index] = summary_text
+                self.cache.put(keys[index], summary_text)
+        logger.debug(f"Summary cache hits: {len(input_texts) - len(missing)} of {len(input_texts)}")
+        return summaries
+
+    async def asummarize(self, input_text) -> str:
+        # The SQLite lookups block, so they run on the loop's default executor.
+        loop = asyncio.get_running_loop()
+        key = self.cache_key(input_text)
+        summary_text = await loop.run_in_executor(None, self.cache.get, key)
+        if summary_text is None:
+            summary_text = await self.summarizer.asummarize(input_text)
+            await loop.run_in_executor(None, self.cache.put, key, summary_text)
+        else:
+            logger.debug(f"Summary cache hit: {key}")
+        return summary_text
+
+    async def asummarize_many(self, input_texts: List[str]) -> List[str]:
+        loop = asyncio.get_running_loop()
+        keys = [self.cache_key(input_text) for input_text in input_texts]
+        summaries = await loop.run_in_executor(None, lambda: [self.cache.get(key) for key in keys])
+        missing = [index for index, summary_text in enumerate(summaries) if summary_text is None]
+        if missing:
+            missing_summaries = await self.summarizer.asummarize_many([input_texts[index] for index in missing])
+
+            def put():
+                for index, summary_text in zip(missing, missing_summaries):
+                    summaries[index] = summary_text
+                    self.cache.put(keys[index], summary_text)
+            await loop.run_in_executor(None, put)
+        logger.debug(f"Summary cache hits: {len(input_texts) - len(missing)} of {len(input_texts)}")
+        return summaries
+
+    def params(self) -> Dict:
+        return self.summarizer.params()
+
+    def cache_key(self, input_text) -> str:
+        """Return the SHA-256 of the given text together with the summarizer parameters."""
+        params = json.dumps(self.params(), sort_keys=True)
+        return hashlib.sha256(f"{params}\n{input_text}".encode("utf-8")).hexdigest()
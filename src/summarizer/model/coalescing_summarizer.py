@@ -0,0 +1,65 @@
+import json
+import asyncio
+import logging
+from typing import Dict, List
+from summarizer.model.gpt3_summarizer import Summarizer
+from summarizer.model.single_flight import SingleFlight, content_key
+
+logger = logging.getLogger(__name__)
+
+
+class CoalescingSummarizer(Summarizer):
+    """Summarize a text once for all the concurrent requests of it, e.g., the same chunk of duplicate documents, and
+    serve its summary for a short time afterwards, delegating the summarization to a summarizer."""
+
+    def __init__(self, summarizer: Summarizer, flights: SingleFlight):
+        super().__init__(summarizer.text_tokens, summarizer.summary_tokens)
+        self.summarizer = summarizer
+        self.flights = flights
+        self.batch_size = summarizer.batch_size
+
+    def summarize(self, input_text) -> str:
+        return self.flights.do(self.flight_key(input_text), lambda: self.summarizer.summarize(input_text))
+
+    def summarize_many(self, input_texts: List[str]) -> List[str]:
+        keys = [self.flight_key(input_text) for input_text in input_texts]
+        claims = [self.flights.claim(key) for key in keys]
+        owned = [index for index, (owner, _) in enumerate(claims) if owner]
+        if owned:
+            logger.debug(f"Summarizing {len(owned)} of {len(input_texts)} texts, the others are coalesced")
+            try:
+                summaries = self.summarizer.summarize_many([input_texts[index] for index in owned])
+            except BaseException as ex:
+                for index in owned:
+                    self.flights.resolve(keys[index], claims[index][1], exception=ex)
+                raise
+            for index, summary_text in zip(owned, summaries):
+                self.flights.resolve(keys[index], claims[index][1], summary_text)
+        return [future.result() for _, future in claims]
+
+    async def asummarize(self, input_text) -> str:
+        return await self.flights.ado(self.flight_key(input_text), lambda: self.summarizer.asummarize(input_text))
+
+    async def asummarize_many(self, input_texts: List[str]) -> List[str]:
+        keys = [self.flight_key(input_text) for input_text in input_texts]
+        claims = [self.flights.claim(key) for key in keys]
+        owned = [index for index, (owner, _) in enumerate(claims) if owner]
+        if owned:
+            logger.debug(f"Summarizing {len(owned)} of {len(input_texts)} texts, the others are coalesced")
+            try:
+                summaries = await self.summarizer.asummarize_many([input_texts[index] for index in owned])
+            except BaseException as ex:
+                for index in owned:
+                    self.flights.resolve(keys[index], claims[index][1], exception=ex)
+                raise
+            for index, summary_text in zip(owned, summaries):
+                self.flights.resolve(keys[index], claims[index][1], summary_text)
+        # Shielded, so that a cancelled caller does not cancel the summaries the other callers wait for.
+        return list(await asyncio.gather(*(asyncio.shield(asyncio.wrap_future(future)) for _, future in claims)))
+
+    def params(self) -> Dict:
+        return self.summarizer.params()
+
+    def flight_key(self, input_text) -> str:
+        """Return the hash of the given text together with the summarizer parameters."""
+        return content_key(json.dumps(self.params(), sort_keys=True), input_text)
@@ -1,4 +1,6 @@
 """GPT3 model config."""
+import os
+
 max_tokens = 2040
 model_name = "text-curie-001"
 temperature = 0.7
@@ -12,3 +14,26 @@ text_tokens = int(token_ratio * max_tokens)
 """The maximum number of tokens used for text (i.e., prompt)"""
 summary_token = max_tokens - text_tokens
 """The maximum number of tokens used for summary (i.e., completion)"""
+
+requests_per_minute = 3000
+"""The requests per minute allowed by the OpenAI rate limit of the model."""
+tokens_per_minute = 250000
+"""The tokens (prompt and completion) per minute allowed by the OpenAI rate limit of the model."""
+rate_limited = os.environ.get("OPENAI_RATE_LIMITED", "true").lower() in ("1", "true", "yes")
+"""Whether the requests are budgeted by a RateLimiter, e.g., not against a mock server, whose 429s simulate the limit."""
+rate_limit_file = os.environ.get("OPENAI_RATE_LIMIT_FILE", "/tmp/summarizer-openai-rate-limit")
+"""The file holding the rate limiter state, shared by all the processes of the host."""
+max_retries = 6
+"""The number of times a throttled or failed request is retried, with exponential backoff."""
+batch_size = 20
+"""The maximum number of prompts sent in a single completion request, i.e., the limit of the Completion API."""
+batch_tokens = 20000
+"""The maximum number of tokens (prompts and maximum completions) of a batched completion request."""
+max_connections = 32
+"""The maximum number of connections to the OpenAI API kept open by a process, shared by all its threads."""
+keepalive_timeout = 60.0
+"""The seconds an idle connection to the OpenAI API is kept open by an async worker."""
+connect_timeout = 10.0
+"""The seconds to wait for a connection to the OpenAI API."""
+read_timeout = 120.0
+"""The seconds to wait for a completion, before the request is retried."""
@@ -1,21 +1,32 @@
 """Interface with GPT-3 API."""
 import os
+import time
+import asyncio
 import openai
 import logging
 import dotenv
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 from abc import ABC, abstractmethod
 from openai import OpenAIError
-from transformers import GPT2TokenizerFast
+from openai.error import APIConnectionError, RateLimitError, ServiceUnavailableError, Timeout, TryAgain
 from summarizer.util import SRC_RESOURCES_DIR
-from summarizer.aws_secrert_manager import get_openai_api_key_from_sm
+from summarizer.model.token_counter import TOKEN_COUNTER, count_tokens
+from summarizer.model.rate_limiter import RateLimiter, backoff_delay, retry_after_seconds
+from summarizer.model.http_client import HttpClient
+from summarizer.metrics import COMPLETION_SECONDS, RATE_LIMIT_SECONDS, OPENAI_RETRIES, record_usage
 
 TLDR_TAG = "\n\nTl;dr"
-GPT2_TOKENIZER = GPT2TokenizerFast.from_pretrained("gpt2")
+
+RETRYABLE_ERRORS = (RateLimitError, ServiceUnavailableError, APIConnectionError, Timeout, TryAgain)
+"""The OpenAI errors that are transient, so the request is retried."""
 
 logger = logging.getLogger(__name__)
 
 
 class Summarizer(ABC):
+    batch_size: int = 1
+    """The maximum number of texts worth passing to summarize_many at once."""
+
     @abstractmethod
     def __init__(self, text_tokens: int, summary_tokens: int):
         self.text_tokens: int = text_tokens
@@ -30,6 +41,31 @@ class Summarizer(ABC):
         """
         pass
 
+    def summarize_many(self, input_texts: List[str]) -> List[str]:
+        """Return the summaries of the given texts, in the same order.
+
+        Summarizers that can summarize several texts in a single request override it, see batch_size.
+        """
+        return [self.summarize(input_text) for input_text in input_texts]
+
+    async def asummarize(self, input_text) -> str:
+        """Summarize the given text without blocking the event loop.
+
+        Summarizers without a native async client run the blocking summarize in the loop's default executor.
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, self.summarize, input_text)
+
+    async def asummarize_many(self, input_texts: List[str]) -> List[str]:
+        """Return the summaries of the given texts, in the same order, without blocking the event loop.
+
+        Summarizers that can summarize several texts in a single request override it, see summarize_many.
+        """
+        return list(await asyncio.gather(*(self.asummarize(input_text) for input_text in input_texts)))
+
+    def params(self) -> Dict:
+        """Return the parameters that determine the summary of a given text, e.g., to key a summary cache."""
+        return {"summarizer": type(self).__name__, "summary_tokens": self.summary_tokens}
+
 
 class Gpt3Summarizer(Summarizer):
     def __init__(
@@ -40,8 +76,20 @@ class Gpt3Summarizer(Summarizer):
             summary_tokens: int,
             top_p: float,
             frequency_penalty: float,
-            presence_penalty: float
+            presence_penalty: float,
+            rate_limiter: Optional[RateLimiter] = None,
+            max_retries: int = 0,
+            batch_size: int = 1,
+            batch_tokens: int = 0,
+            http_client: Optional[HttpClient] = None
     ):
+        """
+        Args:
+            batch_size: The maximum number of prompts of a completion request of summarize_many.
+            batch_tokens: The maximum number of tokens, the prompts and their maximum completions, of a completion
+                request of summarize_many. A single prompt is always sent, whatever its number of tokens.
+            http_client: The connection pools and timeouts of the requests, installed into the OpenAI client.
+        """
         super().__init__(text_tokens, summary_tokens)
         openai.api_key = Gpt3Summarizer.get_api_key()
         self.model_name = model_name
@@ -49,6 +97,13 @@ class Gpt3Summarizer(Summarizer):
         self.top_p = top_p
         self.frequency_penalty = frequency_penalty
         self.presence_penalty = presence_penalty
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.batch_size = batch_size
+        self.batch_tokens = batch_tokens
+        self.http_client = http_client
+        if http_client:
+            http_client.install()
         logger.info(f"OpenAI initialized with: model_name={model_name}, temperature={temperature}, "
                     f"text_tokens={text_tokens}, summary_tokens={summary_tokens}, top_p={top_p} "
                     f"frequency_penalty={frequency_penalty}, presence_penalty={presence_penalty}")
@@ -56,33 +111,171 @@ class Gpt3Summarizer(Summarizer):
     def summarize(self, input_text) -> str:
         """Return summary of the given input_text."""
         logger.debug(f"############### Input Text ###############\n{input_text}\n.................................\n")
+        response = self._create(self._completion_params(input_text), self._request_tokens(input_text))
+        summary_text: str = response["choices"][0]["text"]
+        logger.debug(f"############### Summary Text ###############\n{summary_text}\n..............................\n")
+        return summary_text
+
+    def summarize_many(self, input_texts: List[str]) -> List[str]:
+        """Return the summaries of the given texts, sending them as the prompts of as few completion requests as
+        batch_size and batch_tokens allow, and mapping the choices of a request back to its prompts by their index."""
+        if self.batch_size <= 1 or len(input_texts) <= 1:
+            return super().summarize_many(input_texts)
+
+        summaries: List[str] = []
+        for batch, cost in self._batches(input_texts):
+            if len(batch) == 1:
+                summaries.append(self.summarize(batch[0]))
+                continue
+            logger.debug(f"Summarizing a batch of {len(batch)} texts, tokens: {cost}")
+            response = self._create(self._completion_params(batch), cost if self.rate_limiter else 0)
+            summaries.extend(self._batch_summaries(response, len(batch)))
+        return summaries
+
+    async def asummarize(self, input_text) -> str:
+        """Return summary of the given input_text, using the async OpenAI client."""
+        logger.debug(f"############### Input Text ###############\n{input_text}\n.................................\n")
+        response = await self._acreate(self._completion_params(input_text), self._request_tokens(input_text))
+        summary_text: str = response["choices"][0]["text"]
+        logger.debug(f"############### Summary Text ###############\n{summary_text}\n..............................\n")
+        return summary_text
+
+    async def asummarize_many(self, input_texts: List[str]) -> List[str]:
+        """Return the summaries of the given texts, using the async OpenAI client. See summarize_many."""
+        if self.batch_size <= 1 or len(input_texts) <= 1:
+            return await super().asummarize_many(input_texts)
+
+        summaries: List[str] = []
+        for batch, cost in self._batches(input_texts):
+            if len(batch) == 1:
+                summaries.append(await self.asummarize(batch[0]))
+                continue
+            logger.debug(f"Summarizing a batch of {len(batch)} texts, tokens: {cost}")
+            response = await self._acreate(self._completion_params(batch), cost if self.rate_limiter else 0)
+            summaries.extend(self._batch_summaries(response, len(batch)))
+        return summaries
+
+    def params(self) -> Dict:
+        return dict(
+            super().params(),
+            model_name=self.model_name,
+            temperature=self.temperature,
+            top_p=self.top_p,
+            frequency_penalty=self.frequency_penalty,
+            presence_penalty=self.presence_penalty
+        )
+
+    def _create(self, params: Dict, cost: int) -> Dict:
+        """Send a completion request, retrying it on transient errors, and return its response."""
         try:
-            response = openai.Completion.create(
-                model=self.model_name,
-                prompt=input_text + TLDR_TAG,
-                temperature=self.temperature,
-                max_tokens=self.summary_tokens,
-                top_p=self.top_p,
-                frequency_penalty=self.frequency_penalty,
-                presence_penalty=self.presence_penalty
-            )
-            summary_text: str = response["choices"][0]["text"]
+            for attempt in range(self.max_retries + 1):
+                if self.rate_limiter:
+                    with RATE_LIMIT_SECONDS.time():
+                        self.rate_limiter.acquire(cost)
+                try:
+                    with COMPLETION_SECONDS.time():
+                        response = openai.Completion.create(**params)
+                    break
+                except RETRYABLE_ERRORS as ex:
+                    if attempt == self.max_retries:
+                        raise
+                    OPENAI_RETRIES.labels(type(ex).__name__).inc()
+                    time.sleep(self._backoff(ex, attempt))
+            if self.rate_limiter:
+                self.rate_limiter.succeed()
+            record_usage(response)
+            return response
         except OpenAIError as ex:
             logger.error(f"OpenAI Error: {ex.user_message}")
             raise RuntimeError("OpenAI Error", ex.user_message)
-        logger.debug(f"############### Summary Text ###############\n{summary_text}\n..............................\n")
-        return summary_text
+
+    async def _acreate(self, params: Dict, cost: int) -> Dict:
+        """Send a completion request with the async OpenAI client, over the aiohttp session of the http_client if
+        any, retrying it on transient errors, and return its response."""
+        token = openai.aiosession.set(await self.http_client.aiosession()) if self.http_client else None
+        try:
+            for attempt in range(self.max_retries + 1):
+                if self.rate_limiter:
+                    with RATE_LIMIT_SECONDS.time():
+                        await self.rate_limiter.aacquire(cost)
+                try:
+                    with COMPLETION_SECONDS.time():
+                        response = await openai.Completion.acreate(**params)
+                    break
+                except RETRYABLE_ERRORS as ex:
+                    if attempt == self.max_retries:
+                        raise
+                    OPENAI_RETRIES.labels(type(ex).__name__).inc()
+                    await asyncio.sleep(self._backoff(ex, attempt))
+            if self.rate_limiter:
+                self.rate_limiter.succeed()
+            record_usage(response)
+            return response
+        except OpenAIError as ex:
+            logger.error(f"OpenAI Error: {ex.user_message}")
+            raise RuntimeError("OpenAI Error", ex.user_message)
+        finally:
+            if token is not None:
+                openai.aiosession.reset(token)
+
+    def _batches(self, input_texts: List[str]) -> Iterator[Tuple[List[str], int]]:
+        """Iterate the consecutive texts sent in a request of summarize_many, along with the tokens of the request."""
+        batch: List[str] = []
+        batch_cost = 0
+        for input_text, num_of_tokens in zip(input_texts, TOKEN_COUNTER.count_batch(input_texts)):
+            cost = num_of_tokens + self.summary_tokens
+            if batch and (len(batch) == self.batch_size or self.batch_tokens and batch_cost + cost > self.batch_tokens):
+                yield batch, batch_cost
+                batch, batch_cost = [], 0
+            batch.append(input_text)
+            batch_cost += cost
+        if batch:
+            yield batch, batch_cost
+
+    @staticmethod
+    def _batch_summaries(response: Dict, batch_size: int) -> List[str]:
+        """Return the summaries of the prompts of a batch, mapping the choices of its response back by their index."""
+        batch_summaries: List[Optional[str]] = [None] * batch_size
+        for choice in response["choices"]:
+            batch_summaries[choice["index"]] = choice["text"]
+        if None in batch_summaries:
+            raise RuntimeError("OpenAI Error", f"{batch_summaries.count(None)} prompts of the batch have no choice")
+        return batch_summaries
+
+    def _completion_params(self, input_text: Union[str, List[str]]) -> Dict:
+        """Return the completion request parameters for the given input_text, or list of texts."""
+        return dict(
+            model=self.model_name,
+            prompt=[text + TLDR_TAG for text in input_text] if isinstance(input_text, list) else input_text + TLDR_TAG,
+            temperature=self.temperature,
+            max_tokens=self.summary_tokens,
+            top_p=self.top_p,
+            frequency_penalty=self.frequency_penalty,
+            presence_penalty=self.presence_penalty,
+            **({"request_timeout": self.http_client.timeout} if self.http_client else {})
+        )
+
+    def _request_tokens(self, input_text) -> int:
+        """Return the tokens a request counts against the rate limit: the prompt and the maximum completion."""
+        if not self.rate_limiter:
+            return 0
+        return count_tokens(input_text) + self.summary_tokens
+
+    def _backoff(self, ex: OpenAIError, attempt: int) -> float:
+        """Return the delay before retrying after the given error, pausing the other requests too if throttled."""
+        delay = backoff_delay(attempt, retry_after_seconds(ex.headers) if isinstance(ex, RateLimitError) else None)
+        logger.warning(f"OpenAI Error: {ex.user_message}, retry# {attempt + 1} in {delay:.1f}s")
+        if self.rate_limiter and isinstance(ex, RateLimitError):
+            self.rate_limiter.throttle(delay)
+        return delay
 
     @classmethod
     def get_api_key(cls) -> str:
         api_key = dotenv.dotenv_values(os.path.join(SRC_RESOURCES_DIR, ".env"))["OPENAI_API_KEY"]
         if api_key == "None":
+            # boto3 is only imported when the key lives in the Secret Manager.
+            from summarizer.aws_secrert_manager import get_openai_api_key_from_sm
             api_key = get_openai_api_key_from_sm()
         else:
             logger.info("OpenAI API key retrieved from dotenv.")
         return api_key
-
-
-def count_tokens(text: str):
-    """Return the number of tokens in the given text."""
-    return len(GPT2_TOKENIZER(text)["input_ids"])
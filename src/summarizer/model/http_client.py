@@ -0,0 +1,87 @@
+"""A pooled, keep-alive HTTP client for the OpenAI API, shared by the threads and the event loops of a process."""
+import asyncio
+import logging
+import threading
+import weakref
+import aiohttp
+import openai
+import requests
+from typing import Tuple
+from openai import api_requestor
+
+MAX_CONNECTION_RETRIES = 2
+"""The number of times a failed connection is retried, as by the OpenAI client."""
+
+logger = logging.getLogger(__name__)
+
+
+class SharedSession:
+    """Stand-in for the thread-local session holder of the OpenAI client, holding the same session for every thread."""
+
+    def __init__(self, session: requests.Session):
+        self.session = session
+
+
+class HttpClient:
+    """A requests session, and an aiohttp session per event loop, each with a bounded pool of keep-alive connections.
+
+    The OpenAI client (0.26) opens a requests session per thread and an aiohttp session per async request, so that
+    the chunk requests of the worker threads, and of the event loop, each pay for their own TCP and TLS handshakes.
+    Once installed, the requests of all the threads go through the connection pool of this client, whose requests
+    session is thread-safe. The aiohttp sessions are used by passing them to the async requests, see aiosession.
+    """
+
+    def __init__(self, max_connections: int = 32, keepalive_timeout: float = 60.0, connect_timeout: float = 10.0,
+                 read_timeout: float = 120.0):
+        """
+        Args:
+            max_connections: The maximum number of connections of a pool. When all of them are busy, a request waits
+                for one rather than opening a connection that would not be reused.
+            keepalive_timeout: The seconds an idle connection of an aiohttp session is kept open.
+            connect_timeout: The seconds to wait for a connection.
+            read_timeout: The seconds to wait for a response, i.e., for the completion.
+        """
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max_connections, pool_block=True,
+                                                max_retries=MAX_CONNECTION_RETRIES)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._aiosessions: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    @property
+    def timeout(self) -> Tuple[float, float]:
+        """The (connect, read) timeout of a request, as the request_timeout of the OpenAI client."""
+        return self.connect_timeout, self.read_timeout
+
+    def install(self):
+        """Send the (sync) OpenAI requests of every thread through the session of this client."""
+        proxies = api_requestor._requests_proxies_arg(openai.proxy)
+        if proxies:
+            self.session.proxies = proxies
+        api_requestor._thread_context = SharedSession(self.session)
+        logger.info(f"OpenAI HTTP client installed, max_connections: {self.max_connections}, timeout: {self.timeout}")
+
+    async def aiosession(self) -> aiohttp.ClientSession:
+        """Return the aiohttp session of the running event loop, opening it on first use."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            session = self._aiosessions.get(loop)
+            if session is None or session.closed:
+                connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=self.keepalive_timeout)
+                session = self._aiosessions[loop] = aiohttp.ClientSession(connector=connector)
+        return session
+
+    async def aclose(self):
+        """Close the aiohttp session of the running event loop, e.g., on shutdown."""
+        with self._lock:
+            session = self._aiosessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+    def close(self):
+        self.session.close()
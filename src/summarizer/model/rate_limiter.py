@@ -0,0 +1,128 @@
+"""Budget the requests and tokens sent to the OpenAI API per minute, across the threads and processes of a host."""
+import os
+import time
+import fcntl
+import random
+import struct
+import asyncio
+import logging
+import threading
+from typing import List, Optional
+
+STATE = struct.Struct("5d")
+"""The shared state: available requests, available tokens, last refill time, blocked until, and rate factor."""
+
+MIN_RATE_FACTOR = 0.5
+"""The lowest fraction of the configured rates the limiter slows down to after being throttled."""
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Two token buckets, of requests per minute and of tokens per minute.
+
+    A request waits until both buckets hold enough for it. If the API throttles anyway (HTTP 429), throttle() blocks
+    every request for the given time and lowers the refill rates, which recover additively on success. So the
+    limiter settles just under the actual quota instead of oscillating between idle and throttled.
+
+    With a state_file, the buckets live in that file, guarded by a file lock, so that all gunicorn workers of a
+    container share one budget. Otherwise, they are shared by the threads of this process only.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, state_file: Optional[str] = None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.state_file = state_file
+        self._lock = threading.Lock()
+        self._state: List[float] = [requests_per_minute, tokens_per_minute, time.time(), 0.0, 1.0]
+        self._fd = os.open(state_file, os.O_RDWR | os.O_CREAT, 0o666) if state_file else None
+
+    def acquire(self, num_of_tokens: int):
+        """Block until a request of the given number of tokens (prompt plus completion) fits the budget."""
+        while True:
+            wait_seconds = self._try_acquire(num_of_tokens)
+            if wait_seconds <= 0:
+                return
+            time.sleep(wait_seconds)
+
+    async def aacquire(self, num_of_tokens: int):
+        """Wait on the event loop until a request of the given number of tokens fits the budget."""
+        while True:
+            wait_seconds = self._try_acquire(num_of_tokens)
+            if wait_seconds <= 0:
+                return
+            await asyncio.sleep(wait_seconds)
+
+    def throttle(self, seconds: float):
+        """Block all requests for the given seconds, and slow down the refill, after the API rejected a request."""
+        def update(state: List[float]):
+            state[3] = max(state[3], time.time() + seconds)
+            state[4] = max(MIN_RATE_FACTOR, state[4] * 0.8)
+            return state[4]
+
+        rate_factor = self._update(update)
+        logger.warning(f"Rate limited, pausing for {seconds:.1f}s, rate factor: {rate_factor:.2f}")
+
+    def succeed(self):
+        """Recover the refill rate a little after a successful request."""
+        def update(state: List[float]):
+            state[4] = min(1.0, state[4] + 0.01)
+
+        self._update(update)
+
+    def _try_acquire(self, num_of_tokens: int) -> float:
+        """Take the request from the buckets and return 0, or return the seconds to wait before trying again."""
+        num_of_tokens = min(num_of_tokens, self.tokens_per_minute)
+
+        def update(state: List[float]) -> float:
+            now = time.time()
+            requests, tokens, last_refill, blocked_until, rate_factor = state
+            elapsed = max(0.0, now - last_refill)
+            requests_rate = rate_factor * self.requests_per_minute / 60
+            tokens_rate = rate_factor * self.tokens_per_minute / 60
+            requests = min(self.requests_per_minute, requests + elapsed * requests_rate)
+            tokens = min(self.tokens_per_minute, tokens + elapsed * tokens_rate)
+            state[0], state[1], state[2] = requests, tokens, now
+
+            if now < blocked_until:
+                return blocked_until - now
+            if requests >= 1 and tokens >= num_of_tokens:
+                state[0], state[1] = requests - 1, tokens - num_of_tokens
+                return 0.0
+            return max((1 - requests) / requests_rate, (num_of_tokens - tokens) / tokens_rate)
+
+        return self._update(update)
+
+    def _update(self, update):
+        """Apply update to the state under the thread lock, and the file lock if the state is shared."""
+        with self._lock:
+            if self._fd is None:
+                return update(self._state)
+
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                data = os.pread(self._fd, STATE.size, 0)
+                state = list(STATE.unpack(data)) if len(data) == STATE.size else list(self._state)
+                result = update(state)
+                os.pwrite(self._fd, STATE.pack(*state), 0)
+                return result
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None, base: float = 1.0, cap: float = 60.0) -> float:
+    """Return the delay before retry number attempt (from 0): Retry-After if given, else jittered exponential."""
+    if retry_after is not None:
+        return retry_after
+    return random.uniform(0.5, 1.0) * min(cap, base * 2 ** attempt)
+
+
+def retry_after_seconds(headers) -> Optional[float]:
+    """Return the Retry-After header of an HTTP response in seconds, if it is there and numeric."""
+    if not headers:
+        return None
+    value = headers.get("Retry-After") or headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
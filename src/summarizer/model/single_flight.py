@@ -0,0 +1,108 @@
+"""Coalesce concurrent computations of the same key into one, and keep their results for a short time."""
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+DEFAULT_MAX_ENTRIES = 1024
+"""The default number of results kept by a SingleFlight."""
+
+
+class SingleFlight:
+    """Single-flight deduplication of computations by key, across the threads and event loops of a process.
+
+    The first caller of a key computes its value, and the concurrent callers of the same key wait for that value, or
+    the error, rather than computing it again. A computed value is then served for ttl seconds, from a bounded LRU of
+    max_entries values.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.coalesced = 0
+        self._in_flight = {}
+        self._values: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def do(self, key: str, compute: Callable[[], Any]) -> Any:
+        """Return the value of the given key, calling compute unless it is cached or being computed."""
+        owner, future = self.claim(key)
+        if not owner:
+            return future.result()
+        try:
+            value = compute()
+        except BaseException as ex:
+            self.resolve(key, future, exception=ex)
+            raise
+        self.resolve(key, future, value)
+        return value
+
+    async def ado(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the value of the given key on the running event loop, awaiting compute() unless it is cached or
+        being computed."""
+        owner, future = self.claim(key)
+        if not owner:
+            # Shielded, so that a cancelled waiter does not cancel the computation the other callers wait for.
+            return await asyncio.shield(asyncio.wrap_future(future))
+        try:
+            value = await compute()
+        except BaseException as ex:
+            self.resolve(key, future, exception=ex)
+            raise
+        self.resolve(key, future, value)
+        return value
+
+    def claim(self, key: str) -> Tuple[bool, Future]:
+        """Return whether the caller owns the computation of the given key, and the future of its value.
+
+        The owner must resolve the future, which is already done for a cached value.
+        """
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._values.move_to_end(key)
+                self.hits += 1
+                future = Future()
+                future.set_result(entry[1])
+                return False, future
+            if entry is not None:
+                del self._values[key]
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return False, future
+            future = self._in_flight[key] = Future()
+            return True, future
+
+    def resolve(self, key: str, future: Future, value: Any = None, exception: BaseException = None):
+        """Set the value, or the error, of a claimed key for its waiters, caching the value."""
+        with self._lock:
+            del self._in_flight[key]
+            if exception is None and self.ttl > 0:
+                self._values[key] = (time.monotonic() + self.ttl, value)
+                self._values.move_to_end(key)
+                while len(self._values) > self.max_entries:
+                    self._values.popitem(last=False)
+        if exception is None:
+            future.set_result(value)
+        else:
+            future.set_exception(exception)
+
+    def stats(self) -> Dict:
+        """Return the number of cache hits and coalesced calls, and of the keys in flight and cached."""
+        with self._lock:
+            return {"hits": self.hits, "coalesced": self.coalesced, "in_flight": len(self._in_flight),
+                    "entries": len(self._values)}
+
+
+def content_key(*parts: Any) -> str:
+    """Return the SHA-256 of the given parts, e.g., a text and the parameters its result depends on."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(repr(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
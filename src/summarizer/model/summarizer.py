@@ -1,41 +1,332 @@
+import time
+import asyncio
 import logging
-from typing import List
-from summarizer.model.gpt3_summarizer import Summarizer, Gpt3Summarizer
-from summarizer.dao.chunker import TextChunker
+from dataclasses import dataclass
+from itertools import islice
+from typing import AsyncIterator, Iterable, Iterator, List, Optional, Set
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, as_completed, wait
+from summarizer.model.gpt3_summarizer import Summarizer, Gpt3Summarizer, count_tokens
+from summarizer.model.cached_summarizer import CachedSummarizer
+from summarizer.model.coalescing_summarizer import CoalescingSummarizer
+from summarizer.model.extractive_summarizer import ExtractiveSummarizer
+from summarizer.model.single_flight import SingleFlight
+from summarizer.model.rate_limiter import RateLimiter
+from summarizer.model.http_client import HttpClient
+from summarizer.dao.summary_cache import SummaryCache
+from summarizer.dao.chunker import TextChunker, Chunk
 from summarizer.model import gpt3_config
+from summarizer.metrics import SUMMARIZE_SECONDS
+
+MAX_REDUCE_LEVELS = 8
+"""The maximum number of times the chunk summaries are summarized again to fit a target number of tokens."""
+
+REDUCE_SEPARATOR = "\n\n"
+"""Chunk summaries are re-chunked as paragraphs, so that a summary is not split across chunks."""
 
 logger = logging.getLogger(__name__)
 
 
+async def aiter_in_executor(iterator: Iterable) -> AsyncIterator:
+    """Iterate the given blocking iterator, e.g., a chunk generator tokenizing its document, on the loop's default
+    executor, an item at a time, so that its CPU work does not stall the other requests of the event loop."""
+    loop = asyncio.get_running_loop()
+    iterator = iter(iterator)
+    done = object()
+    while True:
+        item = await loop.run_in_executor(None, next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+@dataclass()
+class ChunkSummary:
+    """The summary of a chunk, as streamed to clients."""
+
+    chunk_id: int
+    """The id of the summarized chunk."""
+    num_of_tokens: int
+    """The number of tokens in the summarized chunk."""
+    summary: str
+    """The summary of the chunk."""
+    seconds: float
+    """The time spent on summarizing the chunk."""
+
+
 class TextSummarizer:
     """Summarize text class."""
 
-    def __init__(self, summarizer: Summarizer):
+    def __init__(self, summarizer: Summarizer, max_workers: int = 1, balanced: bool = False, shrink_tokens: int = 0):
+        """
+        Args:
+            summarizer: The summarizer used to summarize each chunk.
+            max_workers: The maximum number of chunks of a document summarized concurrently. One means sequential.
+            balanced: Chunk the documents into the least chunks of even sizes, rather than greedily.
+            shrink_tokens: Shrink a text of more tokens to its most central sentences within shrink_tokens, with an
+                ExtractiveSummarizer, before it is chunked, so that a huge document costs fewer chunk summaries. Zero
+                never shrinks a text.
+        """
         self.summarizer = summarizer
-        self.chunker = TextChunker(num_of_tokens=summarizer.text_tokens)
+        self.chunker = TextChunker(num_of_tokens=summarizer.text_tokens, balanced=balanced)
+        self.max_workers = max_workers
+        self.shrinker = ExtractiveSummarizer(summarizer.text_tokens, shrink_tokens) if shrink_tokens > 0 else None
+        self._executor = ThreadPoolExecutor(max_workers=max_workers) if max_workers > 1 else None
 
-    def summarize_text(self, text: str, doc_id="n/a") -> str:
-        chunk_sum: List[str] = []
-        for chunk in self.chunker.chunk_generator_from_text(text, doc_id):
-            logger.info(f"Summarizing chunk: {chunk.id}, of {chunk.document_id}, tokens: {chunk.num_of_tokens}")
-            chunk_sum.append(self.summarizer.summarize(chunk.text()))
+    def summarize_text(self, text: str, doc_id="n/a", target_tokens: int = None) -> str:
+        """Summarize the given text. If target_tokens is given, reduce the summary until it fits target_tokens."""
+        text = self.shrink_text(text, doc_id)
+        return self._summarize(self.chunker.chunk_generator_from_text(text, doc_id), doc_id, target_tokens)
+
+    def shrink_text(self, text: str, doc_id="n/a") -> str:
+        """Return the most central sentences of the given text within shrink_tokens, in text order, or the text itself
+        if it fits."""
+        if self.shrinker is None:
+            return text
+        num_of_tokens = count_tokens(text)
+        if num_of_tokens <= self.shrinker.summary_tokens:
+            return text
+        logger.info(f"Document-{doc_id}: shrinking {num_of_tokens} tokens to {self.shrinker.summary_tokens}.")
+        return self.shrinker.summarize(text)
+
+    async def _ashrink_text(self, text: str, doc_id: str) -> str:
+        if self.shrinker is None:
+            return text
+        return await asyncio.get_running_loop().run_in_executor(None, self.shrink_text, text, doc_id)
+
+    def summarize_stream(self, source, doc_id="n/a", target_tokens: int = None, encoding: str = "utf-8") -> str:
+        """Summarize a text read incrementally from a byte stream, e.g., a large file or a request body.
 
+        See summarize_text and TextChunker.chunk_generator_from_stream.
+        """
+        chunks = self.chunker.chunk_generator_from_stream(source, doc_id, encoding)
+        return self._summarize(chunks, doc_id, target_tokens)
+
+    def _summarize(self, chunks: Iterator[Chunk], doc_id: str, target_tokens: Optional[int]) -> str:
+        if target_tokens is None:
+            return self.summarize_chunks(chunks)
+
+        chunk_sum = self.map_chunks(chunks)
+        for level in range(1, MAX_REDUCE_LEVELS + 1):
+            if not self._needs_reduce(chunk_sum, target_tokens, doc_id, level):
+                break
+            chunk_sum = self.map_chunks(self.chunker.chunk_generator_from_text(
+                REDUCE_SEPARATOR.join(chunk_sum), f"{doc_id}/level-{level}"
+            ))
         return " ".join(chunk_sum)
 
     def summarize_file(self, txt_file: str) -> str:
-        chunk_sum: List[str] = []
-        for chunk in self.chunker.chunk_generator_from_file(txt_file):
-            logger.info(f"Summarizing chunk: {chunk.id}, of {chunk.document_id}, tokens: {chunk.num_of_tokens}")
-            chunk_sum.append(self.summarizer.summarize(chunk.text()))
+        return self.summarize_chunks(self.chunker.chunk_generator_from_file(txt_file))
+
+    def summarize_chunks(self, chunks: Iterator[Chunk]) -> str:
+        """Summarize each chunk and join the chunk summaries in chunk id order."""
+        return " ".join(self.map_chunks(chunks))
+
+    def map_chunks(self, chunks: Iterator[Chunk]) -> List[str]:
+        """Summarize each chunk and return the chunk summaries in chunk id order.
+
+        Chunks are summarized in batches of at most summarizer.batch_size chunks, see Summarizer.summarize_many. In
+        concurrent mode, a batch is dispatched to the worker pool as soon as a worker is free or the batch is full, so
+        chunking the rest of the document overlaps with summarizing the first chunks, and a document of a few chunks
+        is summarized a chunk per worker. At most 2 * max_workers batches are waiting or in flight, so that a long
+        (streamed) document is not held in memory as queued chunks.
+        """
+        batch_size = max(1, self.summarizer.batch_size)
+        if self._executor is None:
+            chunks = iter(chunks)
+            return [summary for batch in iter(lambda: list(islice(chunks, batch_size)), [])
+                    for summary in self._summarize_batch(batch)]
+
+        futures: List[Future] = []
+        in_flight: Set[Future] = set()
+        batch: List[Chunk] = []
+        try:
+            for chunk in chunks:
+                batch.append(chunk)
+                in_flight = {future for future in in_flight if not future.done()}
+                if len(in_flight) < self.max_workers or len(batch) == batch_size:
+                    if len(in_flight) >= 2 * self.max_workers:
+                        _, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    futures.append(self._executor.submit(self._summarize_batch, batch))
+                    in_flight.add(futures[-1])
+                    batch = []
+            if batch:
+                futures.append(self._executor.submit(self._summarize_batch, batch))
+            return [summary for future in futures for summary in future.result()]
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+
+    async def asummarize_text(self, text: str, doc_id="n/a", target_tokens: int = None) -> str:
+        """Summarize the given text on the event loop. See summarize_text."""
+        text = await self._ashrink_text(text, doc_id)
+        return await self._asummarize(self.chunker.chunk_generator_from_text(text, doc_id), doc_id, target_tokens)
+
+    async def asummarize_stream(self, source, doc_id="n/a", target_tokens: int = None, encoding: str = "utf-8") -> str:
+        """Summarize a text read incrementally from a byte stream on the event loop. See summarize_stream.
+
+        The source is read on the loop's default executor, along with the chunking, e.g., a request body received
+        from the event loop a message at a time.
+        """
+        chunks = self.chunker.chunk_generator_from_stream(source, doc_id, encoding)
+        return await self._asummarize(chunks, doc_id, target_tokens)
 
+    async def _asummarize(self, chunks: Iterator[Chunk], doc_id: str, target_tokens: Optional[int]) -> str:
+        chunk_sum = await self.amap_chunks(chunks)
+        for level in range(1, MAX_REDUCE_LEVELS + 1):
+            if target_tokens is None or not self._needs_reduce(chunk_sum, target_tokens, doc_id, level):
+                break
+            chunk_sum = await self.amap_chunks(self.chunker.chunk_generator_from_text(
+                REDUCE_SEPARATOR.join(chunk_sum), f"{doc_id}/level-{level}"
+            ))
         return " ".join(chunk_sum)
 
+    async def asummarize_chunks(self, chunks: Iterator[Chunk]) -> str:
+        """Summarize each chunk on the event loop and join the chunk summaries in chunk id order."""
+        return " ".join(await self.amap_chunks(chunks))
+
+    async def amap_chunks(self, chunks: Iterator[Chunk]) -> List[str]:
+        """Summarize each chunk on the event loop, at most max_workers batches at a time, and return them in chunk id
+        order.
+
+        As in map_chunks, chunks are summarized in batches of at most summarizer.batch_size chunks, see
+        Summarizer.asummarize_many, a batch is dispatched as soon as a worker is free or the batch is full, and at most
+        2 * max_workers batches are waiting or in flight. The chunks are produced on the loop's default executor, see
+        aiter_in_executor.
+        """
+        batch_size = max(1, self.summarizer.batch_size)
+        semaphore = asyncio.Semaphore(self.max_workers)
+
+        async def summarize_batch(batch: List[Chunk]) -> List[str]:
+            async with semaphore:
+                for chunk in batch:
+                    logger.info(f"Summarizing chunk: {chunk.id}, of {chunk.document_id}, tokens: {chunk.num_of_tokens}")
+                with SUMMARIZE_SECONDS.time():
+                    return await self.summarizer.asummarize_many([chunk.text() for chunk in batch])
+
+        tasks = []
+        in_flight: Set[asyncio.Future] = set()
+        batch: List[Chunk] = []
+        try:
+            async for chunk in aiter_in_executor(chunks):
+                batch.append(chunk)
+                in_flight = {task for task in in_flight if not task.done()}
+                if len(in_flight) < self.max_workers or len(batch) == batch_size:
+                    if len(in_flight) >= 2 * self.max_workers:
+                        _, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    tasks.append(asyncio.ensure_future(summarize_batch(batch)))
+                    in_flight.add(tasks[-1])
+                    batch = []
+            if batch:
+                tasks.append(asyncio.ensure_future(summarize_batch(batch)))
+            return [summary for summaries in await asyncio.gather(*tasks) for summary in summaries]
+        except Exception:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    def iter_chunk_summaries(self, text: str, doc_id="n/a") -> Iterator[ChunkSummary]:
+        """Iterate the chunk summaries of the given text as soon as each of them is ready, i.e., in completion order."""
+        return self.iter_summaries(self.chunker.chunk_generator_from_text(self.shrink_text(text, doc_id), doc_id))
+
+    def iter_summaries(self, chunks: Iterable[Chunk]) -> Iterator[ChunkSummary]:
+        """Iterate the summaries of the given chunks as soon as each of them is ready, i.e., in completion order.
+
+        As in map_chunks, at most 2 * max_workers chunks are waiting or in flight, so that the chunks of a long document
+        are not all queued at once.
+        """
+        if self._executor is None:
+            for chunk in chunks:
+                yield self._summarize_timed_chunk(chunk)
+            return
+
+        pending: Set[Future] = set()
+        try:
+            for chunk in chunks:
+                if len(pending) >= 2 * self.max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                pending.add(self._executor.submit(self._summarize_timed_chunk, chunk))
+            for future in as_completed(pending):
+                yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def aiter_chunk_summaries(self, text: str, doc_id="n/a") -> AsyncIterator[ChunkSummary]:
+        """Iterate the chunk summaries of the given text on the event loop, in completion order.
+
+        As in iter_summaries, at most 2 * max_workers chunks are waiting or in flight, and the summaries that are ready
+        are yielded while the rest of the text is chunked.
+        """
+        semaphore = asyncio.Semaphore(self.max_workers)
+        text = await self._ashrink_text(text, doc_id)
+
+        async def summarize_chunk(chunk: Chunk) -> ChunkSummary:
+            async with semaphore:
+                logger.info(f"Summarizing chunk: {chunk.id}, of {chunk.document_id}, tokens: {chunk.num_of_tokens}")
+                start = time.perf_counter()
+                summary = await self.summarizer.asummarize(chunk.text())
+                seconds = time.perf_counter() - start
+                SUMMARIZE_SECONDS.observe(seconds)
+                return ChunkSummary(chunk.id, chunk.num_of_tokens, summary, seconds)
+
+        pending: Set[asyncio.Future] = set()
+        try:
+            async for chunk in aiter_in_executor(self.chunker.chunk_generator_from_text(text, doc_id)):
+                done = {task for task in pending if task.done()}
+                if not done and len(pending) >= 2 * self.max_workers:
+                    done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                pending -= done
+                for task in done:
+                    yield task.result()
+                pending.add(asyncio.ensure_future(summarize_chunk(chunk)))
+            for task in asyncio.as_completed(pending):
+                yield await task
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _summarize_timed_chunk(self, chunk: Chunk) -> ChunkSummary:
+        start = time.perf_counter()
+        summary = self._summarize_chunk(chunk)
+        return ChunkSummary(chunk.id, chunk.num_of_tokens, summary, time.perf_counter() - start)
+
+    def _needs_reduce(self, chunk_sum: List[str], target_tokens: int, doc_id: str, level: int) -> bool:
+        """Return True if the joined chunk summaries are longer than target_tokens, and worth another level."""
+        num_of_tokens = count_tokens(" ".join(chunk_sum))
+        if num_of_tokens <= target_tokens:
+            return False
+        if len(chunk_sum) == 1 and num_of_tokens <= self.summarizer.summary_tokens:
+            logger.warning(f"Document-{doc_id}: summary of {num_of_tokens} tokens can't be reduced any further.")
+            return False
+        logger.info(f"Document-{doc_id}: reducing {len(chunk_sum)} summaries of {num_of_tokens} tokens, "
+                    f"target_tokens: {target_tokens}, level: {level}")
+        return True
+
+    def _summarize_batch(self, chunks: List[Chunk]) -> List[str]:
+        for chunk in chunks:
+            logger.info(f"Summarizing chunk: {chunk.id}, of {chunk.document_id}, tokens: {chunk.num_of_tokens}")
+        with SUMMARIZE_SECONDS.time():
+            return self.summarizer.summarize_many([chunk.text() for chunk in chunks])
+
+    def _summarize_chunk(self, chunk: Chunk) -> str:
+        logger.info(f"Summarizing chunk: {chunk.id}, of {chunk.document_id}, tokens: {chunk.num_of_tokens}")
+        with SUMMARIZE_SECONDS.time():
+            return self.summarizer.summarize(chunk.text())
+
 
 class SummarizerFactory:
     """"Summarizer Factory."""
 
     @staticmethod
-    def create_summarizer(sum_type: str) -> Summarizer:
+    def create_summarizer(sum_type: str, cache_file: str = None, coalesce_ttl: float = None) -> Summarizer:
+        """Create a summarizer of the given type. If a cache_file is given, summaries are cached in that file.
+
+        If coalesce_ttl is given, concurrent requests of the same text are summarized once, and the summary is
+        served for coalesce_ttl seconds, see CoalescingSummarizer.
+        """
         if sum_type.lower() == "gpt3":
             summarizer = Gpt3Summarizer(
                 model_name=gpt3_config.model_name,
@@ -44,9 +335,28 @@ class SummarizerFactory:
                 summary_tokens=gpt3_config.summary_token,
                 top_p=gpt3_config.top_p,
                 frequency_penalty=gpt3_config.frequency_penalty,
-                presence_penalty=gpt3_config.presence_penalty
+                presence_penalty=gpt3_config.presence_penalty,
+                rate_limiter=RateLimiter(
+                    gpt3_config.requests_per_minute, gpt3_config.tokens_per_minute, gpt3_config.rate_limit_file
+                ) if gpt3_config.rate_limited else None,
+                max_retries=gpt3_config.max_retries,
+                batch_size=gpt3_config.batch_size,
+                batch_tokens=gpt3_config.batch_tokens,
+                http_client=HttpClient(
+                    gpt3_config.max_connections, gpt3_config.keepalive_timeout, gpt3_config.connect_timeout,
+                    gpt3_config.read_timeout
+                )
+            )
+        elif sum_type.lower() == "extractive":
+            summarizer = ExtractiveSummarizer(
+                text_tokens=gpt3_config.text_tokens,
+                summary_tokens=gpt3_config.summary_token
             )
         else:
             raise NotImplementedError(f"Summarizer type: {sum_type} is not implemented yet.")
 
+        if cache_file:
+            summarizer = CachedSummarizer(summarizer, SummaryCache(cache_file))
+        if coalesce_ttl is not None:
+            summarizer = CoalescingSummarizer(summarizer, SingleFlight(coalesce_ttl))
         return summarizer
@@ -0,0 +1,150 @@
+"""Count tokens of texts in batches, memoizing the counts of recently seen texts."""
+import os
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from itertools import islice
+from typing import Iterable, Iterator, List, Tuple
+from summarizer.util import SRC_RESOURCES_DIR
+from summarizer.metrics import TOKENIZE_SECONDS
+
+GPT2_TOKENIZER_FILE = os.path.join(SRC_RESOURCES_DIR, "gpt2", "tokenizer.json")
+"""The GPT2 tokenizer vendored in the resources, so that loading it needs neither transformers nor network."""
+
+DEFAULT_CACHE_SIZE = 65536
+"""The default number of texts whose token counts are memoized."""
+
+DEFAULT_BATCH_SIZE = 64
+"""The default number of texts counted together by iter_with_counts."""
+
+logger = logging.getLogger(__name__)
+
+
+class TokenizerBackend(ABC):
+    """A tokenizer that only reports the number of tokens of texts."""
+
+    @abstractmethod
+    def count_batch(self, texts: List[str]) -> List[int]:
+        """Return the number of tokens of each of the given texts."""
+        pass
+
+    def warm_up(self):
+        """Load whatever the backend loads lazily, e.g., before a service reports itself healthy."""
+        pass
+
+
+class Gpt2TokenizerBackend(TokenizerBackend):
+    """Count tokens with the Hugging Face fast GPT2 tokenizer, calling the Rust tokenizer directly.
+
+    It skips building a BatchEncoding per text, and the whole batch is encoded in one (parallel) call. The tokenizer
+    is loaded on first use from tokenizer_file; only if that file is missing, it falls back to transformers and the
+    Hugging Face hub.
+    """
+
+    def __init__(self, tokenizer_file: str = GPT2_TOKENIZER_FILE):
+        self.tokenizer_file = tokenizer_file
+        self._tokenizer = None
+        self._lock = threading.Lock()
+
+    @property
+    def tokenizer(self):
+        """The tokenizers.Tokenizer, loaded on first access."""
+        if self._tokenizer is None:
+            with self._lock:
+                if self._tokenizer is None:
+                    self._tokenizer = self._load()
+        return self._tokenizer
+
+    def _load(self):
+        if os.path.exists(self.tokenizer_file):
+            from tokenizers import Tokenizer
+            logger.info(f"Loading GPT2 tokenizer from: {self.tokenizer_file}")
+            return Tokenizer.from_file(self.tokenizer_file)
+
+        from transformers import GPT2TokenizerFast
+        logger.warning(f"Tokenizer file: {self.tokenizer_file} not found, loading GPT2 tokenizer from the hub.")
+        return GPT2TokenizerFast.from_pretrained("gpt2").backend_tokenizer
+
+    def count_batch(self, texts: List[str]) -> List[int]:
+        encodings = self.tokenizer.encode_batch(texts, add_special_tokens=False)
+        return [len(encoding.ids) for encoding in encodings]
+
+    def warm_up(self):
+        _ = self.tokenizer
+
+
+class TiktokenBackend(TokenizerBackend):
+    """Count tokens with the tiktoken BPE of the given OpenAI model, e.g., r50k_base for text-curie-001."""
+
+    def __init__(self, model_name: str):
+        try:
+            import tiktoken
+        except ImportError as ex:
+            raise RuntimeError("TiktokenBackend requires the tiktoken package: pip install tiktoken") from ex
+        self.encoding = tiktoken.encoding_for_model(model_name)
+
+    def count_batch(self, texts: List[str]) -> List[int]:
+        return [len(tokens) for tokens in self.encoding.encode_ordinary_batch(texts)]
+
+
+class TokenCounter:
+    """Count tokens through a TokenizerBackend, with a bounded LRU memo of text to token count."""
+
+    def __init__(self, backend: TokenizerBackend, cache_size: int = DEFAULT_CACHE_SIZE):
+        self.backend = backend
+        self.cache_size = cache_size
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def warm_up(self):
+        """Load the tokenizer now rather than on the first count."""
+        self.backend.warm_up()
+
+    def count(self, text: str) -> int:
+        """Return the number of tokens in the given text."""
+        return self.count_batch([text])[0]
+
+    @TOKENIZE_SECONDS.time()
+    def count_batch(self, texts: List[str]) -> List[int]:
+        """Return the number of tokens of each of the given texts, tokenizing the unseen ones in a single call."""
+        counts: List[int] = [0] * len(texts)
+        missing = {}
+        with self._lock:
+            for index, text in enumerate(texts):
+                if text in self._cache:
+                    self._cache.move_to_end(text)
+                    counts[index] = self._cache[text]
+                else:
+                    missing.setdefault(text, []).append(index)
+
+        if missing:
+            missing_texts = list(missing)
+            missing_counts = self.backend.count_batch(missing_texts)
+            with self._lock:
+                for text, num_of_tokens in zip(missing_texts, missing_counts):
+                    for index in missing[text]:
+                        counts[index] = num_of_tokens
+                    self._cache[text] = num_of_tokens
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        return counts
+
+    def iter_with_counts(self, texts: Iterable[str], batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[Tuple[str, int]]:
+        """Iterate the given texts along with their number of tokens, counting them batch_size texts at a time."""
+        texts = iter(texts)
+        while True:
+            batch = list(islice(texts, batch_size))
+            if not batch:
+                return
+            yield from zip(batch, self.count_batch(batch))
+
+
+TOKEN_COUNTER = TokenCounter(Gpt2TokenizerBackend())
+"""The default token counter, shared by the chunkers and summarizers."""
+
+
+def count_tokens(text: str) -> int:
+    """Return the number of tokens in the given text."""
+    return TOKEN_COUNTER.count(text)
@@ -0,0 +1,98 @@
+"""Opt-in CPU (cProfile) and allocation (tracemalloc) profiling of a block of code, dumped as reports."""
+import os
+import io
+import pstats
+import logging
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, Optional
+
+PROFILE_ENV = "SUMMARIZER_PROFILE"
+"""The profilers enabled by default, comma separated, of: cpu, memory. None if unset."""
+
+PROFILE_DIR_ENV = "SUMMARIZER_PROFILE_DIR"
+"""The directory of the reports, by default."""
+
+DEFAULT_PROFILE_DIR = "profiles"
+"""The directory of the reports, if PROFILE_DIR_ENV is unset."""
+
+CPU, MEMORY = "cpu", "memory"
+
+TOP_ENTRIES = 40
+"""The number of functions, or of allocating lines, in a report."""
+
+logger = logging.getLogger(__name__)
+
+
+def profile_kinds(kinds: Optional[Iterable[str]] = None) -> List[str]:
+    """Return the given profilers, or those of the PROFILE_ENV environment variable, checking their names."""
+    if kinds is None:
+        kinds = os.environ.get(PROFILE_ENV, "").split(",")
+    kinds = [kind.strip().lower() for kind in kinds if kind.strip()]
+    for kind in kinds:
+        if kind not in (CPU, MEMORY):
+            raise RuntimeError(f"Unknown profiler: {kind}, expected: {CPU} or {MEMORY}")
+    return kinds
+
+
+@contextmanager
+def profiled(name: str, kinds: Optional[Iterable[str]] = None, output_dir: Optional[str] = None,
+             top: int = TOP_ENTRIES) -> Iterator[List[str]]:
+    """Profile the block with the given profilers, by default those of PROFILE_ENV, i.e., none unless opted in.
+
+    Yield the paths of the reports, written once the block exits, into output_dir:
+        <name>.prof: The cProfile stats, e.g., for snakeviz or pstats.
+        <name>.cpu.txt: The top functions by cumulative and by own time.
+        <name>.memory.txt: The top lines by allocated size, still allocated at the end of the block, and the peak.
+    """
+    kinds = profile_kinds(kinds)
+    reports: List[str] = []
+    if not kinds:
+        yield reports
+        return
+
+    output_dir = output_dir or os.environ.get(PROFILE_DIR_ENV, DEFAULT_PROFILE_DIR)
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, name)
+    profiler = cProfile.Profile() if CPU in kinds else None
+    trace_memory = MEMORY in kinds and not tracemalloc.is_tracing()
+    if trace_memory:
+        tracemalloc.start()
+    if profiler:
+        profiler.enable()
+    try:
+        yield reports
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(path + ".prof")
+            with open(path + ".cpu.txt", "w") as file_obj:
+                file_obj.write(cpu_report(profiler, top))
+            reports += [path + ".prof", path + ".cpu.txt"]
+        if MEMORY in kinds:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if trace_memory:
+                tracemalloc.stop()
+            with open(path + ".memory.txt", "w") as file_obj:
+                file_obj.write(memory_report(snapshot, peak, top))
+            reports.append(path + ".memory.txt")
+        logger.info(f"Profile of {name} written to: {reports}")
+
+
+def cpu_report(profiler: cProfile.Profile, top: int = TOP_ENTRIES) -> str:
+    """Return the top functions of the profile by cumulative time, then by own time."""
+    report = io.StringIO()
+    stats = pstats.Stats(profiler, stream=report).strip_dirs()
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(top)
+    return report.getvalue()
+
+
+def memory_report(snapshot: tracemalloc.Snapshot, peak: int, top: int = TOP_ENTRIES) -> str:
+    """Return the peak of the traced memory and the top lines of the snapshot by allocated size."""
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    lines = [f"Peak traced memory: {peak / 1024:.1f} KiB", f"Top {top} lines by allocated size:"]
+    lines += [str(statistic) for statistic in snapshot.statistics("lineno")[:top]]
+    return "\n".join(lines) + "\n"
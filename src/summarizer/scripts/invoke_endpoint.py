@@ -2,11 +2,12 @@
 import os
 import sys
 import json
-import jsonlines
 import boto3
 import logging
 import argparse as ap
+from typing import Dict
 from summarizer.util import SRC_RESOURCES_DIR
+from summarizer.batch_runner import BatchRunner, booksum_doc_id
 
 BOOKSUM_DIR = os.path.join(SRC_RESOURCES_DIR, "booksum")
 ENDPOINT_NAME = "chpater-sum-gpt3-endpoint"
@@ -28,18 +29,15 @@ def invoke_sm_endpoint(endpoint_name: str, long_text: str, doc_id: str) -> str:
     return summary_text
 
 
-def summarize_chapters_endpoint(endpoint_name: str, input_file: str, output_file: str):
-    with jsonlines.open(output_file, mode="w") as out_file:
-        line_count = 0
-        for line in jsonlines.open(input_file, mode="r"):
-            line_count += 1
-            doc_id = line["metadata"]["chapter_path"] + "-" + line["metadata"]["summary_path"]
-            logger.info(f"Summarizing line# {line_count} document: {doc_id}")
-            line["system_sum"] = invoke_sm_endpoint(endpoint_name, line["text"], doc_id)
-            out_file.write(line)
+def summarize_chapters_endpoint(
+        endpoint_name: str, input_file: str, output_file: str, max_docs: int = 4, ordered: bool = True
+):
+    """Summarize the chapters of a JSON Lines file, max_docs chapters at a time, skipping those already summarized."""
+    def summarize_line(line: Dict) -> Dict:
+        line["system_sum"] = invoke_sm_endpoint(endpoint_name, line["text"], booksum_doc_id(line))
+        return line
 
-            if line_count % 100 == 0:
-                logger.info(f"Sleeping for 30s at ... {line_count}")
+    BatchRunner(summarize_line, max_workers=max_docs, ordered=ordered).run(input_file, output_file)
 
 
 def _get_args(args):
@@ -63,6 +61,14 @@ def _get_args(args):
         default=os.path.join(BOOKSUM_DIR, "booksum-10chapt-sum.jsonl"),
         help="A JSON Lines output file where each line is a JSON object."
     )
+    parser.add_argument(
+        "--max_docs", type=int, metavar="max-docs", default=4,
+        help="The number of chapters summarized concurrently."
+    )
+    parser.add_argument(
+        "--unordered", action="store_true",
+        help="Write the summaries as soon as they are ready, instead of in input order."
+    )
 
     return parser.parse_args(args[1:])
 
@@ -73,7 +79,9 @@ def main(args):
     logging.info(f"Provided args: {args}")
 
     try:
-        summarize_chapters_endpoint(args.endpoint_name, args.input_file, args.output_file)
+        summarize_chapters_endpoint(
+            args.endpoint_name, args.input_file, args.output_file, args.max_docs, not args.unordered
+        )
     except Exception as error:
         logging.error(f"Error while invoking the endpoint: {str(error)}")
 
@@ -0,0 +1,72 @@
+"""Benchmark the summarizer against a local mock of the OpenAI API, writing the results as JSON."""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+from summarizer.util import SRC_RESOURCES_DIR
+from summarizer.eval.benchmark import STAGES, compare, load_corpus, mock_server_process, run_benchmark
+
+BOOKSUM_DIR = os.path.join(SRC_RESOURCES_DIR, "booksum")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    logging.basicConfig(
+        level=logging.WARNING,
+        format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S"
+    )
+    logger = logging.getLogger()
+    parser = argparse.ArgumentParser(description="Command line utility for benchmarking the chapter summarizer.")
+    parser.add_argument("--input_file", type=str, default=os.path.join(BOOKSUM_DIR, "booksum-10chapt.jsonl"))
+    parser.add_argument("--output_file", type=str, default=None, help="The JSON results, printed if not given.")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of times each chapter is summarized.")
+    parser.add_argument("--stages", type=str, default="chunker,text_summarizer,batch",
+                        help=f"Comma separated stages, of: {','.join(STAGES)}.")
+    parser.add_argument("--max_docs", type=int, default=4, help="Number of chapters summarized concurrently.")
+    parser.add_argument("--max_workers", type=int, default=8, help="Number of chunks summarized concurrently.")
+    parser.add_argument("--balanced", action="store_true", help="Chunk the chapters into chunks of even sizes.")
+    parser.add_argument("--endpoint_url", type=str, default=None,
+                        help="A running service to benchmark as the container stage, rather than starting one.")
+    parser.add_argument("--latency", type=float, default=0.5, help="The median seconds of a completion request.")
+    parser.add_argument("--latency_sigma", type=float, default=0.5, help="The log-normal shape of the latency.")
+    parser.add_argument("--tokens_per_second", type=float, default=0.0, help="The completion speed, 0 for instant.")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="The probability of a 503 response.")
+    parser.add_argument("--rate_limit_rate", type=float, default=0.0, help="The probability of a 429 response.")
+    parser.add_argument("--seed", type=int, default=0, help="The seed of the latencies and errors of the mock API.")
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="The JSON results of a previous run; exit with 1 if these results regress from them.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="The relative change tolerated by --baseline.")
+
+    args = parser.parse_args()
+    logger.warning(f"Input args: {vars(args)}")
+
+    server_options = {name: getattr(args, name) for name in
+                      ("latency", "latency_sigma", "tokens_per_second", "error_rate", "rate_limit_rate", "seed")}
+    corpus = load_corpus(args.input_file, args.repeat)
+    with mock_server_process(**server_options) as api_base:
+        stages = run_benchmark(corpus, api_base, args.stages.split(","), args.max_docs, args.max_workers,
+                               args.balanced, args.endpoint_url)
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "config": dict(vars(args), docs=len(corpus)),
+        "stages": stages
+    }
+
+    report_json = json.dumps(report, indent=4)
+    if args.output_file:
+        with open(args.output_file, "w", encoding="utf-8") as file_obj:
+            file_obj.write(report_json + "\n")
+    else:
+        print(report_json)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file_obj:
+            regressions = compare(report, json.load(file_obj), args.tolerance)
+        for regression in regressions:
+            logger.error(f"Regression: {regression}")
+        sys.exit(1 if regressions else 0)
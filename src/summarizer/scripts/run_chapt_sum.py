@@ -1,26 +1,29 @@
 """Summarise chapter text."""
-import time
+import json
 import logging
 import argparse
-import jsonlines
 import os.path
 from pathlib import Path
+from typing import Dict
 from summarizer.util import SRC_RESOURCES_DIR
+from summarizer.batch_runner import BatchRunner, booksum_doc_id
+from summarizer.dao.chunk_index import ChunkIndex
 from summarizer.model.summarizer import TextSummarizer, SummarizerFactory
+from summarizer.model.cached_summarizer import CachedSummarizer
 
 CHAPTER_DIR = os.path.join(SRC_RESOURCES_DIR, "chapter")
 SUMMARY_DIR = os.path.join(SRC_RESOURCES_DIR, "summary")
 BOOKSUM_DIR = os.path.join(SRC_RESOURCES_DIR, "booksum")
 
 
-def summarize_chapter(chapter_dir: str, summary_dir: str):
+def summarize_chapter(chapter_dir: str, summary_dir: str, max_workers: int = 1, cache_file: str = None):
     """Summarize chapter text and save the summary."""
     chapter_path = Path(chapter_dir).resolve()
     summary_path = Path(summary_dir).resolve()
     Path(summary_path).mkdir(parents=True, exist_ok=True)
 
-    gpt3_summarizer = SummarizerFactory.create_summarizer("gpt3")
-    text_summarizer = TextSummarizer(gpt3_summarizer)
+    gpt3_summarizer = SummarizerFactory.create_summarizer("gpt3", cache_file)
+    text_summarizer = TextSummarizer(gpt3_summarizer, max_workers)
 
     for chapter in os.listdir(chapter_path):
         if not chapter.lower().endswith(".txt"):
@@ -35,22 +38,43 @@ def summarize_chapter(chapter_dir: str, summary_dir: str):
             logger.info(f"Summary save into: {sum_file_path}")
 
 
-def summarize_chapter_batch(input_file: str, output_file: str):
-    gpt3_summarizer = SummarizerFactory.create_summarizer("gpt3")
-    text_summarizer = TextSummarizer(gpt3_summarizer)
-
-    with jsonlines.open(output_file, mode="w") as out_file:
-        line_count = 0
-        for line in jsonlines.open(input_file, mode="r"):
-            line_count += 1
-            doc_id = line["metadata"]["chapter_path"] + "-" + line["metadata"]["summary_path"]
-            logger.info(f"Summarizing line# {line_count} document: {doc_id}")
+def summarize_chapter_batch(
+        input_file: str,
+        output_file: str,
+        max_workers: int = 1,
+        cache_file: str = None,
+        max_docs: int = 4,
+        ordered: bool = True,
+        chunk_index: bool = False,
+        balanced: bool = False
+):
+    """Summarize the chapters of a JSON Lines file, max_docs chapters at a time, skipping those already summarized.
+
+    If chunk_index, the chapters are chunked from the chunk index of the input file, which is built on the first run.
+    If balanced, they are chunked into the least chunks of even sizes, rather than greedily.
+    """
+    gpt3_summarizer = SummarizerFactory.create_summarizer("gpt3", cache_file)
+    text_summarizer = TextSummarizer(gpt3_summarizer, max_workers, balanced)
+    index = ChunkIndex.open(input_file, text_summarizer.chunker.max_tokens, balanced=balanced) if chunk_index else None
+    doc_numbers = {}
+    if index is not None:
+        with open(input_file, "r", encoding="utf-8") as file_obj:
+            lines = (json.loads(raw_line) for raw_line in file_obj if raw_line.strip())
+            doc_numbers = {booksum_doc_id(line): doc_no for doc_no, line in enumerate(lines)}
+
+    def summarize_line(line: Dict) -> Dict:
+        doc_id = booksum_doc_id(line)
+        if index is not None:
+            chunks = text_summarizer.chunker.chunk_generator_from_index(index, doc_numbers[doc_id], doc_id)
+            line["system_sum"] = text_summarizer.summarize_chunks(chunks)
+        else:
             line["system_sum"] = text_summarizer.summarize_text(line["text"], doc_id)
-            out_file.write(line)
+        return line
+
+    BatchRunner(summarize_line, max_workers=max_docs, ordered=ordered).run(input_file, output_file)
 
-            if line_count % 100 == 0:
-                logger.info(f"Sleeping for 30s at ... {line_count}")
-                time.sleep(30)
+    if isinstance(gpt3_summarizer, CachedSummarizer):
+        logger.info(f"Summary cache stats: {gpt3_summarizer.cache.stats()}")
 
 
 def summarize_chapter_text(chapter_text: str):
@@ -68,12 +92,24 @@ if __name__ == "__main__":  # pragma: no cover
     parser = argparse.ArgumentParser(description="Command line utility for running chapter summarizer.")
     parser.add_argument("--chapter_dir", type=str, default=CHAPTER_DIR)
     parser.add_argument("--summary_dir", type=str, default=SUMMARY_DIR)
+    parser.add_argument("--max_workers", type=int, default=1, help="Number of chunks summarized concurrently.")
+    parser.add_argument("--cache_file", type=str, default=None, help="SQLite file caching the chunk summaries.")
+    parser.add_argument("--max_docs", type=int, default=4, help="Number of chapters summarized concurrently.")
+    parser.add_argument("--unordered", action="store_true", help="Write the summaries as soon as they are ready.")
+    parser.add_argument("--chunk_index", action="store_true", help="Chunk the chapters from a chunk index sidecar.")
+    parser.add_argument("--balanced", action="store_true", help="Chunk the chapters into chunks of even sizes.")
 
     args = parser.parse_args()
     logger.info(f"Input args: {vars(args)}")
 
-    # summarize_chapter(args.chapter_dir, args.summary_dir)
+    # summarize_chapter(args.chapter_dir, args.summary_dir, args.max_workers, args.cache_file)
     summarize_chapter_batch(
         os.path.join(BOOKSUM_DIR, "booksum-10chapt.jsonl"),
-        os.path.join(BOOKSUM_DIR, "booksum-10chapt-sum.jsonl")
+        os.path.join(BOOKSUM_DIR, "booksum-10chapt-sum.jsonl"),
+        args.max_workers,
+        args.cache_file,
+        args.max_docs,
+        not args.unordered,
+        args.chunk_index,
+        args.balanced
     )
@@ -0,0 +1,67 @@
+"""Micro-benchmark the chunker over synthetic and real corpora, optionally profiling it, writing the results as JSON."""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+from summarizer.util import SRC_RESOURCES_DIR
+from summarizer.model import gpt3_config
+from summarizer.eval.benchmark import compare
+from summarizer.eval.chunker_benchmark import default_cases, run_chunker_benchmark
+from summarizer.profiling import PROFILE_ENV
+
+BOOKSUM_DIR = os.path.join(SRC_RESOURCES_DIR, "booksum")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(name)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
+    )
+    logging.getLogger("summarizer.dao.chunker").setLevel(logging.ERROR)  # The warnings of the long paragraph case
+    logger = logging.getLogger()
+    parser = argparse.ArgumentParser(description="Command line utility for micro-benchmarking the chunker.")
+    parser.add_argument("--input_file", type=str, default=os.path.join(BOOKSUM_DIR, "booksum-10chapt.jsonl"),
+                        help="The real corpus, also the vocabulary of the synthetic ones.")
+    parser.add_argument("--output_file", type=str, default=None, help="The JSON results, printed if not given.")
+    parser.add_argument("--cases", type=str, default=None, help="Comma separated cases, all of them by default.")
+    parser.add_argument("--runs", type=int, default=5, help="Number of times each corpus is chunked.")
+    parser.add_argument("--max_tokens", type=int, default=gpt3_config.text_tokens, help="The tokens of a chunk.")
+    parser.add_argument("--balanced", action="store_true", help="Chunk into chunks of even sizes.")
+    parser.add_argument("--profile", type=str, default=None,
+                        help=f"Comma separated profilers, of: cpu, memory. Defaults to the {PROFILE_ENV} variable.")
+    parser.add_argument("--profile_dir", type=str, default=None, help="The directory of the profile reports.")
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="The JSON results of a previous run; exit with 1 if these results regress from them.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="The relative change tolerated by --baseline.")
+
+    args = parser.parse_args()
+    logger.info(f"Input args: {vars(args)}")
+
+    cases = default_cases(args.input_file, args.max_tokens)
+    if args.cases:
+        cases = {name: cases[name] for name in args.cases.split(",")}
+    profile = args.profile.split(",") if args.profile is not None else None
+    stages = run_chunker_benchmark(cases, args.max_tokens, args.runs, args.balanced, profile, args.profile_dir)
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "config": vars(args),
+        "stages": stages
+    }
+
+    report_json = json.dumps(report, indent=4)
+    if args.output_file:
+        with open(args.output_file, "w", encoding="utf-8") as file_obj:
+            file_obj.write(report_json + "\n")
+    else:
+        print(report_json)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file_obj:
+            regressions = compare(report, json.load(file_obj), args.tolerance)
+        for regression in regressions:
+            logger.error(f"Regression: {regression}")
+        sys.exit(1 if regressions else 0)
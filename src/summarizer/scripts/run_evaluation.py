@@ -4,7 +4,7 @@ import logging
 import jsonlines
 import pandas as pd
 from summarizer.util import SRC_RESOURCES_DIR
-from summarizer.eval.evaluation import evaluate
+from summarizer.eval.batch_evaluation import evaluate_file
 
 
 def evaluation(file_path):
@@ -22,9 +22,9 @@ if __name__ == "__main__":  # pragma: no cover
 
     file_name = "booksum-10chapt_summary.jsonl"
     file_path = os.path.join(SRC_RESOURCES_DIR, "booksum", file_name)
-    eval_metric, scores_df = evaluate(file_path)
+    aggregator, scores_df = evaluate_file(file_path, with_dataframe=True)
     scores_df.to_csv(file_path.split(".")[-2] + ".csv")
-    print(scores_df.describe(datetime_is_numeric=True))
-    print(json.dumps(eval_metric, indent=4, sort_keys=True))
+    print(json.dumps(aggregator.stats(), indent=4))
+    print(json.dumps(aggregator.avg_score(), indent=4, sort_keys=True))
 
 
@@ -0,0 +1,121 @@
+import time
+import asyncio
+import threading
+import pytest
+from summarizer.model.admission import AdmissionController, Overloaded, estimate_cost, DEFAULT_RETRY_AFTER
+
+
+def test_estimate_cost():
+    # 4000 characters are about 1000 tokens, i.e., 2 chunks of 800 tokens, each with a summary of 100 tokens.
+    assert estimate_cost(4000, chunk_tokens=800, summary_tokens=100) == 1200
+    assert estimate_cost(0, chunk_tokens=800, summary_tokens=100) == 100
+
+
+def test_admit_within_budget():
+    admission = AdmissionController(budget_tokens=1000)
+    with admission.admit(600) as tokens:
+        assert tokens == 600
+        with admission.admit(400):
+            assert admission.stats()["in_flight_tokens"] == 1000
+    assert admission.stats() == {"in_flight_tokens": 0, "waiting": 0, "admitted": 2, "rejected": 0}
+
+    # A request costlier than the budget is admitted alone.
+    with admission.admit(5000) as tokens:
+        assert tokens == 1000
+
+
+def test_small_requests_first():
+    admission = AdmissionController(budget_tokens=1000, priority_rate=1.0)
+    order = []
+
+    def request(name: str, cost: int):
+        with admission.admit(cost):
+            order.append(name)
+
+    with admission.admit(1000):
+        threads = []
+        for name, cost in (("big", 900), ("medium", 500), ("small", 10)):
+            threads.append(threading.Thread(target=request, args=(name, cost)))
+            threads[-1].start()
+            time.sleep(0.05)
+        assert admission.stats()["waiting"] == 3
+    for thread in threads:
+        thread.join()
+    assert order == ["small", "medium", "big"]
+
+
+def test_reject():
+    admission = AdmissionController(budget_tokens=1000, max_queue=1, max_wait=0.2)
+    with admission.admit(1000):
+        waiter = threading.Thread(target=lambda: pytest.raises(Overloaded, admission.admit(10).__enter__))
+        waiter.start()
+        time.sleep(0.05)
+
+        # The queue is full: rejected at once.
+        start = time.perf_counter()
+        with pytest.raises(Overloaded) as error:
+            admission.admit(10).__enter__()
+        assert error.value.status == 503
+        assert error.value.retry_after == DEFAULT_RETRY_AFTER
+        assert time.perf_counter() - start < 0.1
+        waiter.join()
+
+        # Not admitted within max_wait.
+        with pytest.raises(Overloaded) as error:
+            admission.admit(10).__enter__()
+        assert error.value.status == 429
+    assert admission.stats() == {"in_flight_tokens": 0, "waiting": 0, "admitted": 1, "rejected": 3}
+
+    # The waiting requests gave up their places.
+    with admission.admit(1000):
+        pass
+
+
+def test_aadmit():
+    admission = AdmissionController(budget_tokens=1000, max_wait=1.0)
+
+    async def request(cost: int, seconds: float) -> float:
+        start = time.perf_counter()
+        async with admission.aadmit(cost):
+            await asyncio.sleep(seconds)
+        return time.perf_counter() - start
+
+    async def run():
+        return await asyncio.gather(request(800, 0.2), request(800, 0.0), request(100, 0.0))
+
+    big, queued, small = asyncio.run(run())
+    assert small < 0.1 < 0.2 <= queued
+    assert admission.stats()["in_flight_tokens"] == 0
+
+    async def cancel():
+        async with admission.aadmit(1000):
+            waiter = asyncio.ensure_future(request(100, 0.0))
+            await asyncio.sleep(0.05)
+            waiter.cancel()
+            await asyncio.sleep(0.05)
+
+    asyncio.run(cancel())
+    assert admission.stats()["waiting"] == 0
+    assert admission.stats()["in_flight_tokens"] == 0
+
+
+def test_aadmit_cancelled_when_admitted():
+    admission = AdmissionController(budget_tokens=1000, max_wait=1.0)
+
+    async def request():
+        async with admission.aadmit(1000):
+            pass
+
+    async def run():
+        with admission.admit(1000):
+            waiter = asyncio.ensure_future(request())
+            await asyncio.sleep(0.1)
+            # Cancelled, then admitted by the release of the held tokens, before the waiter handles its cancellation.
+            waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    asyncio.run(run())
+    assert admission.stats() == {"in_flight_tokens": 0, "waiting": 0, "admitted": 2, "rejected": 0}
+    # The cancelled request gave its tokens back without counting as a request held for no time.
+    assert admission._hold_seconds >= 0.1
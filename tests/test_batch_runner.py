@@ -0,0 +1,59 @@
+import os
+import time
+import random
+import jsonlines
+from summarizer.batch_runner import BatchRunner, booksum_doc_id
+
+
+def test_batch_runner(resource_path, tmp_path):
+    input_file = os.path.join(resource_path, "summary", "booksum-10chapt-sum_curie.jsonl")
+    output_file = os.path.join(tmp_path, "output.jsonl")
+    doc_ids = [booksum_doc_id(line) for line in jsonlines.open(input_file)]
+    failing_ids = set(doc_ids[3:5])
+    processed_ids = []
+
+    def process_line(line):
+        time.sleep(random.random() / 20)
+        processed_ids.append(booksum_doc_id(line))
+        if booksum_doc_id(line) in failing_ids:
+            raise RuntimeError("OpenAI Error")
+        line["processed"] = True
+        return line
+
+    runner = BatchRunner(process_line, max_workers=4)
+    assert runner.run(input_file, output_file) == {"skipped": 0, "succeeded": 8, "failed": 2}
+    assert [booksum_doc_id(line) for line in jsonlines.open(output_file)] == \
+           [doc_id for doc_id in doc_ids if doc_id not in failing_ids]
+
+    # Simulate a crash while writing a line, then resume.
+    with open(output_file, "a") as file_obj:
+        file_obj.write('{"text": "partial')
+    failing_ids.clear()
+    processed_ids.clear()
+    assert runner.run(input_file, output_file) == {"skipped": 8, "succeeded": 2, "failed": 0}
+    assert sorted(processed_ids) == sorted(doc_ids[3:5])
+
+    lines = list(jsonlines.open(output_file))
+    assert sorted(booksum_doc_id(line) for line in lines) == sorted(doc_ids)
+    assert all(line["processed"] for line in lines)
+
+
+def test_batch_runner_unordered(resource_path, tmp_path):
+    input_file = os.path.join(resource_path, "summary", "booksum-10chapt-sum_curie.jsonl")
+    output_file = os.path.join(tmp_path, "output.jsonl")
+
+    def process_line(line):
+        # The earlier lines finish last.
+        time.sleep(0.02 * (10 - int(line["metadata"]["seq"])))
+        return line
+
+    seq_file = os.path.join(tmp_path, "input.jsonl")
+    with jsonlines.open(seq_file, "w") as writer:
+        for seq, line in enumerate(jsonlines.open(input_file)):
+            line["metadata"]["seq"] = seq
+            writer.write(line)
+
+    BatchRunner(process_line, max_workers=10, ordered=False).run(seq_file, output_file)
+    seqs = [line["metadata"]["seq"] for line in jsonlines.open(output_file)]
+    assert sorted(seqs) == list(range(10))
+    assert seqs != list(range(10))
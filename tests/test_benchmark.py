@@ -0,0 +1,57 @@
+import os.path
+import openai
+from summarizer.util import SRC_RESOURCES_DIR
+from summarizer.eval.benchmark import compare, load_corpus, run_benchmark
+from summarizer.eval.mock_completion_server import MockCompletionServer
+from summarizer.model.summarizer import SummarizerFactory
+
+BOOKSUM_FILE = os.path.join(SRC_RESOURCES_DIR, "booksum", "booksum-10chapt.jsonl")
+
+
+def test_mock_completion_server(mocker):
+    with MockCompletionServer(latency=0.01, rate_limit_rate=0.5, retry_after=0.01, seed=0) as server:
+        mocker.patch.object(openai, "api_base", server.url)
+        summarizer = SummarizerFactory.create_summarizer("gpt3")
+        summarizer.rate_limiter = None
+        summarizer.batch_size = 3
+        summaries = summarizer.summarize_many(["one two three four", "five six seven", "eight nine"])
+        # A completion is the beginning of its prompt.
+        assert [summary.split()[0] for summary in summaries] == ["one", "five", "eight"]
+        assert summarizer.summarize("ten eleven").startswith(" ten eleven")
+    # The throttled requests are retried.
+    assert server.stats["prompts"] == 4
+    assert server.stats["requests"] == 2 + server.stats["throttled"]
+
+
+def test_benchmark():
+    corpus = load_corpus(BOOKSUM_FILE, repeat=2)[:12]
+    assert len({line["metadata"]["chapter_path"] for line in corpus}) == 12
+
+    with MockCompletionServer(latency=0.01, seed=0) as server:
+        stages = run_benchmark(corpus, server.url, ["chunker", "text_summarizer", "batch"], max_docs=4)
+    assert openai.api_base != server.url
+    assert list(stages) == ["chunker", "text_summarizer", "batch"]
+    for stats in stages.values():
+        assert stats["docs"] == 12 and stats["failed"] == 0
+        assert stats["docs_per_sec"] > 0 and stats["p50_seconds"] <= stats["p99_seconds"]
+
+    baseline = {"stages": stages}
+    assert compare(baseline, baseline) == []
+    slower = {"stages": {"batch": dict(stages["batch"], docs_per_sec=stages["batch"]["docs_per_sec"] / 2)}}
+    assert [regression.split(":")[0] for regression in compare(slower, baseline)] == ["batch.docs_per_sec"]
+
+
+def test_benchmark_container(tmp_path, monkeypatch):
+    # The rate limit file of the host, as seen by the service subprocess.
+    rate_limit_file = os.path.join(tmp_path, "rate-limit")
+    monkeypatch.setenv("OPENAI_RATE_LIMIT_FILE", rate_limit_file)
+    corpus = load_corpus(BOOKSUM_FILE)[:4]
+
+    with MockCompletionServer(latency=0.01, seed=0) as server:
+        stages = run_benchmark(corpus, server.url, ["container"], max_docs=2)
+    stats = stages["container"]
+    assert stats["docs"] == 4 and stats["failed"] == 0
+    assert stats["server_cpu_seconds"] > 0
+    assert server.stats["requests"] > 0
+    # The service summarized without the rate limiter, so it did not spend the budget of the host.
+    assert not os.path.exists(rate_limit_file)
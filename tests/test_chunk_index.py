@@ -0,0 +1,92 @@
+import os
+import json
+import shutil
+import jsonlines
+from pytest import raises
+from summarizer.dao.chunker import TextChunker
+from summarizer.dao.chunk_index import ChunkIndex
+
+
+def test_chunk_index(resource_path, tmp_path):
+    corpus_file = os.path.join(tmp_path, "corpus.jsonl")
+    shutil.copy(os.path.join(resource_path, "summary", "booksum-10chapt-sum_curie.jsonl"), corpus_file)
+    with open(corpus_file, "a") as file_obj:
+        file_obj.write(json.dumps({"text": "Café naïve. " * 50 + "\r\n\r\n" + "x " * 300 + ". y z.\n\nq"}) + "\n")
+    texts = [line["text"] for line in jsonlines.open(corpus_file)]
+
+    index = ChunkIndex.open(corpus_file, 100)
+    assert len(index) == len(texts)
+    assert os.path.exists(corpus_file + ".chunkidx")
+
+    # Rechunking with other budgets reuses the token counts of the index, with the same chunks as from the text.
+    for max_tokens in [50, 500]:
+        chunker = TextChunker(max_tokens)
+        index = ChunkIndex.open(corpus_file, max_tokens)
+        assert index.max_tokens == max_tokens
+        for doc_no, text in enumerate(texts):
+            assert list(chunker.chunk_generator_from_index(index, doc_no, "n/a")) == \
+                   list(chunker.chunk_generator_from_text(text, "n/a"))
+
+    chunker = TextChunker(200)
+    chunks = list(chunker.chunk_generator_from_index(ChunkIndex.load(corpus_file), 1, "n/a"))
+    assert chunks == list(chunker.chunk_generator_from_text(texts[1], "n/a"))
+
+    # The packing is saved along with max_tokens.
+    chunker = TextChunker(200, balanced=True)
+    chunks = list(chunker.chunk_generator_from_index(ChunkIndex.load(corpus_file), 1, "n/a"))
+    assert chunks == list(chunker.chunk_generator_from_text(texts[1], "n/a"))
+    assert ChunkIndex.load(corpus_file).balanced
+
+    # A modified corpus makes the index stale.
+    with open(corpus_file, "a") as file_obj:
+        file_obj.write(json.dumps({"text": "The end."}) + "\n")
+    assert ChunkIndex.load(corpus_file) is None
+    assert len(ChunkIndex.open(corpus_file, 100)) == len(texts) + 1
+
+
+def test_chunk_index_shared(resource_path, tmp_path, mocker):
+    corpus_file = os.path.join(tmp_path, "corpus.jsonl")
+    shutil.copy(os.path.join(resource_path, "summary", "booksum-10chapt-sum_curie.jsonl"), corpus_file)
+    texts = [line["text"] for line in jsonlines.open(corpus_file)]
+    ChunkIndex.open(corpus_file, 100)
+
+    # The texts of the documents are sliced from the index, rather than parsed from the corpus again.
+    index = ChunkIndex.load(corpus_file)
+    mocker.patch("summarizer.dao.chunk_index.json.loads", side_effect=AssertionError("parsed"))
+    chunker = TextChunker(100)
+    for doc_no, text in enumerate(texts):
+        assert list(chunker.chunk_generator_from_index(index, doc_no, "n/a")) == \
+               list(chunker.chunk_generator_from_text(text, "n/a"))
+
+    # A chunk generator started before a rechunk, e.g., by another thread, iterates the chunks it started with.
+    generator = chunker.chunk_generator_from_index(index, 1, "n/a")
+    first = next(generator)
+    index.rechunk(50)
+    assert [first] + list(generator) == list(chunker.chunk_generator_from_text(texts[1], "n/a"))
+    assert ChunkIndex.load(corpus_file).max_tokens == 50
+
+
+def test_chunk_index_saved_concurrently(resource_path, tmp_path, mocker):
+    corpus_file = os.path.join(tmp_path, "corpus.jsonl")
+    shutil.copy(os.path.join(resource_path, "summary", "booksum-10chapt-sum_curie.jsonl"), corpus_file)
+    first, second = ChunkIndex.open(corpus_file, 100), ChunkIndex.load(corpus_file)
+    second.rechunk(50)
+
+    # Another index is saved, e.g., by another worker, while the first one is between its write and its rename.
+    replace = os.replace
+
+    def replace_after_second_save(src, dst):
+        mocker.patch("summarizer.dao.chunk_index.os.replace", side_effect=replace)
+        second.save()
+        replace(src, dst)
+
+    mocker.patch("summarizer.dao.chunk_index.os.replace", side_effect=replace_after_second_save)
+    first.save()
+    assert ChunkIndex.load(corpus_file).max_tokens == 100
+    assert sorted(os.listdir(tmp_path)) == ["corpus.jsonl", "corpus.jsonl.chunkidx"]
+
+    # A failed save leaves no temporary file behind.
+    mocker.patch("summarizer.dao.chunk_index.os.replace", side_effect=OSError("disk full"))
+    with raises(OSError):
+        first.save()
+    assert sorted(os.listdir(tmp_path)) == ["corpus.jsonl", "corpus.jsonl.chunkidx"]
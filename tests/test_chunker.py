@@ -1,7 +1,11 @@
+import io
 import os
+import re
+import mmap
+import random
 from nltk.tokenize import sent_tokenize
 
-from summarizer.dao.chunker import paragraphs, TextChunker
+from summarizer.dao.chunker import paragraphs, iter_paragraphs, Chunk, TextChunker, PARA_REGEX
 from summarizer.model.gpt3_summarizer import count_tokens
 
 
@@ -74,6 +78,82 @@ def test_chunk_generator_from_text(resource_path):
     assert len(chunk_words) == len(words)
 
 
+def test_iter_paragraphs():
+    for text in ["", " \n\n ", "a", "\r\n\r\n a \n\n b\r\n\r\n\r\n", "a\n\n \n\nb \n\n \n", "é\r\n\r\nü\n"]:
+        for block_size in [1, 2, 64]:
+            paras = list(iter_paragraphs(io.BytesIO(text.encode("utf-8")), block_size=block_size))
+            assert paras == re.split(PARA_REGEX, text.strip())
+
+
+def test_chunk_generator_from_stream(resource_path):
+    chunker_test_file = os.path.join(resource_path, "chunker-test-2.txt")
+    chunker = TextChunker(num_of_tokens=100)
+    with open(chunker_test_file, "r") as file_obj:
+        chunks = list(chunker.chunk_generator_from_text(file_obj.read(), "n/a"))
+
+    with open(chunker_test_file, "rb") as file_obj:
+        assert list(chunker.chunk_generator_from_stream(file_obj, "n/a")) == chunks
+        with mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ) as mmap_obj:
+            assert list(chunker.chunk_generator_from_stream(mmap_obj, "n/a")) == chunks
+
+
+def test_chunk_spans(resource_path):
+    chunker_test_file = os.path.join(resource_path, "chunker-test-2.txt")
+    chunker = TextChunker(num_of_tokens=100)
+    with open(chunker_test_file, "r") as file_obj:
+        raw_text = file_obj.read()
+    raw_bytes = raw_text.encode("utf-8")
+
+    for chunk in chunker.chunk_generator_from_text(raw_text, "n/a"):
+        assert not hasattr(chunk, "__dict__")
+        assert chunk.source is raw_text
+        assert chunk.text() is chunk.text()
+        assert chunk.to_bytes() == chunk.text().encode("utf-8")
+
+        # The same spans of the UTF-8 encoded text, whose buffers are views of it.
+        spans = tuple(tuple(len(raw_text[:offset].encode("utf-8")) for offset in span) for span in chunk.spans)
+        byte_chunk = Chunk(chunk.id, chunk.num_of_tokens, chunk.document_id, source=raw_bytes, spans=spans)
+        assert byte_chunk == chunk
+        assert all(buffer.obj in (raw_bytes, b"\n", b" ") for buffer in byte_chunk.buffers())
+        assert byte_chunk.to_bytes() == chunk.to_bytes()
+
+
+def test_balanced_chunking(resource_path):
+    chunker_test_file = os.path.join(resource_path, "chunker-test-2.txt")
+    with open(chunker_test_file, "r") as file_obj:
+        raw_text = file_obj.read()
+    greedy_chunks = list(TextChunker(num_of_tokens=100).chunk_generator_from_text(raw_text, "n/a"))
+    chunker = TextChunker(num_of_tokens=100, balanced=True)
+    chunks = list(chunker.chunk_generator_from_text(raw_text, "n/a"))
+
+    assert [chunk.id for chunk in chunks] == list(range(1, len(chunks) + 1))
+    assert sum(chunk.num_of_tokens ** 2 for chunk in chunks) <= sum(chunk.num_of_tokens ** 2 for chunk in greedy_chunks)
+    assert min(chunk.num_of_tokens for chunk in chunks) >= min(chunk.num_of_tokens for chunk in greedy_chunks)
+    for chunk in chunks:
+        assert chunk.num_of_tokens <= chunker.max_tokens
+        assert chunk.num_of_tokens == count_tokens(chunk.text())
+    assert sum((chunk.paragraphs for chunk in chunks), ()) == sum((chunk.paragraphs for chunk in greedy_chunks), ())
+
+
+def test_chunk_sizes_random():
+    # Random documents of paragraphs of sentences of various lengths, some longer than a chunk.
+    rand = random.Random(42)
+    words = ["a", "summary", "of", "the", "long", "chapter", "tokens", "and", "paragraphs", "were", "split"]
+    for max_tokens in (5, 12, 30):
+        for _ in range(20):
+            text = "\n\n".join(
+                " ".join(" ".join(rand.choices(words, k=rand.randint(1, 8))).capitalize() + "."
+                         for _ in range(rand.randint(1, 6)))
+                for _ in range(rand.randint(1, 12))
+            )
+            greedy_chunks = list(TextChunker(num_of_tokens=max_tokens).chunk_generator_from_text(text, "n/a"))
+            chunks = list(TextChunker(num_of_tokens=max_tokens, balanced=True).chunk_generator_from_text(text, "n/a"))
+            assert len(chunks) <= len(greedy_chunks)
+            for chunk in greedy_chunks + chunks:
+                assert chunk.num_of_tokens <= max_tokens
+                assert count_tokens(chunk.text()) <= max_tokens
+
+
 def test_large_paragraph_chunking():
     para_text = "While running on the entire test set, I notice, rarely, there is a paragraph which is greater than " \
                 "our max_tokens. Currently, for those excessively long paragraphs, we through an exception " \
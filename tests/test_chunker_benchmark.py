@@ -0,0 +1,30 @@
+import os.path
+from summarizer.util import SRC_RESOURCES_DIR
+from summarizer.dao.chunker import paragraph_spans
+from summarizer.eval.benchmark import compare
+from summarizer.eval.chunker_benchmark import Case, default_cases, run_chunker_benchmark, synthetic_text
+
+BOOKSUM_FILE = os.path.join(SRC_RESOURCES_DIR, "booksum", "booksum-10chapt.jsonl")
+
+
+def test_synthetic_text():
+    text = synthetic_text(3, 40, ["alpha", "beta", "gamma"], "\r\n", seed=1)
+    assert text == synthetic_text(3, 40, ["alpha", "beta", "gamma"], "\r\n", seed=1)
+    assert text.count("\r\n\r\n") == 2
+    assert [len(text[start:end].split()) for start, end in paragraph_spans(text)] == [40, 40, 40]
+
+
+def test_chunker_benchmark(tmp_path):
+    cases = default_cases(BOOKSUM_FILE, max_tokens=200, num_of_docs=2)
+    assert len(cases["long_paragraph_fallback"].texts) == 2
+    cases = {name: cases[name] for name in ("long_paragraph_fallback", "crlf_stream", "booksum")}
+    cases["crlf_text"] = Case(cases["crlf_stream"].texts, "text")
+    cases["lexrank"] = Case(cases["crlf_stream"].texts, "lexrank")
+
+    stages = run_chunker_benchmark(cases, max_tokens=200, runs=2, profile=["cpu"], profile_dir=str(tmp_path))
+    for stats in stages.values():
+        assert stats["docs"] == 2 and stats["chunks"] > stats["texts"] and stats["mb_per_sec"] > 0
+        assert os.path.exists(stats["profile"][0])
+    # Windows line endings are chunked the same from a text and from a stream.
+    assert stages["crlf_text"]["chunks"] == stages["crlf_stream"]["chunks"]
+    assert compare({"stages": stages}, {"stages": stages}) == []
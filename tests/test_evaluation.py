@@ -3,7 +3,9 @@ import json
 from pytest import approx
 import jsonlines
 
-from summarizer.eval.evaluation import get_eval_score, get_eval_metric, evaluate
+from summarizer.eval.evaluation import get_eval_score, get_eval_metric, evaluate, aggregate_scores
+from summarizer.eval.score_aggregator import ScoreAggregator
+from summarizer.eval import batch_evaluation
 
 
 def test_get_score():
@@ -49,3 +51,39 @@ def test_get_eval_metric(resource_path, rel_tol):
     assert score["rouge-l"]["r"] == approx(0.090, rel_tol)
     assert score["rouge-l"]["f"] == approx(0.130, rel_tol)
 
+
+
+def test_batch_evaluation(resource_path):
+    reference = "this is a dog. it is dog. dog it is. a dog, it is"
+    for candidate in ["it is dog", "a dog. is it. dog dog", "John very much loves data science."]:
+        assert batch_evaluation.get_eval_score(candidate, reference) == get_eval_score(candidate, reference)
+
+    eval_file = os.path.join(resource_path, "summary", "booksum-10chapt-sum_curie.jsonl")
+    for line in jsonlines.open(eval_file):
+        assert batch_evaluation.get_eval_score(line["system_sum"], line["summary"]) == \
+               get_eval_score(line["system_sum"], line["summary"])
+
+    score, _ = batch_evaluation.evaluate(eval_file, max_workers=2)
+    expected_score, _ = evaluate(eval_file)
+    assert score == expected_score
+
+
+def test_score_aggregator(resource_path):
+    eval_file = os.path.join(resource_path, "summary", "booksum-10chapt-sum_curie.jsonl")
+    expected_score, expected_df = evaluate(eval_file)
+    eval_file = eval_file.split(".")[0] + "_eval.jsonl"
+    lines = list(jsonlines.open(eval_file))
+
+    aggregator, scores_df = aggregate_scores(lines)
+    assert scores_df is None
+    assert aggregator.avg_score() == expected_score
+    _, scores_df = get_eval_metric(eval_file)
+    assert scores_df.equals(expected_df)
+
+    shards = [aggregate_scores(lines[:3])[0], aggregate_scores(lines[3:])[0]]
+    merged = ScoreAggregator.from_dict(json.loads(json.dumps(shards[0].to_dict()))).merge(shards[1])
+    stats = merged.stats()["rouge-l-f"]
+    assert merged.count == len(lines)
+    assert stats["mean"] == approx(expected_df["rouge-l-f"].mean())
+    assert stats["std"] == approx(expected_df["rouge-l-f"].std())
+    assert stats["p50"] == approx(sorted(expected_df["rouge-l-f"])[4], abs=0.001)
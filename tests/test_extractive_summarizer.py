@@ -0,0 +1,85 @@
+import os.path
+import time
+import asyncio
+import tracemalloc
+import numpy as np
+from summarizer.model.summarizer import SummarizerFactory, TextSummarizer
+from summarizer.model.extractive_summarizer import ExtractiveSummarizer, lexrank
+from summarizer.model.gpt3_summarizer import count_tokens
+from summarizer.dao.chunker import sentence_spans
+
+
+def test_lexrank():
+    sentences = ["The cat sat on the mat.", "A cat sat on a mat.", "The cat is on the mat.", "Stocks fell sharply."]
+    scores = lexrank(sentences)
+    assert np.isclose(scores.sum(), 1)
+    assert np.argmin(scores) == 3
+    assert np.allclose(lexrank(["Only one sentence."]), [1])
+
+
+def test_lexrank_large(resource_path):
+    with open(os.path.join(resource_path, "chapter", "01.txt"), "r") as file_obj:
+        text = file_obj.read()
+    sentences = [text[start:end] for start, end in sentence_spans(text)]
+    sentences = [f"{sentence} Copy {copy}." for copy in range(60) for sentence in sentences]
+    assert len(sentences) > 5000
+
+    # Its time is benchmarked by the lexrank_large case of the chunker benchmark, see run_chunker_benchmark.
+    tracemalloc.start()
+    scores = lexrank(sentences)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"LexRank of {len(sentences)} sentences, peak memory: {peak / 2 ** 20:.1f} MiB")
+    # Far from the 200 MiB of a dense similarity matrix of the sentences.
+    assert peak < 32 * 2 ** 20
+    assert np.isclose(scores.sum(), 1)
+
+
+def test_extractive_summarizer(resource_path):
+    with open(os.path.join(resource_path, "chapter", "01.txt"), "r") as file_obj:
+        text = file_obj.read()
+    summarizer = ExtractiveSummarizer(text_tokens=2000, summary_tokens=150)
+    summarizer.summarize(text)
+
+    start = time.perf_counter()
+    summary = summarizer.summarize(text)
+    print(f"Extractive summary of {len(text)} characters in {time.perf_counter() - start:.3f}s")
+    assert 100 < count_tokens(summary) <= 150
+
+    # The sentences of the summary are sentences of the text, in text order.
+    sentences = [text[start:end] for start, end in sentence_spans(text)]
+    assert " ".join(sentence for sentence in sentences if sentence in summary) == summary
+
+    assert asyncio.run(summarizer.asummarize(text)) == summary
+    assert summarizer.summarize("") == ""
+    assert 0 < count_tokens(ExtractiveSummarizer(2000, 5).summarize(text)) <= 5
+    assert summarizer.params()["damping"] == summarizer.damping
+
+
+def test_extractive_text_summarizer(resource_path):
+    summarizer = SummarizerFactory.create_summarizer("extractive")
+    assert isinstance(summarizer, ExtractiveSummarizer)
+    text_summarizer = TextSummarizer(summarizer)
+
+    with open(os.path.join(resource_path, "chapter", "01.txt"), "r") as file_obj:
+        text = file_obj.read()
+    summary = text_summarizer.summarize_text(text, target_tokens=200)
+    assert 0 < count_tokens(summary) <= 200
+
+
+def test_shrink_text(resource_path, mocker):
+    summarizer = SummarizerFactory.create_summarizer("extractive")
+    with open(os.path.join(resource_path, "chapter", "01.txt"), "r") as file_obj:
+        text = file_obj.read()
+    assert TextSummarizer(summarizer).shrink_text(text) == text
+
+    text_summarizer = TextSummarizer(summarizer, shrink_tokens=500)
+    shrunk_text = text_summarizer.shrink_text(text)
+    assert 400 < count_tokens(shrunk_text) <= 500
+    assert TextSummarizer(summarizer, shrink_tokens=count_tokens(text)).shrink_text(text) == text
+
+    # The huge document is shrunk before it is chunked.
+    mock_chunk_generator = mocker.spy(text_summarizer.chunker, "chunk_generator_from_text")
+    text_summarizer.summarize_text(text)
+    assert mock_chunk_generator.call_args.args[0] == shrunk_text
+    assert asyncio.run(text_summarizer.asummarize_text(text)) == text_summarizer.summarize_text(text)
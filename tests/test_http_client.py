@@ -0,0 +1,37 @@
+import asyncio
+import threading
+import openai
+from openai import api_requestor
+from summarizer.model.http_client import HttpClient
+from summarizer.model.gpt3_summarizer import Gpt3Summarizer
+
+
+def test_shared_session(mocker):
+    mocker.patch.object(api_requestor, "_thread_context", threading.local())
+    http_client = HttpClient(max_connections=4, connect_timeout=1.0, read_timeout=5.0)
+    summarizer = Gpt3Summarizer("text-curie-001", 0.7, 1800, 200, 1.0, 0.0, 1, http_client=http_client)
+
+    # Every thread sends its requests through the connection pool of the client.
+    sessions = []
+    thread = threading.Thread(target=lambda: sessions.append(api_requestor._thread_context.session))
+    thread.start()
+    thread.join()
+    assert sessions == [http_client.session]
+    assert http_client.session.get_adapter("https://api.openai.com").poolmanager.connection_pool_kw["maxsize"] == 4
+    assert summarizer._completion_params("text")["request_timeout"] == (1.0, 5.0)
+
+    mock_create = mocker.patch("openai.Completion.acreate")
+    aiosessions = []
+
+    async def mocked_acreate(**_):
+        aiosessions.append(openai.aiosession.get())
+        return {"choices": [{"text": "summary"}]}
+
+    async def summarize_twice():
+        await asyncio.gather(summarizer.asummarize("text 1"), summarizer.asummarize("text 2"))
+        await http_client.aclose()
+
+    mock_create.side_effect = mocked_acreate
+    asyncio.run(summarize_twice())
+    assert len(aiosessions) == 2 and aiosessions[0] is aiosessions[1]
+    assert aiosessions[0].closed
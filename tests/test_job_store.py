@@ -0,0 +1,83 @@
+import os
+import time
+from summarizer.dao.job_store import JobStore, QUEUED, RUNNING, SUCCEEDED, FAILED
+
+
+def test_job_lifecycle(tmp_path):
+    store = JobStore(os.path.join(tmp_path, "jobs.sqlite"))
+    documents = [{"text": "First chapter.", "doc_id": "1"}, {"text": "Second chapter.", "doc_id": "2"}]
+
+    job_id = store.create(documents, "owner")
+    assert store.get(job_id)["status"] == QUEUED
+    assert store.get("unknown") is None
+    assert store.documents(job_id) == documents
+
+    store.start(job_id, "owner", chunks_total=4)
+    store.progress(job_id, "owner", chunks_done=3)
+    job = store.get(job_id)
+    assert (job["status"], job["chunks_done"], job["chunks_total"]) == (RUNNING, 3, 4)
+    store.progress(job_id, "owner", chunks_done=4, chunks_total=5)
+    job = store.get(job_id)
+    assert (job["chunks_done"], job["chunks_total"]) == (4, 5)
+    assert store.result(job_id) is None
+
+    result = [{"doc_id": "1", "summary": "first"}, {"doc_id": "2", "summary": "second"}]
+    store.succeed(job_id, "owner", result)
+    store.close()
+
+    store = JobStore(os.path.join(tmp_path, "jobs.sqlite"))
+    assert store.get(job_id)["status"] == SUCCEEDED
+    assert store.result(job_id) == result
+
+    failed_job_id = store.create(documents, "owner")
+    store.fail(failed_job_id, "owner", "Algorithm error")
+    assert store.get(failed_job_id)["status"] == FAILED
+    assert store.get(failed_job_id)["error"] == "Algorithm error"
+
+
+def test_claim_orphans(tmp_path):
+    store = JobStore(os.path.join(tmp_path, "jobs.sqlite"), lease_seconds=0.2)
+    own_job_id = store.create([{"text": "text"}], "worker-1")
+    live_job_id = store.create([{"text": "text"}], "worker-2")
+    orphan_ids = [store.create([{"text": "text"}], "worker-3") for _ in range(3)]
+    store.start(orphan_ids[0], "worker-3", chunks_total=1)
+
+    # The leases have not expired yet.
+    assert store.claim_orphans("worker-1", limit=2) == []
+
+    # worker-2 renews its lease, worker-3 is gone.
+    time.sleep(0.15)
+    assert store.renew("worker-2") == 1
+    time.sleep(0.1)
+    assert store.claim_orphans("worker-1", limit=2) == orphan_ids[:2]
+    assert store.get(orphan_ids[0])["status"] == QUEUED
+    assert store.claim_orphans("worker-1", limit=2) == orphan_ids[2:]
+    assert store.claim_orphans("worker-1", limit=2) == []
+    assert store.get(own_job_id)["status"] == QUEUED
+
+    # The jobs of worker-1 are claimed by a restarted worker, whatever its pid, once it stops renewing its lease.
+    time.sleep(0.25)
+    assert store.claim_orphans("worker-4", limit=10) == [own_job_id, live_job_id] + orphan_ids
+
+    # A finished job is not claimed.
+    assert store.succeed(own_job_id, "worker-4", []) == 1
+    time.sleep(0.25)
+    assert own_job_id not in store.claim_orphans("worker-5", limit=10)
+
+
+def test_former_owner(tmp_path):
+    store = JobStore(os.path.join(tmp_path, "jobs.sqlite"), lease_seconds=0.1)
+    job_id = store.create([{"text": "text"}], "worker-1")
+    assert store.start(job_id, "worker-1", chunks_total=2) == 1
+    time.sleep(0.15)
+    assert store.claim_orphans("worker-2", limit=1) == [job_id]
+
+    # The worker that missed its lease can no longer update the job, whose new owner runs it from the start.
+    assert store.progress(job_id, "worker-1", chunks_done=1) == 0
+    assert store.succeed(job_id, "worker-1", []) == 0
+    assert store.fail(job_id, "worker-1", "error") == 0
+    assert store.get(job_id)["status"] == QUEUED
+    assert store.start(job_id, "worker-2", chunks_total=2) == 1
+    assert store.progress(job_id, "worker-2", chunks_done=2) == 1
+    assert store.succeed(job_id, "worker-2", [{"summary": "summary"}]) == 1
+    assert store.result(job_id) == [{"summary": "summary"}]
@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+import subprocess
+from prometheus_client import REGISTRY, CollectorRegistry, Histogram
+from summarizer.metrics import timed
+from summarizer.model.summarizer import SummarizerFactory, TextSummarizer
+
+STAGES = ("tokenize", "chunk", "summarize", "completion")
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_timed():
+    histogram = Histogram("test_timed_seconds", "Test.", registry=CollectorRegistry())
+
+    def slow_items():
+        for item in range(3):
+            time.sleep(0.01)
+            yield item
+
+    items = []
+    for item in timed(slow_items(), histogram):
+        items.append(item)
+        time.sleep(0.05)  # The time of the consumer is not observed.
+    assert items == [0, 1, 2]
+    registry_sample = histogram.collect()[0].samples
+    count = next(s.value for s in registry_sample if s.name == "test_timed_seconds_count")
+    seconds = next(s.value for s in registry_sample if s.name == "test_timed_seconds_sum")
+    assert count == 1
+    assert 0.03 <= seconds < 0.1
+
+
+def test_summarizer_metrics(sample_file, mocker):
+    gpt3_summarizer = SummarizerFactory.create_summarizer("gpt3")
+    gpt3_summarizer.text_tokens = 100
+    gpt3_summarizer.batch_size = 1
+    mock_create = mocker.patch("openai.Completion.create")
+    mock_create.return_value = {"choices": [{"index": 0, "text": "summary"}],
+                                "usage": {"prompt_tokens": 10, "completion_tokens": 2, "total_tokens": 12}}
+    text_summarizer = TextSummarizer(gpt3_summarizer)
+
+    prompt_tokens = sample("summarizer_openai_tokens_total", kind="prompt")
+    completion_tokens = sample("summarizer_openai_tokens_total", kind="completion")
+    stage_counts = {stage: sample("summarizer_stage_seconds_count", stage=stage) for stage in STAGES}
+    with open(sample_file, "r") as file_obj:
+        text_summarizer.summarize_text(file_obj.read())
+
+    num_of_requests = mock_create.call_count
+    assert sample("summarizer_openai_tokens_total", kind="prompt") - prompt_tokens == 10 * num_of_requests
+    assert sample("summarizer_openai_tokens_total", kind="completion") - completion_tokens == 2 * num_of_requests
+    for stage in STAGES:
+        assert sample("summarizer_stage_seconds_count", stage=stage) > stage_counts[stage], stage
+    assert sample("summarizer_stage_seconds_count", stage="chunk") == stage_counts["chunk"] + 1
+
+
+def test_multiprocess_metrics(tmp_path):
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path), PYTHONPATH="src")
+    for _ in range(2):
+        subprocess.run([sys.executable, "-c", "from summarizer import metrics; metrics.PROMPT_TOKENS.inc(5)"],
+                       env=env, check=True)
+
+    # The metrics of both (gone) processes are summed by whichever process serves them.
+    latest = subprocess.run([sys.executable, "-c", "from summarizer import metrics; print(metrics.latest()[0].decode())"],
+                            env=env, check=True, capture_output=True, text=True).stdout
+    assert 'summarizer_openai_tokens_total{kind="prompt"} 10.0' in latest
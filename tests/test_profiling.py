@@ -0,0 +1,24 @@
+import os
+from pytest import raises
+from summarizer.profiling import PROFILE_ENV, profiled
+
+
+def test_profiled(tmp_path, monkeypatch):
+    monkeypatch.delenv(PROFILE_ENV, raising=False)
+    with profiled("off", output_dir=str(tmp_path)) as reports:
+        sum(range(1000))
+    assert reports == [] and os.listdir(tmp_path) == []
+
+    monkeypatch.setenv(PROFILE_ENV, "cpu, memory")
+    with profiled("on", output_dir=str(tmp_path)) as reports:
+        data = [str(number) * 10 for number in range(10000)]
+    assert sorted(os.listdir(tmp_path)) == ["on.cpu.txt", "on.memory.txt", "on.prof"]
+    assert len(reports) == 3
+    with open(tmp_path / "on.memory.txt") as file_obj:
+        memory_report = file_obj.read()
+    assert memory_report.startswith("Peak traced memory:") and "test_profiling.py" in memory_report
+    assert len(data) == 10000
+
+    with raises(RuntimeError):
+        with profiled("unknown", ["gpu"], str(tmp_path)):
+            pass
@@ -0,0 +1,55 @@
+import os
+import time
+import pytest
+from openai.error import RateLimitError, InvalidRequestError
+from summarizer.model.rate_limiter import RateLimiter, backoff_delay, retry_after_seconds
+from summarizer.model.gpt3_summarizer import Gpt3Summarizer
+
+
+def test_token_bucket(tmp_path):
+    rate_limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=6000)
+    rate_limiter.acquire(3000)
+    rate_limiter.acquire(3000)
+
+    # The tokens bucket is empty, 1000 tokens refill in 10s.
+    assert rate_limiter._try_acquire(1000) == pytest.approx(10, abs=0.1)
+
+    # A second limiter on the same state file shares the budget.
+    state_file = os.path.join(tmp_path, "rate-limit")
+    RateLimiter(600, 6000, state_file).acquire(6000)
+    assert RateLimiter(600, 6000, state_file)._try_acquire(600) == pytest.approx(6, abs=0.1)
+
+
+def test_throttle(tmp_path):
+    rate_limiter = RateLimiter(600, 6000, os.path.join(tmp_path, "rate-limit"))
+    rate_limiter.throttle(0.2)
+    start = time.time()
+    rate_limiter.acquire(100)
+    assert time.time() - start >= 0.15
+    assert rate_limiter._update(lambda state: state[4]) == pytest.approx(0.8)
+
+
+def test_backoff_delay():
+    assert backoff_delay(3, retry_after=7) == 7
+    assert 4 <= backoff_delay(3) <= 8
+    assert backoff_delay(20) <= 60
+    assert retry_after_seconds({"retry-after": "2"}) == 2
+    assert retry_after_seconds({}) is None
+
+
+def test_retry(mocker):
+    rate_limiter = RateLimiter(600, 60000)
+    summarizer = Gpt3Summarizer("text-curie-001", 0.7, 1800, 200, 1.0, 0.0, 1, rate_limiter, max_retries=2)
+    mock_throttle = mocker.spy(rate_limiter, "throttle")
+    mock_create = mocker.patch("openai.Completion.create")
+    mock_create.side_effect = [
+        RateLimitError("Slow down", headers={"Retry-After": "0.01"}),
+        {"choices": [{"text": "summary"}]}
+    ]
+    assert summarizer.summarize("text") == "summary"
+    mock_throttle.assert_called_once_with(0.01)
+
+    mock_create.side_effect = InvalidRequestError("Too long", param="prompt")
+    with pytest.raises(RuntimeError):
+        summarizer.summarize("text")
+    assert mock_create.call_count == 3
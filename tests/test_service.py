@@ -0,0 +1,337 @@
+import os
+import json
+import asyncio
+import sqlite3
+import time
+import threading
+from typing import Dict
+from pytest import fixture
+from prometheus_client import CONTENT_TYPE_LATEST
+from summarizer.model.gpt3_summarizer import Gpt3Summarizer
+from summarizer.model.single_flight import SingleFlight
+from summarizer.model.summarizer import TextSummarizer
+from summarizer.model.admission import AdmissionController
+from summarizer.dao.job_store import QUEUED, RUNNING, SUCCEEDED, FAILED
+from summarizer_service import JobRunner, SummarizerService, app
+import asgi
+
+
+@fixture
+def client(mocker):
+    """A test client of the Flask app, summarizing each chunk by its first words, without the OpenAI API."""
+    # A summarizer, and coalesced summaries, of this test only.
+    mocker.patch.object(SummarizerService, "_summarizer", None)
+    mocker.patch.object(SummarizerService, "_documents", SingleFlight(ttl=0))
+    mocker.patch.object(Gpt3Summarizer, "summarize", side_effect=lambda text: " ".join(text.split()[:3]))
+    SummarizerService.get_summarizer()
+    return app.test_client()
+
+
+def test_target_tokens(client, sample_file):
+    with open(sample_file, "r") as file_obj:
+        text = file_obj.read()
+
+    response = client.post("/invocations", json={"text": text, "target_tokens": 20})
+    assert response.status_code == 200
+    assert json.loads(response.data)["summary"]
+    calls = Gpt3Summarizer.summarize.call_count
+
+    # Rejected before any chunk is summarized.
+    for target_tokens in ("200", 0, -1, 2.5, True):
+        response = client.post("/invocations", json={"text": text, "target_tokens": target_tokens})
+        assert response.status_code == 400
+        assert b"target_tokens" in response.data
+    response = client.post("/invocations", json={"text": text, "target_tokens": 20, "stream": True})
+    assert response.status_code == 400
+    response = client.post("/invocations?target_tokens=many", data=text, content_type="text/plain")
+    assert response.status_code == 400
+    assert Gpt3Summarizer.summarize.call_count == calls
+
+    response = client.post("/invocations?target_tokens=20", data=text, content_type="text/plain")
+    assert response.status_code == 200
+
+
+def test_stream(client, sample_file):
+    with open(sample_file, "r") as file_obj:
+        text = file_obj.read()
+    num_of_chunks = len(list(SummarizerService.get_summarizer().chunker.chunk_generator_from_text(text, "n/a")))
+
+    for request in ({"json": {"text": text, "stream": True}},
+                    {"json": {"text": text}, "headers": {"Accept": "application/x-ndjson"}}):
+        response = client.post("/invocations", **request)
+        assert response.status_code == 200
+        assert response.mimetype == "application/x-ndjson"
+        records = [json.loads(line) for line in response.data.decode("utf-8").splitlines()]
+        chunk_records, final_record = records[:-1], records[-1]
+        assert sorted(record["chunk_id"] for record in chunk_records) == list(range(1, num_of_chunks + 1))
+        assert all(record["summary"] and record["num_of_tokens"] > 0 for record in chunk_records)
+        assert final_record["num_of_chunks"] == num_of_chunks
+        assert final_record["summary"] == " ".join(
+            record["summary"] for record in sorted(chunk_records, key=lambda record: record["chunk_id"])
+        )
+
+
+def test_stream_error(client, sample_file):
+    with open(sample_file, "r") as file_obj:
+        text = file_obj.read()
+    Gpt3Summarizer.summarize.side_effect = RuntimeError("OpenAI Error")
+
+    # The response has started, so the error is the last record rather than a status.
+    response = client.post("/invocations", json={"text": text, "stream": True})
+    assert response.status_code == 200
+    records = [json.loads(line) for line in response.data.decode("utf-8").splitlines()]
+    assert "summary" not in records[-1]
+    assert "Algorithm error" in records[-1]["error"]
+
+
+def test_metrics(client, sample_file):
+    with open(sample_file, "r") as file_obj:
+        client.post("/invocations", json={"text": file_obj.read()})
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type == CONTENT_TYPE_LATEST
+    body = response.data.decode("utf-8")
+    assert 'summarizer_stage_seconds_count{stage="chunk"}' in body
+    assert 'summarizer_stage_seconds_count{stage="summarize"}' in body
+    # By route and status, not by path.
+    assert 'summarizer_request_seconds_count{method="POST",route="/invocations",status="200"}' in body
+
+
+@fixture
+def admission(client, mocker):
+    """The admission controller of the test client, of a small budget, which rejects a request at once when full."""
+    admission = AdmissionController(budget_tokens=1000, max_queue=0, max_wait=0.1)
+    mocker.patch.object(SummarizerService, "_admission", admission)
+    return admission
+
+
+def test_admission(client, admission, sample_file):
+    with open(sample_file, "r") as file_obj:
+        text = file_obj.read()
+
+    with admission.admit(1000):
+        # No place in the queue.
+        response = client.post("/invocations", json={"text": text})
+        assert response.status_code == 503
+        assert int(response.headers["Retry-After"]) >= 1
+        response = client.post("/invocations", data=text, content_type="text/plain")
+        assert response.status_code == 503
+
+        # Queued, but not admitted in time.
+        admission.max_queue = 1
+        response = client.post("/invocations", json={"text": text, "stream": True})
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 1
+    assert admission.stats()["rejected"] == 3
+
+    # A streamed response holds its tokens until it is closed.
+    response = client.post("/invocations", json={"text": text, "stream": True}, buffered=False)
+    assert response.status_code == 200
+    assert admission.stats()["in_flight_tokens"] == SummarizerService.estimate_cost(len(text))
+    assert json.loads(response.get_data().decode("utf-8").splitlines()[-1])["summary"]
+    response.close()
+    assert admission.stats()["in_flight_tokens"] == 0
+
+
+def test_admission_released_on_error(client, admission, sample_file, mocker):
+    with open(sample_file, "r") as file_obj:
+        text = file_obj.read()
+    mocker.patch.object(SummarizerService, "stream_summary", side_effect=RuntimeError("Not streamed"))
+
+    # Admitted, but failed before the response was created.
+    response = client.post("/invocations", json={"text": text, "stream": True})
+    assert response.status_code == 500
+    assert admission.stats() == {"in_flight_tokens": 0, "waiting": 0, "admitted": 1, "rejected": 0}
+
+
+@fixture
+def jobs(client, tmp_path, mocker):
+    """The job runner of the test client, with a job store of this test only."""
+    mocker.patch("summarizer_service.job_store_file", os.path.join(tmp_path, "jobs.sqlite"))
+    mocker.patch.object(JobRunner, "_store", None)
+    mocker.patch.object(JobRunner, "_slots", threading.BoundedSemaphore(2))
+    return JobRunner
+
+
+def wait_for_job(client, job_id: str) -> Dict:
+    for _ in range(100):
+        job = json.loads(client.get(f"/jobs/{job_id}").data)
+        if job["status"] in (SUCCEEDED, FAILED):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Job {job_id} did not finish: {job}")
+
+
+def test_jobs(client, jobs):
+    response = client.post("/jobs", json={"text": "First chapter.\n\nIt has two paragraphs.", "doc_id": "1"})
+    assert response.status_code == 202
+    job_id = json.loads(response.data)["job_id"]
+    assert response.headers["Location"] == f"/jobs/{job_id}"
+    job = wait_for_job(client, job_id)
+    assert (job["status"], job["num_of_documents"], job["chunks_done"]) == (SUCCEEDED, 1, job["chunks_total"])
+    response = client.get(f"/jobs/{job_id}/result")
+    assert response.status_code == 200
+    assert response.mimetype == "application/jsonlines"
+    assert [json.loads(line) for line in response.data.decode("utf-8").splitlines()] == \
+           [{"doc_id": "1", "summary": "First chapter. It"}]
+
+    # A batch of documents, as JSON Lines.
+    batch = "\n".join(json.dumps({"text": f"Chapter {index}.", "doc_id": str(index)}) for index in range(3))
+    response = client.post("/jobs", data=batch, content_type="application/jsonlines")
+    assert response.status_code == 202
+    job_id = json.loads(response.data)["job_id"]
+    assert wait_for_job(client, job_id)["num_of_documents"] == 3
+    result = [json.loads(line) for line in client.get(f"/jobs/{job_id}/result").data.decode("utf-8").splitlines()]
+    assert [doc_sum["doc_id"] for doc_sum in result] == ["0", "1", "2"]
+
+
+def test_jobs_errors(client, jobs):
+    assert client.post("/jobs", data="text", content_type="text/plain").status_code == 415
+    assert client.post("/jobs", json={"doc_id": "1"}).status_code == 400
+    assert client.post("/jobs", data="{", content_type="application/json").status_code == 400
+    for document in (3, None, "a text", ["text"], {"text": 3}):
+        assert client.post("/jobs", data=json.dumps(document), content_type="application/json").status_code == 400
+    batch = "\n".join(json.dumps(document) for document in ({"text": "Chapter 1."}, 3, None, "text"))
+    assert client.post("/jobs", data=batch, content_type="application/jsonlines").status_code == 400
+    assert client.get("/jobs/unknown").status_code == 404
+    assert client.get("/jobs/unknown/result").status_code == 404
+
+    # The result of an unfinished job is a conflict, and the job queue of the worker holds two jobs.
+    release = threading.Event()
+    Gpt3Summarizer.summarize.side_effect = lambda text: release.wait(5) and "summary"
+    job_ids = [json.loads(client.post("/jobs", json={"text": f"Chapter {index}."}).data)["job_id"]
+               for index in range(2)]
+    response = client.get(f"/jobs/{job_ids[0]}/result")
+    assert response.status_code == 409
+    assert json.loads(response.data)["status"] in (QUEUED, RUNNING)
+    response = client.post("/jobs", json={"text": "Chapter 2."})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
+
+    release.set()
+    assert [wait_for_job(client, job_id)["status"] for job_id in job_ids] == [SUCCEEDED, SUCCEEDED]
+
+    # A failed job has its error.
+    Gpt3Summarizer.summarize.side_effect = RuntimeError("OpenAI Error")
+    job = wait_for_job(client, json.loads(client.post("/jobs", json={"text": "Chapter 3."}).data)["job_id"])
+    assert job["status"] == FAILED
+    assert "OpenAI Error" in job["error"]
+    assert client.get(f"/jobs/{job['job_id']}/result").status_code == 409
+
+
+def test_job_claimed_by_another_worker(client, jobs):
+    release = threading.Event()
+    Gpt3Summarizer.summarize.side_effect = lambda text: release.wait(5) and "summary"
+    job_id = json.loads(client.post("/jobs", json={"text": "Chapter 1.\n\nChapter 2."}).data)["job_id"]
+    for _ in range(100):
+        if json.loads(client.get(f"/jobs/{job_id}").data)["status"] == RUNNING:
+            break
+        time.sleep(0.05)
+
+    # Claimed by another worker while running, e.g., after this one missed its lease: this one stops running it.
+    conn = sqlite3.connect(jobs.get_store().db_file)
+    conn.execute("UPDATE job SET owner = 'another-worker' WHERE id = ?", (job_id,))
+    conn.commit()
+    conn.close()
+    release.set()
+    time.sleep(0.3)
+    job = json.loads(client.get(f"/jobs/{job_id}").data)
+    assert (job["status"], job["chunks_done"]) == (RUNNING, 0)
+    assert client.get(f"/jobs/{job_id}/result").status_code == 409
+
+
+def test_job_admission(client, jobs, admission, mocker):
+    shrink_text = mocker.spy(TextSummarizer, "shrink_text")
+    mocker.patch.object(admission, "retry_after", return_value=0.1)
+    with admission.admit(1000):
+        # Rejected while the worker is full, the job waits for its admission instead of failing.
+        job_id = json.loads(client.post("/jobs", json={"text": "Chapter 1.", "doc_id": "1"}).data)["job_id"]
+        time.sleep(0.3)
+        job = json.loads(client.get(f"/jobs/{job_id}").data)
+        assert (job["status"], job["chunks_done"], job["chunks_total"]) == (RUNNING, 0, 0)
+    job = wait_for_job(client, job_id)
+    assert (job["status"], job["chunks_done"], job["chunks_total"]) == (SUCCEEDED, 1, 1)
+    assert shrink_text.call_args.args[1:] == ("Chapter 1.", "1")
+    assert admission.stats()["in_flight_tokens"] == 0
+
+
+def test_asgi_text_stream(client, sample_file, mocker):
+    with open(sample_file, "rb") as file_obj:
+        data = file_obj.read()
+
+    async def asummarize(text):
+        return Gpt3Summarizer.summarize(text)
+
+    mocker.patch.object(Gpt3Summarizer, "asummarize", side_effect=asummarize)
+    messages = []
+
+    async def call(content_type: bytes, query_string: bytes, body: bytes):
+        # The body is received in small parts, while the first chunks are summarized.
+        parts = [body[start:start + 1000] for start in range(0, len(body), 1000)]
+        received = iter([{"type": "http.request", "body": part, "more_body": i < len(parts) - 1}
+                          for i, part in enumerate(parts)])
+
+        async def receive():
+            await asyncio.sleep(0)
+            return next(received)
+
+        async def send(message):
+            messages.append(message)
+
+        messages.clear()
+        scope = {"type": "http", "path": "/invocations", "method": "POST", "query_string": query_string,
+                 "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())]}
+        await asgi.app(scope, receive, send)
+        return messages[0]["status"], messages[1]["body"]
+
+    expected = client.post("/invocations?doc_id=1", data=data, content_type="text/plain").data
+    assert asyncio.run(call(b"text/plain", b"doc_id=1", data)) == (200, expected)
+    assert asyncio.run(call(b"text/plain; charset=utf-16", b"", data.decode("utf-8").encode("utf-16"))) == \
+           (200, expected)
+    assert asyncio.run(call(b"text/plain", b"target_tokens=20", data))[0] == 200
+    assert asyncio.run(call(b"text/plain", b"target_tokens=many", data))[0] == 400
+    assert asyncio.run(call(b"application/xml", b"", data))[0] == 415
+
+
+def test_asgi_jobs(client, jobs):
+    async def call(method: str, path: str, content_type: bytes = b"application/json", body: bytes = b""):
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {"type": "http", "path": path, "method": method, "query_string": b"",
+                 "headers": [(b"content-type", content_type)]}
+        await asgi.app(scope, receive, send)
+        return messages[0]["status"], dict(messages[0]["headers"]), messages[1]["body"]
+
+    status, headers, body = asyncio.run(call("POST", "/jobs", body=b'{"text": "First chapter.", "doc_id": "1"}'))
+    assert status == 202
+    job_id = json.loads(body)["job_id"]
+    assert headers[b"location"] == f"/jobs/{job_id}".encode()
+    for _ in range(100):
+        status, _, body = asyncio.run(call("GET", f"/jobs/{job_id}"))
+        if json.loads(body)["status"] == SUCCEEDED:
+            break
+        time.sleep(0.05)
+    assert status == 200
+    status, headers, body = asyncio.run(call("GET", f"/jobs/{job_id}/result"))
+    assert (status, headers[b"content-type"]) == (200, b"application/jsonlines")
+    assert body == client.get(f"/jobs/{job_id}/result").data
+
+    batch = b'{"text": "Chapter 1."}\n{"text": "Chapter 2."}'
+    assert asyncio.run(call("POST", "/jobs", b"application/jsonlines", batch))[0] == 202
+    assert asyncio.run(call("POST", "/jobs", b"text/plain", b"text"))[0] == 415
+    assert asyncio.run(call("POST", "/jobs", body=b'{"text": 3}'))[0] == 400
+    assert asyncio.run(call("POST", "/jobs", body=b"{"))[0] == 400
+    assert asyncio.run(call("GET", "/jobs/unknown"))[0] == 404
+    assert asyncio.run(call("GET", "/jobs/unknown/result"))[0] == 404
+    assert asyncio.run(call("GET", "/jobs/unknown/other"))[0] == 404
+
+    metrics_text = client.get("/metrics").data.decode("utf-8")
+    assert 'route="/jobs/<job_id>/result"' in metrics_text
+    assert job_id not in metrics_text
@@ -0,0 +1,67 @@
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from pytest import raises
+from summarizer.model.single_flight import SingleFlight
+from summarizer.model.coalescing_summarizer import CoalescingSummarizer
+from summarizer.model.summarizer import SummarizerFactory
+
+
+def test_single_flight():
+    flights = SingleFlight(ttl=0.2)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.1)
+        return "value"
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        values = list(executor.map(lambda _: flights.do("key", compute), range(8)))
+    assert values == ["value"] * 8
+    assert len(calls) == 1
+    assert flights.stats()["coalesced"] == 7
+
+    # The value is cached for ttl seconds only.
+    assert flights.do("key", compute) == "value"
+    assert flights.hits == 1
+    time.sleep(0.2)
+    assert flights.do("key", compute) == "value"
+    assert len(calls) == 2
+
+    # Errors are raised to every waiter, and not cached.
+    def fail():
+        raise RuntimeError("OpenAI Error")
+
+    with raises(RuntimeError):
+        flights.do("other", fail)
+    assert flights.do("other", compute) == "value"
+
+
+def test_single_flight_async():
+    flights = SingleFlight(ttl=60)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return "value"
+
+    async def main():
+        return await asyncio.gather(*(flights.ado("key", compute) for _ in range(8)))
+
+    assert asyncio.run(main()) == ["value"] * 8
+    assert len(calls) == 1
+
+
+def test_coalescing_summarizer(mocker):
+    gpt3_summarizer = SummarizerFactory.create_summarizer("gpt3")
+    mock_summarize_many = mocker.patch("summarizer.model.gpt3_summarizer.Gpt3Summarizer.summarize_many")
+    mock_summarize_many.side_effect = lambda texts: [f"summary of {text}" for text in texts]
+    summarizer = CoalescingSummarizer(gpt3_summarizer, SingleFlight(ttl=60))
+
+    texts = ["chunk 1", "chunk 2", "chunk 1"]
+    assert summarizer.summarize_many(texts) == [f"summary of {text}" for text in texts]
+    mock_summarize_many.assert_called_once_with(["chunk 1", "chunk 2"])
+    assert summarizer.summarize_many(["chunk 2", "chunk 3"]) == ["summary of chunk 2", "summary of chunk 3"]
+    mock_summarize_many.assert_called_with(["chunk 3"])
@@ -1,7 +1,9 @@
 import os.path
+import time
+import asyncio
 from pytest import raises
 from summarizer.model.summarizer import SummarizerFactory, TextSummarizer
-from summarizer.model.gpt3_summarizer import count_tokens
+from summarizer.model.gpt3_summarizer import Gpt3Summarizer, count_tokens
 
 MOCKED_SUMMARY = ["mocked summary " + str(i + 1) for i in range(4)]
 
@@ -9,15 +11,226 @@ MOCKED_SUMMARY = ["mocked summary " + str(i + 1) for i in range(4)]
 def test_text_summarizer(sample_file, mocker):
     gpt3_summarizer = SummarizerFactory.create_summarizer("gpt3")
     gpt3_summarizer.text_tokens = 100
+    gpt3_summarizer.batch_size = 3
+    summaries = iter(MOCKED_SUMMARY)
 
-    mock_summarizer = mocker.patch("summarizer.model.gpt3_summarizer.Gpt3Summarizer.summarize")
-    mock_summarizer.side_effect = MOCKED_SUMMARY
+    def mocked_create(prompt, **_):
+        if isinstance(prompt, str):
+            return {"choices": [{"index": 0, "text": next(summaries)}]}
+        # The choices of a batch are mapped back to its prompts by index, whatever their order.
+        choices = [{"index": index, "text": next(summaries)} for index in range(len(prompt))]
+        return {"choices": choices[::-1]}
+
+    mock_create = mocker.patch("openai.Completion.create")
+    mock_create.side_effect = mocked_create
     text_summarizer = TextSummarizer(gpt3_summarizer)
 
     with open(sample_file, "r") as file_obj:
         text = file_obj.read()
         summary = text_summarizer.summarize_text(text)
         assert summary == " ".join(MOCKED_SUMMARY)
+    assert mock_create.call_count == 2
+    assert len(mock_create.call_args_list[0].kwargs["prompt"]) == 3
+
+
+def test_text_summarizer_concurrent(sample_file, mocker):
+    gpt3_summarizer = SummarizerFactory.create_summarizer("gpt3")
+    gpt3_summarizer.text_tokens = 100
+
+    def mocked_summarize(chunk_text):
+        # Finish the earlier chunks last, so that summaries complete out of chunk order.
+        index = text.find(chunk_text.split()[0])
+        time.sleep(0.2 * (1.0 - index / len(text)))
+        return f"summary of {index}"
+
+    mock_summarizer = mocker.patch("summarizer.model.gpt3_summarizer.Gpt3Summarizer.summarize")
+    mock_summarizer.side_effect = mocked_summarize
+    text_summarizer = TextSummarizer(gpt3_summarizer, max_workers=4)
+
+    with open(sample_file, "r") as file_obj:
+        text = file_obj.read()
+    sequential_summary = " ".join(
+        mocked_summarize(chunk.text()) for chunk in text_summarizer.chunker.chunk_generator_from_text(text, "n/a")
+    )
+
+    start = time.time()
+    summary = text_summarizer.summarize_text(text)
+    assert summary == sequential_summary
+    assert mock_summarizer.call_count == 4
+    assert time.time() - start < 0.4
+
+
+def test_text_summarizer_async(sample_file, mocker):
+    gpt3_summarizer = SummarizerFactory.create_summarizer("gpt3")
+    gpt3_summarizer.text_tokens = 100
+
+    async def mocked_asummarize(_, chunk_text):
+        await asyncio.sleep(0.1)
+        return f"summary of {len(chunk_text)}"
+
+    mocker.patch.object(Gpt3Summarizer, "asummarize", new=mocked_asummarize)
+    text_summarizer = TextSummarizer(gpt3_summarizer, max_workers=4)
+
+    with open(sample_file, "r") as file_obj:
+        text = file_obj.read()
+    expected_summary = " ".join(
+        f"summary of {len(chunk.text())}" for chunk in text_summarizer.chunker.chunk_generator_from_text(text, "n/a")
+    )
+
+    start = time.time()
+    summary = asyncio.run(text_summarizer.asummarize_text(text))
+    assert summary == expected_summary
+    assert time.time() - start < 0.2
+
+
+def test_text_summarizer_async_batches(sample_file, mocker):
+    gpt3_summarizer = SummarizerFactory.create_summarizer("gpt3")
+    gpt3_summarizer.text_tokens = 100
+    gpt3_summarizer.batch_size = 3
+    summaries = iter(MOCKED_SUMMARY)
+
+    async def mocked_acreate(prompt, **_):
+        await asyncio.sleep(0.05)
+        if isinstance(prompt, str):
+            return {"choices": [{"index": 0, "text": next(summaries)}]}
+        choices = [{"index": index, "text": next(summaries)} for index in range(len(prompt))]
+        return {"choices": choices[::-1]}
+
+    mock_acreate = mocker.patch("openai.Completion.acreate", side_effect=mocked_acreate)
+    text_summarizer = TextSummarizer(gpt3_summarizer)
+
+    with open(sample_file, "r") as file_obj:
+        text = file_obj.read()
+    assert asyncio.run(text_summarizer.asummarize_text(text)) == " ".join(MOCKED_SUMMARY)
+    # The first chunk is sent at once, the next ones are batched while it is summarized.
+    assert [len(call.kwargs["prompt"]) if isinstance(call.kwargs["prompt"], list) else 1
+            for call in mock_acreate.call_args_list] == [1, 3]
+
+
+def test_async_chunking_off_the_loop(sample_file, mocker):
+    gpt3_summarizer = SummarizerFactory.create_summarizer("gpt3")
+    gpt3_summarizer.text_tokens = 100
+
+    async def mocked_asummarize(_, chunk_text):
+        return "summary"
+
+    mocker.patch.object(Gpt3Summarizer, "asummarize", new=mocked_asummarize)
+    text_summarizer = TextSummarizer(gpt3_summarizer, max_workers=4)
+    with open(sample_file, "r") as file_obj:
+        chunks = list(text_summarizer.chunker.chunk_generator_from_text(file_obj.read(), "n/a"))
+
+    def slow_chunks():
+        # Blocking work, e.g., tokenizing a long document, between the chunks.
+        for chunk in chunks:
+            time.sleep(0.05)
+            yield chunk
+
+    async def run():
+        ticks = []
+
+        async def tick():
+            while True:
+                ticks.append(time.perf_counter())
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.ensure_future(tick())
+        summaries = await text_summarizer.amap_chunks(slow_chunks())
+        ticker.cancel()
+        return summaries, ticks
+
+    summaries, ticks = asyncio.run(run())
+    assert summaries == ["summary"] * len(chunks)
+    # The event loop kept serving the ticker while the chunks were produced.
+    assert len(ticks) >= 2 * len(chunks)
+
+
+def test_iter_chunk_summaries(sample_file, mocker):
+    gpt3_summarizer = SummarizerFactory.create_summarizer("gpt3")
+    gpt3_summarizer.text_tokens = 100
+
+    def mocked_summarize(chunk_text):
+        # The longer the chunk, the later its summary is ready.
+        time.sleep(len(chunk_text) / 5000)
+        return f"summary of {len(chunk_text)}"
+
+    mock_summarizer = mocker.patch("summarizer.model.gpt3_summarizer.Gpt3Summarizer.summarize")
+    mock_summarizer.side_effect = mocked_summarize
+    text_summarizer = TextSummarizer(gpt3_summarizer, max_workers=4)
+
+    with open(sample_file, "r") as file_obj:
+        text = file_obj.read()
+    chunks = list(text_summarizer.chunker.chunk_generator_from_text(text, "n/a"))
+
+    chunk_sums = list(text_summarizer.iter_chunk_summaries(text))
+    assert sorted(chunk_sum.chunk_id for chunk_sum in chunk_sums) == [chunk.id for chunk in chunks]
+    assert [chunk_sum.summary for chunk_sum in chunk_sums] == \
+           [mocked_summarize(chunk.text()) for chunk in sorted(chunks, key=lambda chunk: len(chunk.text()))]
+    for chunk_sum in chunk_sums:
+        assert chunk_sum.num_of_tokens == chunks[chunk_sum.chunk_id - 1].num_of_tokens
+        assert chunk_sum.seconds > 0
+
+
+def test_iter_summaries_bounded(sample_file, mocker):
+    gpt3_summarizer = SummarizerFactory.create_summarizer("gpt3")
+    gpt3_summarizer.text_tokens = 20
+
+    def mocked_summarize(chunk_text):
+        time.sleep(0.01)
+        return "summary"
+
+    mocker.patch("summarizer.model.gpt3_summarizer.Gpt3Summarizer.summarize").side_effect = mocked_summarize
+    text_summarizer = TextSummarizer(gpt3_summarizer, max_workers=2)
+    with open(sample_file, "r") as file_obj:
+        chunks = list(text_summarizer.chunker.chunk_generator_from_text(file_obj.read(), "n/a"))
+    assert len(chunks) > 8
+
+    # The chunks are pulled as summaries are ready, at most 2 * max_workers ahead of them.
+    pulled = []
+
+    def pull():
+        for chunk in chunks:
+            pulled.append(chunk.id)
+            yield chunk
+
+    summaries = 0
+    for _ in text_summarizer.iter_summaries(pull()):
+        summaries += 1
+        assert len(pulled) - summaries <= 2 * 2
+    assert summaries == len(chunks)
+
+
+def test_hierarchical_summarization(resource_path, mocker):
+    gpt3_summarizer = SummarizerFactory.create_summarizer("gpt3")
+    gpt3_summarizer.text_tokens = 200
+    gpt3_summarizer.batch_size = 1
+
+    def mocked_summarize(chunk_text):
+        # Keep a quarter of the words, i.e., a 4:1 compression of each chunk.
+        words = chunk_text.split()
+        return " ".join(words[:max(1, len(words) // 4)])
+
+    async def mocked_asummarize(_, chunk_text):
+        return mocked_summarize(chunk_text)
+
+    mock_summarizer = mocker.patch("summarizer.model.gpt3_summarizer.Gpt3Summarizer.summarize")
+    mock_summarizer.side_effect = mocked_summarize
+    mocker.patch.object(Gpt3Summarizer, "asummarize", new=mocked_asummarize)
+    text_summarizer = TextSummarizer(gpt3_summarizer, max_workers=4)
+
+    with open(os.path.join(resource_path, "chapter", "01.txt"), "r") as file_obj:
+        text = file_obj.read()
+
+    flat_summary = text_summarizer.summarize_text(text)
+    flat_calls = mock_summarizer.call_count
+    assert count_tokens(flat_summary) > 150
+
+    summary = text_summarizer.summarize_text(text, target_tokens=150)
+    assert count_tokens(summary) <= 150
+    assert mock_summarizer.call_count > 2 * flat_calls
+    print(f"Summary calls, flat: {flat_calls}, hierarchical: {mock_summarizer.call_count - flat_calls}")
+    assert summary.split()[0] == flat_summary.split()[0]
+
+    assert asyncio.run(text_summarizer.asummarize_text(text, target_tokens=150)) == summary
 
 
 def test_max_tokens(resource_path):
@@ -63,3 +276,72 @@ def test_count_tokens():
     assert count_tokens(text1) == 43
     assert count_tokens(text2) == 26
     assert count_tokens(text3) == 86
+
+
+def test_aiter_chunk_summaries_bounded(sample_file, mocker):
+    gpt3_summarizer = SummarizerFactory.create_summarizer("gpt3")
+    gpt3_summarizer.text_tokens = 20
+
+    async def mocked_asummarize(_, chunk_text):
+        await asyncio.sleep(0.01)
+        return "summary"
+
+    mocker.patch.object(Gpt3Summarizer, "asummarize", new=mocked_asummarize)
+    text_summarizer = TextSummarizer(gpt3_summarizer, max_workers=2)
+    with open(sample_file, "r") as file_obj:
+        text = file_obj.read()
+    chunks = list(text_summarizer.chunker.chunk_generator_from_text(text, "n/a"))
+    assert len(chunks) > 8
+
+    # The chunks are pulled as summaries are ready, at most 2 * max_workers ahead of them.
+    pulled = []
+
+    def pull(*_):
+        for chunk in chunks:
+            pulled.append(chunk.id)
+            yield chunk
+
+    mocker.patch.object(text_summarizer.chunker, "chunk_generator_from_text", side_effect=pull)
+
+    async def run():
+        summaries = 0
+        first_pulled = None
+        async for _ in text_summarizer.aiter_chunk_summaries(text):
+            summaries += 1
+            first_pulled = first_pulled or len(pulled)
+            assert len(pulled) - summaries <= 2 * 2
+        return summaries, first_pulled
+
+    summaries, first_pulled = asyncio.run(run())
+    assert summaries == len(chunks)
+    # The first summary is yielded while the rest of the text is chunked.
+    assert first_pulled < len(chunks)
+
+
+def test_amap_chunks_bounded(sample_file, mocker):
+    gpt3_summarizer = SummarizerFactory.create_summarizer("gpt3")
+    gpt3_summarizer.text_tokens = 20
+    gpt3_summarizer.batch_size = 1
+    with open(sample_file, "r") as file_obj:
+        chunks = list(TextSummarizer(gpt3_summarizer).chunker.chunk_generator_from_text(file_obj.read(), "n/a"))
+    assert len(chunks) > 8
+
+    # The chunks are pulled as batches are summarized, at most 2 * max_workers batches ahead of them, and the batch
+    # waiting for a place.
+    pulled = []
+    summarized = []
+
+    def pull():
+        for chunk in chunks:
+            pulled.append(chunk.id)
+            yield chunk
+
+    async def mocked_asummarize_many(_, chunk_texts):
+        assert len(pulled) - len(summarized) <= 2 * 2 + 1
+        await asyncio.sleep(0.01)
+        summarized.extend(chunk_texts)
+        return ["summary"] * len(chunk_texts)
+
+    mocker.patch.object(Gpt3Summarizer, "asummarize_many", new=mocked_asummarize_many)
+    text_summarizer = TextSummarizer(gpt3_summarizer, max_workers=2)
+    assert asyncio.run(text_summarizer.amap_chunks(pull())) == ["summary"] * len(chunks)
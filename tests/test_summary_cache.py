@@ -0,0 +1,107 @@
+import os
+import asyncio
+import sqlite3
+from summarizer.dao.summary_cache import SummaryCache
+from summarizer.model.cached_summarizer import CachedSummarizer
+from summarizer.model.summarizer import SummarizerFactory
+
+
+def test_summary_cache(tmp_path):
+    cache_file = os.path.join(tmp_path, "cache.sqlite")
+    cache = SummaryCache(cache_file, max_bytes=70)
+
+    assert cache.get("a") is None
+    cache.put("a", "x" * 30)
+    cache.put("b", "y" * 30)
+    assert cache.get("a") == "x" * 30
+    assert cache.hits == 1 and cache.misses == 1
+
+    # "b" is the least recently used one, so it is evicted to make room for "c".
+    cache.put("c", "z" * 30)
+    assert cache.get("b") is None
+    assert cache.get("c") == "z" * 30
+    assert cache.size() <= 70
+    assert len(cache) == 2
+    cache.close()
+
+    cache = SummaryCache(cache_file, max_bytes=70)
+    assert cache.get("a") == "x" * 30
+    assert cache.stats()["entries"] == 2
+
+
+def test_summary_cache_lru_eviction(tmp_path):
+    cache_file = os.path.join(tmp_path, "cache.sqlite")
+    cache = SummaryCache(cache_file, max_bytes=1000)
+    keys = [f"key-{index:02d}" for index in range(40)]  # 6 bytes of key and 44 of summary: 50 bytes each
+    for key in keys[:20]:
+        cache.put(key, "s" * 44)
+    assert cache.size() == 1000
+
+    # Touch the oldest ten, so that the next ten are the least recently used ones.
+    for key in keys[:10]:
+        assert cache.get(key) is not None
+    for key in keys[20:30]:
+        cache.put(key, "s" * 44)
+    assert cache.size() == 1000
+    assert [key for key in keys if cache.get(key) is not None] == keys[:10] + keys[20:30]
+
+    # Replacing a summary accounts for the size of the replaced one.
+    cache.put(keys[0], "s" * 4)
+    assert cache.size() == 960
+    assert cache.size() == sum(6 + len(cache.get(key)) for key in keys if cache.get(key) is not None)
+    cache.close()
+
+    # The total of a cache file written before it was kept is summed once, on open.
+    conn = sqlite3.connect(cache_file)
+    conn.execute("DROP TABLE summary_total")
+    conn.commit()
+    conn.close()
+    assert SummaryCache(cache_file, max_bytes=1000).size() == 960
+
+
+def test_cached_summarizer(tmp_path, mocker):
+    gpt3_summarizer = SummarizerFactory.create_summarizer("gpt3")
+    mock_summarize = mocker.patch("summarizer.model.gpt3_summarizer.Gpt3Summarizer.summarize")
+    mock_summarize.side_effect = lambda text: f"summary of {text}"
+    cached_summarizer = CachedSummarizer(gpt3_summarizer, SummaryCache(os.path.join(tmp_path, "cache.sqlite")))
+
+    assert cached_summarizer.summarize("chunk 1") == "summary of chunk 1"
+    assert cached_summarizer.summarize("chunk 1") == "summary of chunk 1"
+    assert cached_summarizer.summarize("chunk 2") == "summary of chunk 2"
+    assert mock_summarize.call_count == 2
+    assert cached_summarizer.cache.hits == 1
+
+    key = cached_summarizer.cache_key("chunk 1")
+    gpt3_summarizer.temperature += 0.1
+    assert cached_summarizer.cache_key("chunk 1") != key
+    assert cached_summarizer.summarize("chunk 1") == "summary of chunk 1"
+    assert mock_summarize.call_count == 3
+
+
+def test_cached_summarizer_many(tmp_path, mocker):
+    gpt3_summarizer = SummarizerFactory.create_summarizer("gpt3")
+    mock_summarize_many = mocker.patch("summarizer.model.gpt3_summarizer.Gpt3Summarizer.summarize_many")
+    mock_summarize_many.side_effect = lambda texts: [f"summary of {text}" for text in texts]
+    cached_summarizer = CachedSummarizer(gpt3_summarizer, SummaryCache(os.path.join(tmp_path, "cache.sqlite")))
+
+    texts = ["chunk 1", "chunk 2", "chunk 3"]
+    assert cached_summarizer.summarize_many(texts[:2]) == ["summary of chunk 1", "summary of chunk 2"]
+    assert cached_summarizer.summarize_many(texts) == [f"summary of {text}" for text in texts]
+    mock_summarize_many.assert_called_with(["chunk 3"])
+    assert cached_summarizer.batch_size == gpt3_summarizer.batch_size
+
+
+def test_cached_summarizer_async_many(tmp_path, mocker):
+    gpt3_summarizer = SummarizerFactory.create_summarizer("gpt3")
+
+    async def asummarize_many(texts):
+        return [f"summary of {text}" for text in texts]
+
+    mock_asummarize_many = mocker.patch("summarizer.model.gpt3_summarizer.Gpt3Summarizer.asummarize_many",
+                                        side_effect=asummarize_many)
+    cached_summarizer = CachedSummarizer(gpt3_summarizer, SummaryCache(os.path.join(tmp_path, "cache.sqlite")))
+
+    texts = ["chunk 1", "chunk 2", "chunk 3"]
+    assert asyncio.run(cached_summarizer.asummarize_many(texts[:2])) == ["summary of chunk 1", "summary of chunk 2"]
+    assert asyncio.run(cached_summarizer.asummarize_many(texts)) == [f"summary of {text}" for text in texts]
+    mock_asummarize_many.assert_called_with(["chunk 3"])
@@ -0,0 +1,50 @@
+from typing import List
+from summarizer.model.token_counter import TokenCounter, TokenizerBackend, Gpt2TokenizerBackend, TOKEN_COUNTER
+
+
+class WordCountBackend(TokenizerBackend):
+    def __init__(self):
+        self.calls: List[List[str]] = []
+
+    def count_batch(self, texts: List[str]) -> List[int]:
+        self.calls.append(texts)
+        return [len(text.split()) for text in texts]
+
+
+def test_count_batch(sample_file):
+    with open(sample_file, "r") as file_obj:
+        texts = file_obj.read().split("\n\n")
+
+    backend = Gpt2TokenizerBackend()
+    assert TOKEN_COUNTER.count_batch(texts) == [backend.count_batch([text])[0] for text in texts]
+
+
+def test_lazy_tokenizer():
+    backend = Gpt2TokenizerBackend()
+    assert backend._tokenizer is None
+    assert TokenCounter(backend).count("As a rough rule of thumb, 1 token is approximately 4 characters.") == 14
+    assert backend._tokenizer is not None
+
+
+def test_token_counter_memoization():
+    backend = WordCountBackend()
+    token_counter = TokenCounter(backend, cache_size=3)
+
+    assert token_counter.count_batch(["a b", "c", "a b"]) == [2, 1, 2]
+    assert backend.calls == [["a b", "c"]]
+    assert token_counter.count("c") == 1
+    assert len(backend.calls) == 1
+
+    assert token_counter.count_batch(["d e f", "g h i j"]) == [3, 4]
+    # "a b" is the least recently used one, so it has been evicted.
+    assert token_counter.count("a b") == 2
+    assert backend.calls[-1] == ["a b"]
+
+
+def test_iter_with_counts():
+    backend = WordCountBackend()
+    token_counter = TokenCounter(backend)
+    texts = [" ".join(["w"] * i) for i in range(1, 8)]
+
+    assert list(token_counter.iter_with_counts(iter(texts), batch_size=3)) == list(zip(texts, range(1, 8)))
+    assert [len(batch) for batch in backend.calls] == [3, 3, 1]